@@ -0,0 +1,192 @@
+"""Dataroom sharing and materialized permissions.
+
+Owners share a dataroom, or a folder subtree within it, by granting a user
+the viewer or editor role (`Grant`). Grants are not evaluated per request:
+they are materialized into `Permission` rows keyed by (user, dataroom, path
+prefix), where the prefix is the granted folder's path ('' for the whole
+dataroom) and the owner holds an owner row at ''. Checking access to an item
+in folder /a/b is a primary-key lookup of the prefixes '', /a and /a/b, and
+listings filter with an indexed EXISTS against the same table.
+
+Permission rows follow the tree: grant changes rebuild a user's rows in the
+dataroom, folder renames and moves rewrite prefixes in place, and deleting
+a folder drops the grants and permissions below it. `flask permissions-rebuild`
+recomputes everything from owners and grants.
+"""
+
+from typing import Optional
+
+from sqlalchemy import select, delete, insert, update, func, or_, exists, literal
+
+from models import db, DataRoom, Folder, Grant, Permission
+
+VIEWER = 1  # Read files and folders
+EDITOR = 2  # Also upload, rename, move and delete
+OWNER = 3  # Also manage the dataroom and its members
+
+ROLES = {"viewer": VIEWER, "editor": EDITOR, "owner": OWNER}
+ROLE_NAMES = {level: role for role, level in ROLES.items()}
+
+
+def path_prefixes(path: Optional[str]) -> list[str]:
+    """List the permission prefixes covering a folder path (None for the dataroom root)."""
+    prefixes = [""]
+    if path:
+        end = path.find("/", 1)
+        while end != -1:
+            prefixes.append(path[:end])
+            end = path.find("/", end + 1)
+        prefixes.append(path)
+    return prefixes
+
+
+def folder_name_error(name) -> Optional[str]:
+    """Check a new folder name; returns why it is invalid, or None if it is valid.
+
+    Folder paths double as permission prefixes, so a name with a "/" would
+    let a rename move a subtree, and the grants below it, onto the path of
+    another folder.
+    """
+    if not isinstance(name, str) or not name.strip():
+        return "Folder name is required"
+    if "/" in name or name in (".", ".."):
+        return 'Folder names cannot contain "/" or be "." or ".."'
+    return None
+
+
+def get_access_level(user_id: int, dataroom_id: int, path: Optional[str] = None) -> int:
+    """Get a user's level for items in a folder path of a dataroom (0 for no access)."""
+    level = db.session.execute(
+        select(func.max(Permission.level)).where(
+            Permission.user_id == user_id,
+            Permission.dataroom_id == dataroom_id,
+            Permission.path_prefix.in_(path_prefixes(path)),
+        )
+    ).scalar()
+    return level or 0
+
+
+def has_access(user_id: int, dataroom_id: int, required: int, path: Optional[str] = None) -> bool:
+    """Check whether a user has at least `required` for items in a folder path."""
+    return get_access_level(user_id, dataroom_id, path) >= required
+
+
+def folder_path(item) -> Optional[str]:
+    """Folder path governing access to a file or folder (None at the dataroom root)."""
+    if isinstance(item, Folder):
+        return item.path
+    return item.folder.path if item.folder_id else None
+
+
+def get_user_prefixes(user_id: int, dataroom_id: int) -> dict[str, int]:
+    """Get a user's permission prefixes in a dataroom with their levels."""
+    return dict(db.session.execute(
+        select(Permission.path_prefix, Permission.level)
+        .where(Permission.user_id == user_id, Permission.dataroom_id == dataroom_id)
+    ).all())
+
+
+def level_at(prefixes: dict[str, int], path: Optional[str]) -> int:
+    """Resolve the level for a folder path from prefixes loaded with get_user_prefixes."""
+    return max((prefixes.get(prefix, 0) for prefix in path_prefixes(path)), default=0)
+
+
+def accessible(user_id: int, dataroom_column, path_column, required: int = VIEWER):
+    """SQL condition: the user has `required` for rows with this dataroom and folder path.
+
+    `path_column` is the path of the folder holding the row (NULL at the
+    dataroom root, which only a dataroom-wide permission covers).
+    """
+    return exists().where(
+        Permission.user_id == user_id,
+        Permission.dataroom_id == dataroom_column,
+        Permission.level >= required,
+        or_(
+            Permission.path_prefix == "",
+            path_column == Permission.path_prefix,
+            func.substr(path_column, 1, func.length(Permission.path_prefix) + 1) == Permission.path_prefix + "/",
+        ),
+    )
+
+
+def get_permission_version(user_id: int) -> int:
+    """Fingerprint of a user's permissions, part of every response cache key."""
+    rows = db.session.execute(
+        select(Permission.dataroom_id, Permission.path_prefix, Permission.level)
+        .where(Permission.user_id == user_id)
+        .order_by(Permission.dataroom_id, Permission.path_prefix)
+    ).all()
+    return hash(tuple(tuple(row) for row in rows))
+
+
+def rebuild_permissions(dataroom_id: int, user_id: int) -> None:
+    """Recompute a user's permissions in a dataroom from its owner and grants."""
+    db.session.execute(
+        delete(Permission).where(Permission.user_id == user_id, Permission.dataroom_id == dataroom_id)
+    )
+
+    levels = {}
+    owner_id = db.session.execute(select(DataRoom.owner_id).where(DataRoom.id == dataroom_id)).scalar()
+    if owner_id == user_id:
+        levels[""] = OWNER
+    grants = db.session.execute(
+        select(Grant.role, Folder.path)
+        .outerjoin(Folder, Grant.folder_id == Folder.id)
+        .where(Grant.dataroom_id == dataroom_id, Grant.user_id == user_id)
+    )
+    for role, path in grants:
+        prefix = path or ""
+        levels[prefix] = max(levels.get(prefix, 0), ROLES[role])
+
+    if levels:
+        db.session.execute(insert(Permission), [
+            {"user_id": user_id, "dataroom_id": dataroom_id, "path_prefix": prefix, "level": level}
+            for prefix, level in levels.items()
+        ])
+
+
+def rebuild_all_permissions() -> int:
+    """Recompute every permission from owners and grants; returns the number of rows."""
+    db.session.execute(delete(Permission))
+    db.session.execute(
+        insert(Permission).from_select(
+            ["user_id", "dataroom_id", "path_prefix", "level"],
+            select(DataRoom.owner_id, DataRoom.id, literal(""), literal(OWNER)),
+        )
+    )
+    pairs = db.session.execute(select(Grant.dataroom_id, Grant.user_id).distinct()).all()
+    for dataroom_id, user_id in pairs:
+        rebuild_permissions(dataroom_id, user_id)
+    return db.session.execute(select(func.count()).select_from(Permission)).scalar()
+
+
+def move_permission_prefixes(dataroom_id: int, old_path: str, new_path: str) -> None:
+    """Rewrite permission prefixes after a folder subtree changed path."""
+    db.session.execute(
+        update(Permission)
+        .where(
+            Permission.dataroom_id == dataroom_id,
+            or_(Permission.path_prefix == old_path, Permission.path_prefix.startswith(f"{old_path}/", autoescape=True)),
+        )
+        .values(path_prefix=literal(new_path) + func.substr(Permission.path_prefix, len(old_path) + 1))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def drop_subtree_permissions(dataroom_id: int, path: str) -> None:
+    """Remove grants and permissions on a folder subtree that is being deleted."""
+    subtree_ids = select(Folder.id).where(
+        Folder.dataroom_id == dataroom_id,
+        or_(Folder.path == path, Folder.path.startswith(f"{path}/", autoescape=True)),
+    )
+    db.session.execute(
+        delete(Grant).where(Grant.folder_id.in_(subtree_ids)).execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(Permission)
+        .where(
+            Permission.dataroom_id == dataroom_id,
+            or_(Permission.path_prefix == path, Permission.path_prefix.startswith(f"{path}/", autoescape=True)),
+        )
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,392 @@
+"""Admission control of expensive endpoints.
+
+Content search, uploads (with inline extraction) and full-tree structure
+listings each hold a worker thread for a long time, so a single user
+repeating them could occupy every worker. Views decorated with
+`@admission_control(endpoint)` are admitted in three steps, each configured
+per endpoint in ADMISSION_LIMITS (0 disables a step):
+
+- a token bucket per user limits the request rate: `rate` tokens per
+  second, up to `burst`. Over the rate, 429 with Retry-After set to when
+  the next token is available;
+- a semaphore per user caps the user's requests in flight
+  (`user_concurrency`). Excess requests are rejected with 429 rather than
+  queued, since a queued request holds a worker thread too;
+- a semaphore per endpoint caps the requests in flight in total
+  (`concurrency`). Requests wait up to ADMISSION_QUEUE_TIMEOUT for a slot,
+  then get 503.
+
+Retry-After for full semaphores is the endpoint's recent average duration.
+Slots are released when the view returns, or for streamed responses (e.g.
+structure listings) once the last byte has been sent.
+
+The state lives in a pluggable store (ADMISSION_BACKEND):
+
+- memory: per process, so the limits apply per gunicorn worker;
+- redis: shared by every process (requires the redis package). Buckets and
+  semaphores are updated atomically by Lua scripts on the server's clock,
+  and slots expire after ADMISSION_LEASE_SECONDS if their worker dies.
+
+If the store fails (e.g. Redis is down), requests are admitted unchecked.
+Stores also count admissions, rejections and queue time per endpoint
+(process totals for memory, deployment totals for redis), served by
+`GET /health/admission`.
+
+Cached responses (see compress.cached_response) are served before
+admission, so the decorator goes below `@cached_response`.
+"""
+
+import itertools
+import math
+import threading
+import time
+import uuid
+from functools import wraps
+from typing import Any, Callable, NamedTuple, Optional
+
+from flask import Flask, Response, current_app, jsonify, make_response
+
+KEY_PREFIX = "dataroom:admission:"
+QUEUE_POLL_INTERVAL = 0.05  # Seconds between attempts on a shared semaphore
+DURATION_SMOOTHING = 0.2  # Weight of the latest request in the average duration
+MAX_IDLE_BUCKETS = 10000  # In-memory buckets kept before refilled ones are pruned
+
+COUNTERS = ("admitted", "queued", "queue_seconds", "rejected_rate", "rejected_user", "rejected_busy")
+
+
+class Limit(NamedTuple):
+    """Admission limits of one endpoint, see ADMISSION_LIMITS."""
+
+    rate: float
+    burst: int
+    user_concurrency: int
+    concurrency: int
+
+
+class Rejected(Exception):
+    """A request that was not admitted."""
+
+    def __init__(self, message: str, status: int, retry_after: float):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionStore:
+    """Base class for the token buckets, semaphores and counters of admission control."""
+
+    scope = "process"
+
+    def take_token(self, key: str, rate: float, burst: int) -> float:
+        """Take a token from a bucket; returns 0 if taken, else seconds until one is available."""
+        raise NotImplementedError
+
+    def acquire(self, key: str, limit: int, lease_seconds: float, timeout: float = 0) -> Optional[str]:
+        """Take a slot of a semaphore, waiting up to `timeout`; returns its lease id, or None."""
+        raise NotImplementedError
+
+    def release(self, key: str, lease_id: str) -> None:
+        raise NotImplementedError
+
+    def in_flight(self, key: str) -> int:
+        """Count the taken slots of a semaphore."""
+        raise NotImplementedError
+
+    def record(self, endpoint: str, **counts: float) -> None:
+        """Add to the counters of an endpoint."""
+        raise NotImplementedError
+
+    def counters(self, endpoint: str) -> dict[str, float]:
+        raise NotImplementedError
+
+
+class MemoryStore(AdmissionStore):
+    """Admission state of one process."""
+
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float, float]] = {}  # Key -> (tokens, updated, full again)
+        self._slots: dict[str, set[str]] = {}
+        self._counters: dict[str, dict[str, float]] = {}
+        self._lease_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def take_token(self, key: str, rate: float, burst: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            if key not in self._buckets and len(self._buckets) >= MAX_IDLE_BUCKETS:
+                # A bucket refilled to its burst is the same as a missing one
+                self._buckets = {other: bucket for other, bucket in self._buckets.items() if bucket[2] > now}
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return wait
+
+    def acquire(self, key: str, limit: int, lease_seconds: float, timeout: float = 0) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            slots = self._slots.setdefault(key, set())
+            while len(slots) >= limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._released.wait(remaining)
+            lease_id = str(next(self._lease_ids))
+            slots.add(lease_id)
+            return lease_id
+
+    def release(self, key: str, lease_id: str) -> None:
+        with self._lock:
+            slots = self._slots.get(key)
+            if slots is not None:
+                slots.discard(lease_id)
+                if not slots:
+                    del self._slots[key]
+            self._released.notify_all()
+
+    def in_flight(self, key: str) -> int:
+        with self._lock:
+            return len(self._slots.get(key, ()))
+
+    def record(self, endpoint: str, **counts: float) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, dict.fromkeys(COUNTERS, 0))
+            for name, amount in counts.items():
+                counters[name] += amount
+
+    def counters(self, endpoint: str) -> dict[str, float]:
+        with self._lock:
+            return dict(self._counters.get(endpoint) or dict.fromkeys(COUNTERS, 0))
+
+
+_TAKE_TOKEN_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = math.min(burst, (tonumber(state[1]) or burst) + (now - (tonumber(state[2]) or now)) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+_ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then return 0 end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2])))
+return 1
+"""
+
+
+class RedisStore(AdmissionStore):
+    """Admission state shared through Redis (requires the redis package).
+
+    Semaphores are sorted sets of lease ids scored by their expiry time.
+    """
+
+    scope = "shared"
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("The redis admission backend requires the redis package") from e
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._take_token = self.client.register_script(_TAKE_TOKEN_SCRIPT)
+        self._acquire = self.client.register_script(_ACQUIRE_SCRIPT)
+
+    def take_token(self, key: str, rate: float, burst: int) -> float:
+        return float(self._take_token(keys=[KEY_PREFIX + key], args=[rate, burst]))
+
+    def acquire(self, key: str, limit: int, lease_seconds: float, timeout: float = 0) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        lease_id = uuid.uuid4().hex
+        while not self._acquire(keys=[KEY_PREFIX + key], args=[limit, lease_seconds, lease_id]):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(QUEUE_POLL_INTERVAL, remaining))
+        return lease_id
+
+    def release(self, key: str, lease_id: str) -> None:
+        self.client.zrem(KEY_PREFIX + key, lease_id)
+
+    def in_flight(self, key: str) -> int:
+        seconds, microseconds = self.client.time()
+        return self.client.zcount(KEY_PREFIX + key, seconds + microseconds / 1e6, "+inf")
+
+    def record(self, endpoint: str, **counts: float) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        for name, amount in counts.items():
+            pipeline.hincrbyfloat(f"{KEY_PREFIX}counters:{endpoint}", name, amount)
+        pipeline.execute()
+
+    def counters(self, endpoint: str) -> dict[str, float]:
+        stored = self.client.hgetall(f"{KEY_PREFIX}counters:{endpoint}")
+        return {name: float(stored.get(name, 0)) for name in COUNTERS}
+
+
+def create_admission_store(config) -> AdmissionStore:
+    """Create the admission store selected by ADMISSION_BACKEND."""
+    backend = config["ADMISSION_BACKEND"]
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "redis":
+        return RedisStore(config["ADMISSION_REDIS_URL"])
+    raise ValueError(f"Unknown admission backend: {backend}")
+
+
+class AdmissionController:
+    """The admission limits of an application and the store they are enforced with."""
+
+    def __init__(self, app: Flask):
+        self.enabled = app.config["ADMISSION_ENABLED"]
+        self.store = create_admission_store(app.config) if self.enabled else None
+        self.limits = {endpoint: Limit(**limit) for endpoint, limit in app.config["ADMISSION_LIMITS"].items()}
+        self.queue_timeout = app.config["ADMISSION_QUEUE_TIMEOUT"]
+        self.lease_seconds = app.config["ADMISSION_LEASE_SECONDS"]
+        self._durations: dict[str, float] = {}  # Smoothed seconds per request, per endpoint
+        self._lock = threading.Lock()
+
+    def admit(self, endpoint: str, user_id: int) -> list[tuple[str, str]]:
+        """Admit a request; returns the (semaphore, lease id) slots it holds.
+
+        Raises Rejected if the request is not admitted.
+        """
+        limit = self.limits[endpoint]
+        if limit.rate > 0:
+            wait = self.store.take_token(f"rate:{endpoint}:{user_id}", limit.rate, limit.burst)
+            if wait > 0:
+                self.store.record(endpoint, rejected_rate=1)
+                raise Rejected("Too many requests, slow down", 429, wait)
+
+        slots = []
+        try:
+            if limit.user_concurrency > 0:
+                key = f"slots:{endpoint}:{user_id}"
+                lease_id = self.store.acquire(key, limit.user_concurrency, self.lease_seconds)
+                if lease_id is None:
+                    self.store.record(endpoint, rejected_user=1)
+                    raise Rejected("Too many requests in progress", 429, self.retry_after(endpoint))
+                slots.append((key, lease_id))
+
+            if limit.concurrency > 0:
+                key = f"slots:{endpoint}"
+                lease_id = self.store.acquire(key, limit.concurrency, self.lease_seconds)
+                if lease_id is None:
+                    started = time.monotonic()
+                    lease_id = self.store.acquire(key, limit.concurrency, self.lease_seconds, self.queue_timeout)
+                    self.store.record(endpoint, queued=1, queue_seconds=time.monotonic() - started)
+                    if lease_id is None:
+                        self.store.record(endpoint, rejected_busy=1)
+                        raise Rejected("Server busy, try again later", 503, self.retry_after(endpoint))
+                slots.append((key, lease_id))
+        except BaseException:
+            self.release(slots)
+            raise
+
+        self.store.record(endpoint, admitted=1)
+        return slots
+
+    def release(self, slots: list[tuple[str, str]]) -> None:
+        """Release the slots of an admitted request."""
+        for key, lease_id in reversed(slots):
+            self.store.release(key, lease_id)
+
+    def finished(self, endpoint: str, seconds: float) -> None:
+        """Record how long an admitted request took."""
+        with self._lock:
+            previous = self._durations.get(endpoint)
+            self._durations[endpoint] = seconds if previous is None else (
+                previous + DURATION_SMOOTHING * (seconds - previous)
+            )
+
+    def retry_after(self, endpoint: str) -> float:
+        """Estimate when a slot frees up: the endpoint's average duration."""
+        with self._lock:
+            return self._durations.get(endpoint, 1.0)
+
+    def metrics(self) -> dict:
+        """Counters and requests in flight per endpoint."""
+        if not self.enabled:
+            return {"enabled": False}
+        endpoints = {}
+        for endpoint, limit in self.limits.items():
+            counters = self.store.counters(endpoint)
+            queued = counters["queued"]
+            endpoints[endpoint] = {
+                **counters,
+                "average_queue_seconds": counters["queue_seconds"] / queued if queued else 0.0,
+                "in_flight": self.store.in_flight(f"slots:{endpoint}") if limit.concurrency > 0 else None,
+                "average_seconds": self._durations.get(endpoint),
+                "limits": limit._asdict(),
+            }
+        return {"enabled": True, "backend": current_app.config["ADMISSION_BACKEND"],
+                "scope": self.store.scope, "endpoints": endpoints}
+
+
+def admission_control(endpoint: str) -> Callable:
+    """Decorator admitting requests to a view under the limits of `endpoint`.
+
+    Must be applied below `login_required` (and `cached_response`), since
+    limits are kept per user.
+    """
+    def decorator(f: Callable) -> Callable:
+        @wraps(f)
+        def decorated_function(current_user, *args: Any, **kwargs: Any) -> Any:
+            controller: AdmissionController = current_app.extensions["admission"]
+            if not controller.enabled:
+                return f(current_user, *args, **kwargs)
+
+            try:
+                slots = controller.admit(endpoint, current_user.id)
+            except Rejected as e:
+                response = jsonify({"error": e.message})
+                response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+                return response, e.status
+            except Exception as e:
+                # An unreachable shared store must not take the endpoints down with it
+                current_app.logger.warning(f"Admission control unavailable, admitting {endpoint} request: {e}")
+                return f(current_user, *args, **kwargs)
+
+            started = time.monotonic()
+            try:
+                response: Response = make_response(f(current_user, *args, **kwargs))
+            except BaseException:
+                controller.release(slots)
+                raise
+
+            def release() -> None:
+                controller.release(slots)
+                controller.finished(endpoint, time.monotonic() - started)
+
+            if response.is_streamed:
+                # Streamed bodies are produced after the view returns
+                response.call_on_close(release)
+            else:
+                release()
+            return response
+        return decorated_function
+    return decorator
+
+
+def init_admission(app: Flask) -> None:
+    """Create the admission controller of an application."""
+    app.extensions["admission"] = AdmissionController(app)
+
+
+def get_admission() -> AdmissionController:
+    """Get the admission controller of the current application."""
+    return current_app.extensions["admission"]
@@ -6,6 +6,15 @@ from pathlib import Path
 
 from config import get_config
 from models import db
+from migrate import upgrade_database
+from storage import init_storage
+from compress import init_compression
+from audit import init_audit
+from replicas import init_replicas
+from oauth import init_oauth
+from tree_index import init_tree_index
+from name_index import init_name_index
+from admission import init_admission, get_admission
 
 
 def create_app() -> Flask:
@@ -27,6 +36,14 @@ def create_app() -> Flask:
 
     # Initialize extensions
     db.init_app(app)
+    init_replicas(app)
+    init_storage(app)
+    init_compression(app)
+    init_audit(app)
+    init_oauth(app)
+    init_tree_index(app)
+    init_name_index(app)
+    init_admission(app)
     CORS(app, origins=app.config["CORS_ORIGINS"].split(","), supports_credentials=True)
 
     # Register blueprints
@@ -35,12 +52,18 @@ def create_app() -> Flask:
     from routes.folders import folders_bp
     from routes.files import files_bp
     from routes.search import search_bp
+    from routes.batch import batch_bp
 
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
     app.register_blueprint(datarooms_bp, url_prefix="/api/datarooms")
     app.register_blueprint(folders_bp, url_prefix="/api/folders")
     app.register_blueprint(files_bp, url_prefix="/api/files")
     app.register_blueprint(search_bp, url_prefix="/api/search")
+    app.register_blueprint(batch_bp, url_prefix="/api/batch")
+
+    # Register CLI commands
+    from commands import register_commands
+    register_commands(app)
 
     # Health check endpoint
     @app.route("/health")
@@ -48,18 +71,23 @@ def create_app() -> Flask:
         """Health check endpoint."""
         return {"status": "healthy", "service": "dataroom-backend"}
 
-    # Create database tables (skip in serverless environments)
-    # In serverless, tables should be created via migration scripts
-    try:
-        with app.app_context():
-            db.create_all()
-    except Exception as e:
-        # Log the error but don't fail - tables might already exist or we're in serverless
-        print(f"Warning: Could not create tables: {e}")
+    @app.route("/health/admission")
+    def admission_metrics():
+        """Admission control counters: admitted, queued and rejected requests per endpoint."""
+        return get_admission().metrics()
+
+    # Apply schema migrations (in serverless, run `alembic upgrade head` at deploy time instead)
+    if app.config["DB_AUTO_MIGRATE"]:
+        try:
+            upgrade_database(app)
+        except Exception as e:
+            # Log the error but don't fail - the database may be unreachable from this environment
+            print(f"Warning: Could not migrate database: {e}")
 
     return app
 
 
 if __name__ == "__main__":
     app = create_app()
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    # Development server only; production uses gunicorn (see gunicorn.conf.py)
+    app.run(host="0.0.0.0", port=5001, debug=app.config["DEBUG"])
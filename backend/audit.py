@@ -0,0 +1,159 @@
+"""Buffered audit log of file views and downloads.
+
+Requests never write audit rows themselves: `record_access` appends the
+event to an in-process buffer and returns. A background thread per process
+bulk-inserts the buffer whenever AUDIT_FLUSH_BATCH events are waiting or
+AUDIT_FLUSH_INTERVAL seconds have passed, so the hot read paths gain no
+database round trip.
+
+Backpressure: the buffer holds at most AUDIT_BUFFER_SIZE events. When the
+database falls behind and it fills up, recording waits up to
+AUDIT_ENQUEUE_TIMEOUT for room and then drops the event (counted and
+logged) rather than stalling downloads indefinitely.
+
+Buffered events are flushed on interpreter exit and by gunicorn's
+`worker_exit` hook, so graceful restarts lose nothing.
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from flask import Flask, current_app, request
+from sqlalchemy import insert
+
+from models import db, get_utc_now, AccessEvent, File, User
+
+
+class AuditLog:
+    """Per-process buffer of access events with a background flush thread."""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.max_size = app.config["AUDIT_BUFFER_SIZE"]
+        self.batch_size = app.config["AUDIT_FLUSH_BATCH"]
+        self.interval = app.config["AUDIT_FLUSH_INTERVAL"]
+        self.enqueue_timeout = app.config["AUDIT_ENQUEUE_TIMEOUT"]
+        self.dropped = 0
+        self._events: deque[dict] = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()  # One flush at a time (thread, exit hook)
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._stopping = False
+
+    def record(self, event: dict) -> bool:
+        """Buffer an event; returns False if it was dropped because the buffer is full."""
+        self._ensure_thread()
+        with self._not_full:
+            if len(self._events) >= self.max_size:
+                deadline = time.monotonic() + self.enqueue_timeout
+                while len(self._events) >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.dropped += 1
+                        if self.dropped == 1 or self.dropped % 1000 == 0:
+                            self.app.logger.warning(f"Audit buffer full, {self.dropped} events dropped")
+                        return False
+                    self._wake.set()
+                    self._not_full.wait(remaining)
+            self._events.append(event)
+            pending = len(self._events)
+
+        if pending >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def flush(self) -> int:
+        """Write all buffered events with bulk inserts; returns the number written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._events:
+                        break
+                    batch = [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+                    self._not_full.notify_all()
+
+                try:
+                    with self.app.app_context():
+                        db.session.execute(insert(AccessEvent), batch)
+                        db.session.commit()
+                except Exception:
+                    self.app.logger.exception(f"Failed to write {len(batch)} audit events")
+                    self._requeue(batch)
+                    break
+                written += len(batch)
+        return written
+
+    def pending(self) -> int:
+        """Number of events waiting to be written."""
+        with self._lock:
+            return len(self._events)
+
+    def shutdown(self) -> None:
+        """Stop the flush thread and write whatever is still buffered."""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
+
+    def _requeue(self, batch: list[dict]) -> None:
+        """Put a failed batch back at the front, keeping as much as fits."""
+        with self._lock:
+            room = self.max_size - len(self._events)
+            kept = batch[:max(room, 0)]
+            self._events.extendleft(reversed(kept))
+            lost = len(batch) - len(kept)
+            if lost:
+                self.dropped += lost
+                self.app.logger.warning(f"Audit buffer full, {lost} events dropped after a failed write")
+
+    def _ensure_thread(self) -> None:
+        """Start the flush thread lazily; threads do not survive fork."""
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            if self._thread_pid is not None:
+                # Forked after events were buffered: those belong to the parent
+                self._events.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-flush", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+def record_access(user: User, file: File, action: str) -> None:
+    """Record that a user viewed or downloaded a file."""
+    audit_log: AuditLog = current_app.extensions["audit_log"]
+    user_agent = request.user_agent.string
+    audit_log.record({
+        "dataroom_id": file.dataroom_id,
+        "file_id": file.id,
+        "file_name": file.name,
+        "user_id": user.id,
+        "action": action,
+        "ip_address": request.remote_addr,
+        "user_agent": user_agent[:255] if user_agent else None,
+        "created_at": get_utc_now(),
+    })
+
+
+def init_audit(app: Flask) -> None:
+    """Create the audit buffer of an application and flush it on exit."""
+    audit_log = AuditLog(app)
+    app.extensions["audit_log"] = audit_log
+    atexit.register(audit_log.shutdown)
@@ -0,0 +1,40 @@
+"""Background execution of work that should not delay the response."""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from flask import current_app
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    """Get the process-wide executor, creating it lazily.
+
+    Threads do not survive fork, so a worker process forked from a preloaded
+    parent creates its own executor on first use.
+    """
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="background")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def run_in_background(func: Callable[..., Any], *args: Any) -> None:
+    """Run `func(*args)` in a background thread inside an application context."""
+    app = current_app._get_current_object()
+
+    def task() -> None:
+        with app.app_context():
+            try:
+                func(*args)
+            except Exception:
+                app.logger.exception(f"Background task {func.__name__} failed")
+
+    _get_executor(app.config["BACKGROUND_WORKERS"]).submit(task)
@@ -0,0 +1,134 @@
+"""Per-dataroom change log used for incremental client sync.
+
+Events carry the folder path governing access to the changed item (and its
+path before a move or rename), so members of single folders are only sent
+the changes within their subtrees. Dataroom events go to every member.
+
+Cursors are event ids, which are allocated when an event is inserted but
+become visible when its transaction commits, so on PostgreSQL a later id can
+commit first. A client that advanced past it would never see the earlier
+one. The feed therefore only advances to the settled cursor: events younger
+than CHANGE_FEED_SAFETY_LAG seconds, and every event after the first of
+them, are held back until they are older. This is a window, not a
+guarantee: an event whose transaction commits more than the lag after its
+insert (or an app server clock that far behind) can still be skipped.
+Events are inserted when the session flushes, normally right before commit.
+Clients should apply changes idempotently, since the events between the
+settled cursor and the latest one are already reflected in /structure.
+"""
+
+from datetime import timedelta
+from typing import Optional
+
+from flask import current_app
+from sqlalchemy import and_, exists, select, func, or_
+
+from acl import accessible
+from models import db, get_utc_now, ChangeEvent, Folder, Permission
+
+RECENT_EVENTS_SCANNED = 1000  # Newest events checked for ones still within the safety lag
+
+
+def record_change(
+    dataroom_id: int,
+    entity_type: str,
+    entity_id: int,
+    action: str,
+    data: Optional[dict] = None,
+    path: Optional[str] = None,
+    old_path: Optional[str] = None,
+) -> ChangeEvent:
+    """Append a change event to the current session.
+
+    `path` is the folder path governing access to the item (see
+    acl.folder_path), `old_path` the one before a move or rename. The event
+    is committed together with the mutation that caused it, so the log never
+    contains changes that were rolled back.
+    """
+    event = ChangeEvent(
+        dataroom_id=dataroom_id,
+        entity_type=entity_type,
+        entity_id=entity_id,
+        action=action,
+        data=data,
+        path=path,
+        old_path=old_path,
+    )
+    db.session.add(event)
+    return event
+
+
+def visible_to(user_id: int):
+    """SQL condition: the user may see a change event.
+
+    Besides events on items they can read, members see folders moving or
+    being renamed above their grants, since that rewrites the paths they hold.
+    """
+    below = exists().where(
+        Permission.user_id == user_id,
+        Permission.dataroom_id == ChangeEvent.dataroom_id,
+        func.substr(Permission.path_prefix, 1, func.length(ChangeEvent.path) + 1) == ChangeEvent.path + "/",
+    )
+    return or_(
+        ChangeEvent.entity_type == "dataroom",
+        accessible(user_id, ChangeEvent.dataroom_id, ChangeEvent.path),
+        accessible(user_id, ChangeEvent.dataroom_id, ChangeEvent.old_path),
+        and_(ChangeEvent.entity_type == "folder", ChangeEvent.old_path.is_not(None), below),
+    )
+
+
+def get_settled_cursor(dataroom_id: int) -> int:
+    """Get the cursor the feed may advance to: the last event before any still within the safety lag."""
+    cutoff = get_utc_now() - timedelta(seconds=current_app.config["CHANGE_FEED_SAFETY_LAG"])
+    recent = (
+        select(ChangeEvent.id, ChangeEvent.created_at)
+        .where(ChangeEvent.dataroom_id == dataroom_id)
+        .order_by(ChangeEvent.id.desc())
+        .limit(RECENT_EVENTS_SCANNED)
+        .subquery()
+    )
+    first_unsettled = db.session.execute(select(func.min(recent.c.id)).where(recent.c.created_at > cutoff)).scalar()
+    if first_unsettled is not None:
+        return first_unsettled - 1
+    return get_latest_cursor(dataroom_id)
+
+
+def get_changes_since(
+    dataroom_id: int, cursor: int, until: int, limit: int, user_id: Optional[int] = None,
+) -> list[ChangeEvent]:
+    """Get up to `limit` changes for a dataroom with a cursor after `cursor` and up to `until`.
+
+    With `user_id`, only the changes that user may see (see visible_to).
+    """
+    stmt = select(ChangeEvent).where(
+        ChangeEvent.dataroom_id == dataroom_id, ChangeEvent.id > cursor, ChangeEvent.id <= until,
+    )
+    if user_id is not None:
+        stmt = stmt.where(visible_to(user_id))
+    return db.session.execute(stmt.order_by(ChangeEvent.id).limit(limit)).scalars().all()
+
+
+def get_latest_cursor(dataroom_id: int) -> int:
+    """Get the cursor of the most recent change in a dataroom (0 if none)."""
+    latest = db.session.execute(
+        select(func.max(ChangeEvent.id)).where(ChangeEvent.dataroom_id == dataroom_id)
+    ).scalar()
+    return latest or 0
+
+
+def get_folder_cursor(folder_id: int) -> int:
+    """Get the latest cursor of the dataroom containing a folder (0 if none)."""
+    dataroom_id = select(Folder.dataroom_id).where(Folder.id == folder_id).scalar_subquery()
+    latest = db.session.execute(
+        select(func.max(ChangeEvent.id)).where(ChangeEvent.dataroom_id == dataroom_id)
+    ).scalar()
+    return latest or 0
+
+
+def get_user_cursor(user_id: int) -> int:
+    """Get the latest cursor across all datarooms a user can access (0 if none)."""
+    dataroom_ids = select(Permission.dataroom_id).where(Permission.user_id == user_id)
+    latest = db.session.execute(
+        select(func.max(ChangeEvent.id)).where(ChangeEvent.dataroom_id.in_(dataroom_ids))
+    ).scalar()
+    return latest or 0
@@ -0,0 +1,608 @@
+"""Flask CLI commands for maintenance tasks."""
+
+import os
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, or_, select, update, delete, insert
+from sqlalchemy.orm import joinedload
+
+from auth_utils import create_jwt_token
+from models import db, ChangeEvent, DataRoom, File, FileContent, FilePage, FileSignature, FileTerm, Folder, ImportJob, Permission, User
+from extraction import ExtractionEngine, ExtractionResult
+from thumbnails import generate_preview, get_thumbnail_key
+from storage import LocalStorage, StorageBackend, get_storage
+from quota import reconcile_storage
+from similarity import index_files
+from text_store import compress_texts, decompress_text, get_current_dictionary_id, load_texts, store_texts, train_dictionary
+from acl import folder_path, rebuild_all_permissions, rebuild_permissions
+from changes import record_change
+from importer import ArchiveError, create_import_job, get_resumable_jobs, run_import
+
+
+def read_checkpoint(path: Path) -> int:
+    """Read the last processed id from a checkpoint file (0 if none)."""
+    try:
+        return int(path.read_text().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def write_checkpoint(path: Path, last_id: int) -> None:
+    """Atomically record the last processed id."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(str(last_id))
+    os.replace(tmp_path, path)
+
+
+@click.command("reindex")
+@click.option("--batch-size", default=200, show_default=True, help="Files fetched and committed per batch.")
+@click.option("--workers", type=int, default=None, help="Documents extracted in parallel (default: PDF_EXTRACT_WORKERS).")
+@click.option("--all", "reindex_all", is_flag=True, help="Re-extract every file, not only files without text.")
+@click.option("--dataroom-id", type=int, default=None, help="Only reindex files in this dataroom.")
+@click.option("--checkpoint", type=click.Path(dir_okay=False, path_type=Path),
+              default=Path(".reindex-checkpoint"), show_default=True, help="File recording progress for resuming.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and start from the first file.")
+@with_appcontext
+def reindex_command(batch_size, workers, reindex_all, dataroom_id, checkpoint, restart):
+    """Re-extract PDF text and rebuild per-page text in bulk."""
+    config = current_app.config
+    storage = get_storage()
+    workers = workers or config["PDF_EXTRACT_WORKERS"]
+
+    # Parallelism is across documents, which share one pool of budgeted
+    # worker processes for the whole run
+    engine = ExtractionEngine.from_config(config, workers=workers)
+
+    start_id = 0 if restart else read_checkpoint(checkpoint)
+    if start_id:
+        click.echo(f"Resuming after file id {start_id}")
+
+    stmt = select(File.id, File.file_path, File.file_size).where(File.id > start_id).order_by(File.id)
+    if not reindex_all:
+        stmt = stmt.outerjoin(FileContent, FileContent.file_id == File.id).where(FileContent.file_id.is_(None))
+    if dataroom_id:
+        stmt = stmt.where(File.dataroom_id == dataroom_id)
+
+    processed = failed = missing = 0
+    bytes_processed = 0
+    started = time.monotonic()
+
+    def extract(row) -> tuple[int, ExtractionResult | None]:
+        if not storage.exists(row.file_path):
+            return row.id, None
+        with storage.local_path(row.file_path) as path:
+            return row.id, engine.extract(path)
+
+    # Rows are streamed through a server-side cursor on a dedicated
+    # connection while results are written back through the session
+    with engine, db.engine.connect() as conn, ThreadPoolExecutor(max_workers=workers) as executor:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+        for rows in result.partitions():
+            documents = []
+            page_rows = []
+            page_counts = []
+            for file_id, extraction in executor.map(extract, rows):
+                if extraction is None:
+                    missing += 1
+                elif not extraction.ok:
+                    failed += 1
+                    current_app.logger.warning(f"Failed to extract text for file {file_id}: {extraction.error}")
+                else:
+                    documents.append((file_id, extraction.text))
+                    page_counts.append({"id": file_id, "page_count": extraction.page_count})
+                    page_rows.extend(
+                        {"file_id": file_id, "page_number": number, "text_offset": offset, "text_length": length}
+                        for number, (offset, length) in enumerate(extraction.page_spans, start=1)
+                    )
+
+            if documents:
+                updated_ids = [file_id for file_id, _ in documents]
+                store_texts(documents)
+                db.session.execute(delete(FilePage).where(FilePage.file_id.in_(updated_ids)))
+                if page_rows:
+                    db.session.execute(insert(FilePage), page_rows)
+                db.session.execute(update(File), page_counts)
+                index_files(documents)
+                # Listings, the tree index and cached responses follow the change log
+                files = File.query.options(joinedload(File.folder)).filter(File.id.in_(updated_ids))
+                for file in files:
+                    record_change(file.dataroom_id, "file", file.id, "updated", file.to_dict(), path=folder_path(file))
+            db.session.commit()
+            write_checkpoint(checkpoint, rows[-1].id)
+
+            processed += len(rows)
+            bytes_processed += sum(row.file_size for row in rows)
+            elapsed = max(time.monotonic() - started, 1e-9)
+            click.echo(
+                f"Processed {processed} files ({failed} failed, {missing} missing in storage) - "
+                f"{processed / elapsed:.1f} files/s, {bytes_processed / elapsed / 1048576:.1f} MB/s"
+            )
+
+    # A completed run leaves nothing to resume
+    checkpoint.unlink(missing_ok=True)
+    click.echo(f"Reindex complete: {processed} files in {time.monotonic() - started:.1f}s")
+
+
+@click.command("extract-benchmark")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--repeat", default=3, show_default=True, help="Runs per file and mode.")
+@with_appcontext
+def extract_benchmark_command(paths, repeat):
+    """Compare extraction time and peak worker RSS with and without mmap."""
+    for use_mmap in (False, True):
+        for path in paths:
+            durations = []
+            peak_rss = 0
+            # Fresh workers per file, since peak RSS is measured over a worker's lifetime
+            with ExtractionEngine.from_config(current_app.config, use_mmap=use_mmap) as engine:
+                for _ in range(repeat):
+                    started = time.monotonic()
+                    result = engine.extract(path)
+                    durations.append(time.monotonic() - started)
+                    if not result.ok:
+                        raise click.ClickException(f"{path}: {result.error}")
+                    peak_rss = max(peak_rss, result.peak_rss)
+            click.echo(
+                f"{'mmap' if use_mmap else 'read'}  {path}: {result.page_count} pages, "
+                f"best {min(durations):.3f}s, peak worker RSS {peak_rss / 1048576:.1f} MB"
+            )
+
+
+@click.command("generate-previews")
+@click.option("--all", "regenerate_all", is_flag=True, help="Regenerate previews that already exist.")
+@with_appcontext
+def generate_previews_command(regenerate_all):
+    """Backfill page counts and thumbnails for stored files."""
+    stmt = select(File.id).order_by(File.id)
+    if not regenerate_all:
+        stmt = stmt.where(or_(File.page_count.is_(None), File.thumbnail_path.is_(None)))
+    file_ids = db.session.execute(stmt).scalars().all()
+
+    started = time.monotonic()
+    for count, file_id in enumerate(file_ids, start=1):
+        generate_preview(file_id)
+        if count % 100 == 0 or count == len(file_ids):
+            click.echo(f"Generated {count}/{len(file_ids)} previews ({count / (time.monotonic() - started):.1f} files/s)")
+
+
+def copy_blob(source: StorageBackend, target: StorageBackend, old_key: str, new_key: str) -> None:
+    """Copy a blob between backends, leaving the source in place."""
+    if isinstance(source, LocalStorage) and isinstance(target, LocalStorage):
+        dest = target.path(new_key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # Same filesystem: a hard link moves nothing and is atomic
+            os.link(source.path(old_key), dest)
+            return
+        except FileExistsError:
+            return  # Linked by an earlier, interrupted run
+        except OSError:
+            pass
+
+    with source.open(old_key) as stream:
+        target.save(stream, new_key)
+
+
+@click.command("storage-migrate")
+@click.option("--batch-size", default=500, show_default=True, help="Files moved and committed per batch.")
+@click.option("--source-root", type=click.Path(file_okay=False, path_type=Path), default=None,
+              help="Directory the blobs currently live in (default: UPLOAD_FOLDER).")
+@with_appcontext
+def storage_migrate_command(batch_size, source_root):
+    """Move blobs to the layout of the configured STORAGE_BACKEND and rewrite File.file_path."""
+    target = get_storage()
+    source = LocalStorage(source_root or current_app.config["UPLOAD_FOLDER"], fsync="none")
+
+    last_id = 0
+    migrated = skipped = missing = 0
+    started = time.monotonic()
+
+    while True:
+        rows = db.session.execute(
+            select(File.id, File.dataroom_id, File.file_path, File.thumbnail_path)
+            .where(File.id > last_id)
+            .order_by(File.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        old_keys = []
+        for row in rows:
+            new_key = target.make_key(row.dataroom_id, Path(row.file_path).name)
+            if new_key == row.file_path and target.exists(new_key):
+                skipped += 1  # Already in the target layout
+                continue
+            if not source.exists(row.file_path):
+                missing += 1
+                continue
+
+            copy_blob(source, target, row.file_path, new_key)
+            update_row = {"id": row.id, "file_path": new_key}
+            old_keys.append(row.file_path)
+
+            if row.thumbnail_path and source.exists(row.thumbnail_path):
+                new_thumbnail_key = get_thumbnail_key(new_key)
+                copy_blob(source, target, row.thumbnail_path, new_thumbnail_key)
+                update_row["thumbnail_path"] = new_thumbnail_key
+                old_keys.append(row.thumbnail_path)
+
+            updates.append(update_row)
+
+        if updates:
+            db.session.execute(update(File), updates)
+        db.session.commit()
+
+        # Old copies are removed only once the new keys are committed
+        for key in old_keys:
+            source.delete(key)
+
+        migrated += len(updates)
+        click.echo(
+            f"Migrated {migrated} files ({skipped} already migrated, {missing} missing) - "
+            f"{migrated / max(time.monotonic() - started, 1e-9):.1f} files/s"
+        )
+
+    click.echo(f"Storage migration complete: {migrated} files moved")
+
+
+@click.command("structure-benchmark")
+@click.option("--nodes", default=50000, show_default=True, help="Approximate number of folders and files to seed.")
+@click.option("--fanout", default=10, show_default=True, help="Subfolders per folder.")
+@click.option("--files-per-folder", default=4, show_default=True, help="Files per folder.")
+@click.option("--accept-encoding", default="identity", show_default=True, help="Accept-Encoding sent with the request.")
+@with_appcontext
+def structure_benchmark_command(nodes, fanout, files_per_folder, accept_encoding):
+    """Measure time-to-first-byte and peak memory of the dataroom structure endpoint."""
+    user = User(email=f"benchmark-{uuid.uuid4().hex}@example.com", oauth_provider="benchmark", oauth_id="benchmark")
+    db.session.add(user)
+    db.session.flush()
+    user_id = user.id
+    dataroom = DataRoom(name="Structure benchmark", owner_id=user_id)
+    db.session.add(dataroom)
+    db.session.flush()
+    dataroom_id = dataroom.id
+    rebuild_permissions(dataroom_id, user_id)
+
+    try:
+        # Seed the tree level by level so parent ids are known
+        started = time.monotonic()
+        folder_budget = max(1, nodes // (files_per_folder + 1))
+        level = [(None, "")]
+        folder_ids = []
+        while level and len(folder_ids) < folder_budget:
+            rows = []
+            for parent_id, parent_path in level:
+                for i in range(fanout):
+                    if len(folder_ids) + len(rows) >= folder_budget:
+                        break
+                    rows.append({
+                        "name": f"folder-{i}",
+                        "parent_id": parent_id,
+                        "dataroom_id": dataroom_id,
+                        "path": f"{parent_path}/folder-{i}",
+                    })
+            ids = db.session.scalars(insert(Folder).returning(Folder.id, sort_by_parameter_order=True), rows).all()
+            folder_ids.extend(ids)
+            level = [(folder_id, row["path"]) for folder_id, row in zip(ids, rows)]
+
+        file_rows = [
+            {
+                "name": f"file-{i}.pdf",
+                "original_name": f"file-{i}.pdf",
+                "folder_id": folder_id,
+                "dataroom_id": dataroom_id,
+                "file_path": f"{dataroom_id}/{folder_id}-{i}.pdf",
+                "file_size": 1024,
+            }
+            for folder_id in folder_ids
+            for i in range(files_per_folder)
+        ]
+        db.session.execute(insert(File), file_rows)
+        db.session.commit()
+        click.echo(
+            f"Seeded {len(folder_ids)} folders and {len(file_rows)} files in {time.monotonic() - started:.1f}s"
+        )
+
+        client = current_app.test_client()
+        headers = {"Authorization": f"Bearer {create_jwt_token(user_id)}", "Accept-Encoding": accept_encoding}
+
+        def fetch() -> tuple[int, float, float, str]:
+            started = time.monotonic()
+            response = client.get(f"/api/datarooms/{dataroom_id}/structure", headers=headers, buffered=False)
+            chunks = iter(response.response)
+            size = len(next(chunks, b""))
+            first_byte = time.monotonic() - started
+            for chunk in chunks:
+                size += len(chunk)
+            response.close()
+            if response.status_code != 200:
+                raise click.ClickException(f"Structure request failed with status {response.status_code}")
+            return size, first_byte, time.monotonic() - started, response.headers.get("Content-Encoding", "identity")
+
+        size, first_byte, total, encoding = fetch()
+
+        # Memory is traced in a separate, uncached run since tracing slows Python down
+        current_app.extensions["response_cache"].clear()
+        tracemalloc.start()
+        fetch()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        click.echo(
+            f"Structure ({encoding}): {size / 1048576:.1f} MB, first byte {first_byte * 1000:.0f} ms, "
+            f"total {total * 1000:.0f} ms, peak Python memory {peak / 1048576:.1f} MB"
+        )
+    finally:
+        db.session.rollback()
+        db.session.execute(delete(File).where(File.dataroom_id == dataroom_id))
+        db.session.execute(delete(Folder).where(Folder.dataroom_id == dataroom_id))
+        db.session.execute(delete(ChangeEvent).where(ChangeEvent.dataroom_id == dataroom_id))
+        db.session.execute(delete(Permission).where(Permission.dataroom_id == dataroom_id))
+        db.session.execute(delete(DataRoom).where(DataRoom.id == dataroom_id))
+        db.session.execute(delete(User).where(User.id == user_id))
+        db.session.commit()
+
+
+@click.command("quota-reconcile")
+@click.option("--user-id", type=int, default=None, help="Only reconcile this user.")
+@with_appcontext
+def quota_reconcile_command(user_id):
+    """Recompute per-user storage usage from stored files."""
+    corrected = reconcile_storage(user_id)
+    db.session.commit()
+    click.echo(f"Reconciled storage usage: {corrected} users corrected")
+
+
+@click.command("permissions-rebuild")
+@with_appcontext
+def permissions_rebuild_command():
+    """Recompute materialized permissions from dataroom owners and grants."""
+    count = rebuild_all_permissions()
+    db.session.commit()
+    click.echo(f"Rebuilt permissions: {count} rows")
+
+
+@click.command("replica-status")
+@with_appcontext
+def replica_status_command():
+    """Check every configured read replica and report its health and lag."""
+    replicas = current_app.extensions["replicas"]
+    if not replicas.replicas:
+        click.echo("No replicas configured (DATABASE_REPLICA_URLS is empty)")
+        return
+
+    replicas.check_all()
+    for replica in replicas.replicas:
+        url = replica.engine.url.render_as_string(hide_password=True)
+        if replica.healthy:
+            click.echo(f"{url}: healthy, lag {replica.lag:.1f}s")
+        else:
+            click.echo(f"{url}: unavailable - {replica.error}")
+    if not any(replica.healthy for replica in replicas.replicas):
+        raise click.ClickException("No healthy replicas; reads are served by the primary")
+
+
+@click.command("similarity-backfill")
+@click.option("--batch-size", default=500, show_default=True, help="Files indexed and committed per batch.")
+@click.option("--all", "reindex_all", is_flag=True, help="Recompute signatures that already exist.")
+@with_appcontext
+def similarity_backfill_command(batch_size, reindex_all):
+    """Compute near-duplicate signatures for stored files."""
+    last_id = 0
+    processed = indexed = 0
+    started = time.monotonic()
+
+    while True:
+        stmt = select(File.id).where(File.id > last_id).order_by(File.id).limit(batch_size)
+        if not reindex_all:
+            stmt = stmt.outerjoin(FileSignature, FileSignature.file_id == File.id).where(FileSignature.file_id.is_(None))
+        rows = db.session.execute(stmt).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        texts = load_texts(row.id for row in rows)
+        indexed += index_files((row.id, texts.get(row.id)) for row in rows)
+        db.session.commit()
+
+        processed += len(rows)
+        click.echo(
+            f"Processed {processed} files ({indexed} with signatures) - "
+            f"{processed / max(time.monotonic() - started, 1e-9):.1f} files/s"
+        )
+
+    click.echo(f"Similarity backfill complete: {indexed} signatures computed")
+
+
+@click.command("content-train-dictionary")
+@click.option("--samples", default=2000, show_default=True, help="Stored texts sampled for training.")
+@click.option("--size", default=112640, show_default=True, help="Dictionary size in bytes.")
+@click.option("--recompress", is_flag=True, help="Recompress every stored text with the new dictionary.")
+@click.option("--batch-size", default=200, show_default=True, help="Texts loaded and committed per batch.")
+@with_appcontext
+def content_train_dictionary_command(samples, size, recompress, batch_size):
+    """Train a zstd dictionary on stored texts; texts stored from now on use it."""
+    file_ids = db.session.execute(
+        select(FileContent.file_id).order_by(func.random()).limit(samples)
+    ).scalars().all()
+    texts = (
+        text
+        for start in range(0, len(file_ids), batch_size)
+        for text in load_texts(file_ids[start:start + batch_size]).values()
+    )
+    dictionary = train_dictionary(texts, size)
+    if dictionary is None:
+        raise click.ClickException("Not enough stored text to train a dictionary")
+    db.session.commit()
+    click.echo(f"Trained dictionary {dictionary.id}: {len(dictionary.data)} bytes from {dictionary.sample_count} samples")
+    if not recompress:
+        return
+
+    last_id = 0
+    processed = before = after = 0
+    started = time.monotonic()
+    while True:
+        rows = db.session.execute(
+            select(FileContent.file_id, FileContent.dictionary_id, FileContent.data)
+            .where(FileContent.file_id > last_id)
+            .order_by(FileContent.file_id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].file_id
+
+        frames = compress_texts((decompress_text(row.data, row.dictionary_id) for row in rows), dictionary.id)
+        db.session.execute(update(FileContent), [
+            {"file_id": row.file_id, "dictionary_id": dictionary.id, "data": frame}
+            for row, frame in zip(rows, frames)
+        ])
+        db.session.commit()
+
+        processed += len(rows)
+        before += sum(len(row.data) for row in rows)
+        after += sum(len(frame) for frame in frames)
+        click.echo(
+            f"Recompressed {processed} texts: {before / 1048576:.1f} MB -> {after / 1048576:.1f} MB - "
+            f"{processed / max(time.monotonic() - started, 1e-9):.1f} texts/s"
+        )
+
+
+@click.command("content-benchmark")
+@click.option("--samples", default=500, show_default=True, help="Stored texts sampled for decoding.")
+@with_appcontext
+def content_benchmark_command(samples):
+    """Report the size of stored texts and the cost of decoding them."""
+    count, text_size, stored_size = db.session.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(FileContent.text_size), 0),
+            func.coalesce(func.sum(func.length(FileContent.data)), 0),
+        )
+    ).one()
+    term_count = db.session.execute(select(func.count()).select_from(FileTerm)).scalar()
+    click.echo(
+        f"Stored: {count} texts, {text_size / 1048576:.1f} MB of text in {stored_size / 1048576:.1f} MB "
+        f"(ratio {text_size / max(stored_size, 1):.2f}), {term_count} indexed terms"
+    )
+
+    rows = db.session.execute(
+        select(FileContent.dictionary_id, FileContent.data).order_by(func.random()).limit(samples)
+    ).all()
+    if not rows:
+        return
+    texts = [decompress_text(row.data, row.dictionary_id) for row in rows]  # Also loads the dictionaries
+    raw_size = sum(len(text.encode(errors="replace")) for text in texts)
+
+    def report(label: str, frames: list[tuple[bytes, int | None]]) -> None:
+        started = time.perf_counter()
+        for data, dictionary_id in frames:
+            decompress_text(data, dictionary_id)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        size = sum(len(data) for data, _ in frames)
+        click.echo(
+            f"{label}: {size / 1048576:.2f} MB (ratio {raw_size / max(size, 1):.2f}), "
+            f"decode {elapsed / len(frames) * 1e6:.0f} us/text, {raw_size / elapsed / 1048576:.0f} MB/s"
+        )
+
+    click.echo(f"Sample of {len(rows)} texts, {raw_size / 1048576:.2f} MB of text:")
+    report("  as stored", [(row.data, row.dictionary_id) for row in rows])
+    report("  no dictionary", [(frame, None) for frame in compress_texts(texts)])
+    dictionary_id = get_current_dictionary_id()
+    if dictionary_id is not None:
+        report(f"  dictionary {dictionary_id}", [(frame, dictionary_id) for frame in compress_texts(texts, dictionary_id)])
+
+
+def echo_import_progress(job: ImportJob) -> None:
+    """Print the progress of an import job."""
+    click.echo(
+        f"Import {job.id}: {job.processed_entries}/{job.total_entries} entries "
+        f"({job.imported_files} imported, {job.failed_entries} corrupt, {job.skipped_entries} skipped) - "
+        f"{job.bytes_imported / 1048576:.1f} MB"
+    )
+
+
+def run_import_job(job_id: int) -> None:
+    """Run an import job, printing its progress; fails the command if the job fails."""
+    started = time.monotonic()
+    # Background threads would not outlive the command, so previews are a separate step
+    job = run_import(job_id, progress=echo_import_progress, previews=False)
+    if job is None:
+        raise click.ClickException(f"Import {job_id} is completed or running in another process")
+    if job.status == "failed":
+        raise click.ClickException(f"Import {job.id} failed: {job.error} (resume with `flask import-resume {job.id}`)")
+    click.echo(f"Import {job.id} complete: {job.imported_files} files in {time.monotonic() - started:.1f}s")
+    click.echo("Run `flask generate-previews` to fill in page counts and thumbnails")
+
+
+@click.command("dataroom-import")
+@click.argument("archive", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--dataroom-id", type=int, required=True, help="Dataroom to import into.")
+@click.option("--folder-id", type=int, default=None, help="Target folder (default: the dataroom root).")
+@click.option("--user-id", type=int, default=None, help="User recorded as the importer (default: the dataroom owner).")
+@with_appcontext
+def dataroom_import_command(archive, dataroom_id, folder_id, user_id):
+    """Import a ZIP archive of PDFs into a dataroom, recreating its folders."""
+    dataroom = db.session.get(DataRoom, dataroom_id)
+    if not dataroom:
+        raise click.ClickException(f"Dataroom {dataroom_id} not found")
+    if folder_id is not None:
+        folder = db.session.get(Folder, folder_id)
+        if not folder or folder.dataroom_id != dataroom_id:
+            raise click.ClickException(f"Folder {folder_id} is not in dataroom {dataroom_id}")
+
+    # The archive is copied so the job can resume even if the original moves
+    with open(archive, "rb") as stream:
+        try:
+            job = create_import_job(
+                dataroom_id, folder_id, user_id or dataroom.owner_id, stream, archive.name, archive.stat().st_size,
+            )
+        except ArchiveError as e:
+            raise click.ClickException(str(e))
+    run_import_job(job.id)
+
+
+@click.command("import-resume")
+@click.argument("job_id", type=int, required=False)
+@with_appcontext
+def import_resume_command(job_id):
+    """Resume an interrupted import, or every failed and stale import."""
+    if job_id is not None:
+        run_import_job(job_id)
+        return
+
+    job_ids = get_resumable_jobs()
+    if not job_ids:
+        click.echo("No imports to resume")
+    for pending_id in job_ids:
+        try:
+            run_import_job(pending_id)
+        except click.ClickException as e:
+            click.echo(f"Error: {e.message}", err=True)
+
+
+def register_commands(app: Flask) -> None:
+    """Register CLI commands with the application."""
+    app.cli.add_command(reindex_command)
+    app.cli.add_command(extract_benchmark_command)
+    app.cli.add_command(generate_previews_command)
+    app.cli.add_command(storage_migrate_command)
+    app.cli.add_command(structure_benchmark_command)
+    app.cli.add_command(quota_reconcile_command)
+    app.cli.add_command(permissions_rebuild_command)
+    app.cli.add_command(replica_status_command)
+    app.cli.add_command(similarity_backfill_command)
+    app.cli.add_command(content_train_dictionary_command)
+    app.cli.add_command(content_benchmark_command)
+    app.cli.add_command(dataroom_import_command)
+    app.cli.add_command(import_resume_command)
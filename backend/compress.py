@@ -0,0 +1,293 @@
+"""Negotiated compression of API responses.
+
+Text responses above COMPRESSION_MIN_SIZE are compressed with the best
+encoding the client accepts (zstd, br or gzip, depending on what is
+installed). Streamed responses are compressed chunk by chunk, so they keep
+streaming. PDFs, thumbnails and the change stream are never compressed.
+
+Views decorated with `cached_response` also keep their compressed bodies in a
+per-process LRU cache keyed by user, URL, the user's permissions and a
+version (the dataroom change cursor), so hot listings are neither rebuilt
+nor recompressed per request. A hit skips the view and its access checks,
+which is safe because any change to the user's access changes the key.
+"""
+
+import itertools
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from flask import Flask, Response, current_app, g, request
+
+from acl import get_permission_version
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "text/css",
+    "text/csv",
+    "text/html",
+    "text/plain",
+}
+
+
+class GzipEncoder:
+    """Incremental gzip compressor."""
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        # Sync flush so every input chunk produces output right away
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    """Incremental brotli compressor."""
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    """Incremental zstd compressor."""
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+ENCODERS: dict[str, type] = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress a whole body with an encoding."""
+    encoder = ENCODERS[encoding]()
+    return encoder.compress(data) + encoder.finish()
+
+
+def negotiate_encoding() -> Optional[str]:
+    """Pick the best encoding accepted by the client, in server preference order."""
+    candidates = [
+        encoding for encoding in current_app.config["COMPRESSION_ENCODINGS"].split(",")
+        if encoding in ENCODERS
+    ]
+    if not candidates:
+        return None
+    return request.accept_encodings.best_match(candidates)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of compressed response bodies, bounded in bytes."""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: OrderedDict[tuple, tuple[bytes, str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[tuple[bytes, str]]:
+        """Get the body and mimetype stored under a key."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            body, mimetype, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return body, mimetype
+
+    def set(self, key: tuple, body: bytes, mimetype: str) -> None:
+        """Store a body, evicting the least recently used entries to fit."""
+        # A single entry may take at most a quarter of the cache
+        if len(body) > self.max_bytes // 4:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, mimetype, time.monotonic())
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key: tuple) -> None:
+        body, _, _ = self._entries.pop(key)
+        self.size -= len(body)
+
+
+def cached_response(version: Callable[..., Any]) -> Callable:
+    """Decorator caching a view's compressed responses.
+
+    `version` receives the view arguments and returns a value that changes
+    whenever the response would (e.g. the dataroom change cursor); the
+    user's permissions are always part of the key. Must be applied below
+    `login_required`, since entries are kept per user.
+    """
+    def decorator(f: Callable) -> Callable:
+        @wraps(f)
+        def decorated_function(current_user, *args: Any, **kwargs: Any) -> Any:
+            cache: ResponseCache = current_app.extensions["response_cache"]
+            encoding = negotiate_encoding() if current_app.config["COMPRESSION_ENABLED"] else None
+            if encoding is None:
+                return f(current_user, *args, **kwargs)
+
+            key = (
+                current_user.id,
+                request.full_path,
+                get_permission_version(current_user.id),
+                version(current_user, *args, **kwargs),
+                encoding,
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                body, mimetype = cached
+                response = Response(body, mimetype=mimetype)
+                response.headers["Content-Encoding"] = encoding
+                response.vary.add("Accept-Encoding")
+                return response
+
+            # Stored by compress_response once the body is compressed
+            g.response_cache_key = key
+            return f(current_user, *args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _peek(chunks: Iterator[bytes], size: int) -> tuple[list[bytes], bool]:
+    """Read the first chunk of a stream; report whether the stream ended.
+
+    The rest of the stream is left to be read as it is sent. Only a first
+    chunk smaller than `size` is followed by a look at the next, since that
+    is how a short body ends (iter_json sends a short chunk only last).
+    """
+    buffered = []
+    for chunk in chunks:
+        buffered.append(chunk)
+        if len(chunk) >= size or len(buffered) == 2:
+            return buffered, False
+    return buffered, True
+
+
+def _compress_stream(chunks: Iterable[bytes], encoding: str, on_complete: Optional[Callable[[bytes], None]],
+                     close: Optional[Callable[[], None]]) -> Iterator[bytes]:
+    """Compress a streamed body chunk by chunk, handing the full body to `on_complete`."""
+    encoder = ENCODERS[encoding]()
+    output = [] if on_complete else None
+    try:
+        for chunk in chunks:
+            data = encoder.compress(chunk)
+            if data:
+                if output is not None:
+                    output.append(data)
+                yield data
+        data = encoder.finish()
+        if output is not None:
+            output.append(data)
+            on_complete(b"".join(output))
+        yield data
+    finally:
+        if close is not None:
+            close()
+
+
+def compress_response(response: Response) -> Response:
+    """Compress an outgoing response if the client accepts it and it is worth it."""
+    config = current_app.config
+    if (
+        not config["COMPRESSION_ENABLED"]
+        or request.method == "HEAD"
+        or response.status_code in (204, 304)
+        or response.direct_passthrough
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    cache_key = g.get("response_cache_key") if response.status_code == 200 else None
+    cache: ResponseCache = current_app.extensions["response_cache"]
+    mimetype = response.mimetype
+
+    if response.is_streamed:
+        chunks = response.iter_encoded()
+        buffered, ended = _peek(chunks, config["COMPRESSION_MIN_SIZE"])
+        if ended:
+            response.set_data(b"".join(buffered))
+        else:
+            def store(body: bytes) -> None:
+                cache.set(cache_key, body, mimetype)
+
+            source = response.response
+            response.response = _compress_stream(
+                itertools.chain(buffered, chunks),
+                encoding,
+                store if cache_key else None,
+                getattr(source, "close", None),
+            )
+            response.headers["Content-Encoding"] = encoding
+            response.headers.pop("Content-Length", None)
+            return response
+
+    body = response.get_data()
+    if len(body) < config["COMPRESSION_MIN_SIZE"]:
+        return response
+
+    body = compress(body, encoding)
+    if cache_key:
+        cache.set(cache_key, body, mimetype)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_compression(app: Flask) -> None:
+    """Enable response compression and the compressed response cache for an application."""
+    app.extensions["response_cache"] = ResponseCache(
+        max_bytes=app.config["RESPONSE_CACHE_MAX_BYTES"],
+        ttl=app.config["RESPONSE_CACHE_TTL"],
+    )
+    app.after_request(compress_response)
@@ -0,0 +1,391 @@
+"""PDF text extraction engine with pluggable backends.
+
+Extraction always runs in worker processes: every document gets a hard time
+and memory budget, so a malformed or hostile PDF can at worst kill its own
+worker and never pins a request thread. Large documents are split into page
+ranges that are extracted in parallel. An engine keeps one pool of workers
+for all its documents, so processes are not started per document.
+
+Workers read stored blobs through a read-only memory map, so parsers only
+fault in the parts of the file they touch instead of copying the whole PDF
+into the Python heap.
+"""
+
+import io
+import mmap
+import multiprocessing
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator, Optional
+
+from flask import current_app
+
+MAX_TASKS_PER_WORKER = 100  # Workers are replaced after this many tasks, bounding parser leaks
+
+_engine_lock = threading.Lock()
+
+
+@contextmanager
+def open_blob(path: str, use_mmap: bool = True) -> Iterator[BinaryIO]:
+    """Open a stored blob as a seekable read-only stream.
+
+    With `use_mmap` the stream is a memory map of the file; otherwise the file
+    is read into memory, which is how parsers behave when given a path.
+    """
+    with open(path, "rb") as fp:
+        if not use_mmap or os.fstat(fp.fileno()).st_size == 0:
+            yield io.BytesIO(fp.read())
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+class PdfBackend:
+    """Base class for PDF parsing libraries.
+
+    Backends receive an open stream and must finish with it before returning,
+    since the underlying memory map is closed afterwards.
+    """
+
+    name: str = ""
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """Check if the underlying library is installed."""
+        raise NotImplementedError
+
+    def page_count(self, stream: BinaryIO) -> int:
+        """Get the number of pages in a PDF."""
+        raise NotImplementedError
+
+    def extract_pages(self, stream: BinaryIO, start: int, stop: int) -> list[str]:
+        """Extract the text of pages [start, stop), one string per page."""
+        raise NotImplementedError
+
+
+class PypdfBackend(PdfBackend):
+    """Backend using pypdf, the maintained successor of PyPDF2."""
+
+    name = "pypdf"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            import pypdf  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _reader(self, stream: BinaryIO):
+        from pypdf import PdfReader
+        return PdfReader(stream)
+
+    def page_count(self, stream: BinaryIO) -> int:
+        return len(self._reader(stream).pages)
+
+    def extract_pages(self, stream: BinaryIO, start: int, stop: int) -> list[str]:
+        # Page objects are parsed lazily, so only the requested pages are read
+        reader = self._reader(stream)
+        return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+class PyPDF2Backend(PypdfBackend):
+    """Backend using the deprecated PyPDF2 library."""
+
+    name = "pypdf2"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            import PyPDF2  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _reader(self, stream: BinaryIO):
+        from PyPDF2 import PdfReader
+        return PdfReader(stream)
+
+
+class PdfminerBackend(PdfBackend):
+    """Backend using pdfminer.six (slower, better layout analysis)."""
+
+    name = "pdfminer"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            import pdfminer  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def page_count(self, stream: BinaryIO) -> int:
+        from pdfminer.pdfpage import PDFPage
+        return sum(1 for _ in PDFPage.get_pages(stream))
+
+    def extract_pages(self, stream: BinaryIO, start: int, stop: int) -> list[str]:
+        from pdfminer.converter import PDFPageAggregator
+        from pdfminer.layout import LAParams, LTTextContainer
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+
+        resources = PDFResourceManager()
+        device = PDFPageAggregator(resources, laparams=LAParams())
+        interpreter = PDFPageInterpreter(resources, device)
+
+        pages = []
+        for page in PDFPage.get_pages(stream, pagenos=set(range(start, stop))):
+            interpreter.process_page(page)
+            pages.append("".join(
+                element.get_text() for element in device.get_result() if isinstance(element, LTTextContainer)
+            ))
+        return pages
+
+
+BACKENDS: dict[str, type[PdfBackend]] = {
+    backend.name: backend for backend in (PypdfBackend, PdfminerBackend, PyPDF2Backend)
+}
+
+
+def get_backend(name: str) -> PdfBackend:
+    """Get a backend by name ('auto' picks the first installed one)."""
+    if name == "auto":
+        for backend in BACKENDS.values():
+            if backend.is_available():
+                return backend()
+        raise RuntimeError("No PDF extraction backend is installed")
+
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown PDF extraction backend: {name}")
+    if not backend.is_available():
+        raise RuntimeError(f"PDF extraction backend '{name}' is not installed")
+    return backend()
+
+
+@dataclass
+class ExtractionResult:
+    """Text extracted from a PDF, one entry per page."""
+
+    pages: list[str] = field(default_factory=list)
+    error: Optional[str] = None
+    peak_rss: int = 0  # Highest resident set size of the workers used (over their lifetime), in bytes
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(page for page in self.pages if page)
+
+    @property
+    def page_spans(self) -> list[tuple[int, int]]:
+        """Offset and length of each page's text within text (0 length for empty pages)."""
+        spans = []
+        offset = 0
+        for page in self.pages:
+            spans.append((offset, len(page)))
+            if page:
+                offset += len(page) + 1
+        return spans
+
+
+# Worker process entry points (module level so they can be pickled)
+
+def _init_worker(memory_limit: int) -> None:
+    """Apply the per-document memory budget to a worker process."""
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def _peak_rss() -> int:
+    """Get the peak resident set size of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux reports KiB
+
+
+def _probe(backend_name: str, path: str, stop: int, use_mmap: bool) -> tuple[int, list[str], int]:
+    """Count pages and extract the first chunk in one pass."""
+    backend = get_backend(backend_name)
+    with open_blob(path, use_mmap) as stream:
+        page_count = backend.page_count(stream)
+        pages = backend.extract_pages(stream, 0, min(stop, page_count))
+    return page_count, pages, _peak_rss()
+
+
+def _extract_range(backend_name: str, path: str, start: int, stop: int, use_mmap: bool) -> tuple[list[str], int]:
+    with open_blob(path, use_mmap) as stream:
+        pages = get_backend(backend_name).extract_pages(stream, start, stop)
+    return pages, _peak_rss()
+
+
+class ExtractionEngine:
+    """Runs a backend over documents in a pool of budgeted worker processes.
+
+    The pool is started on first use and shared by every document and thread
+    until close(). A document that exceeds its time budget retires the pool:
+    later documents get a fresh one, and the old one is terminated (killing
+    the stuck worker) once the documents still using it are done.
+    """
+
+    def __init__(
+        self,
+        backend: str = "auto",
+        workers: int = 1,
+        pages_per_worker: int = 50,
+        timeout: float = 120,
+        memory_limit: int = 0,
+        start_method: str = "forkserver",
+        use_mmap: bool = True,
+    ):
+        # Resolve 'auto' once so every worker uses the same library
+        self.backend = get_backend(backend).name
+        self.workers = max(1, workers)
+        self.pages_per_worker = max(1, pages_per_worker)
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.use_mmap = use_mmap
+        self.context = multiprocessing.get_context(start_method)
+        self._pool = None
+        self._pool_pid = None
+        self._users: dict = {}  # Documents using each pool, retired ones included
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, **overrides) -> "ExtractionEngine":
+        """Create an engine from Flask configuration."""
+        options = {
+            "backend": config["PDF_EXTRACTOR"],
+            "workers": config["PDF_EXTRACT_WORKERS"],
+            "pages_per_worker": config["PDF_EXTRACT_PAGES_PER_WORKER"],
+            "timeout": config["PDF_EXTRACT_TIMEOUT"],
+            "memory_limit": config["PDF_EXTRACT_MEMORY_LIMIT"],
+            "start_method": config["PDF_EXTRACT_START_METHOD"],
+            "use_mmap": config["PDF_EXTRACT_MMAP"],
+        }
+        options.update(overrides)
+        return cls(**options)
+
+    def __enter__(self) -> "ExtractionEngine":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @contextmanager
+    def _borrow_pool(self):
+        """Use the shared pool, starting it if needed; a timeout retires it."""
+        with self._lock:
+            if self._pool_pid != os.getpid():
+                # A forked child cannot use its parent's pool
+                self._pool, self._users = None, {}
+            if self._pool is None:
+                self._pool = self.context.Pool(
+                    processes=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.memory_limit,),
+                    maxtasksperchild=MAX_TASKS_PER_WORKER,
+                )
+                self._pool_pid = os.getpid()
+                self._users[self._pool] = 0
+            pool = self._pool
+            self._users[pool] += 1
+        try:
+            yield pool
+        except multiprocessing.TimeoutError:
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+        finally:
+            with self._lock:
+                self._users[pool] -= 1
+                done = pool is not self._pool and not self._users[pool]
+                if done:
+                    del self._users[pool]
+            if done:
+                pool.terminate()
+                pool.join()
+
+    def close(self) -> None:
+        """Stop the worker pool (it is terminated once documents still using it are done)."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            done = pool is not None and not self._users.get(pool)
+            if done:
+                del self._users[pool]
+        if done:
+            pool.terminate()
+            pool.join()
+
+    def run(self, func, *args):
+        """Run a single task in a budgeted worker process and return its result.
+
+        Raises multiprocessing.TimeoutError if the time budget is exceeded.
+        """
+        with self._borrow_pool() as pool:
+            return pool.apply_async(func, args).get(self.timeout)
+
+    def extract(self, path: str) -> ExtractionResult:
+        """Extract per-page text from a PDF within the time and memory budget."""
+        deadline = time.monotonic() + self.timeout
+
+        def remaining() -> float:
+            return max(0.0, deadline - time.monotonic())
+
+        try:
+            with self._borrow_pool() as pool:
+                # Small documents are handled entirely by the probe
+                page_count, pages, peak_rss = pool.apply_async(
+                    _probe, (self.backend, path, self.pages_per_worker, self.use_mmap)
+                ).get(remaining())
+
+                ranges = [
+                    (start, min(start + self.pages_per_worker, page_count))
+                    for start in range(len(pages), page_count, self.pages_per_worker)
+                ]
+                pending = [
+                    pool.apply_async(_extract_range, (self.backend, path, start, stop, self.use_mmap))
+                    for start, stop in ranges
+                ]
+                for result in pending:
+                    range_pages, range_rss = result.get(remaining())
+                    pages.extend(range_pages)
+                    peak_rss = max(peak_rss, range_rss)
+
+            return ExtractionResult(pages=pages, peak_rss=peak_rss)
+        except multiprocessing.TimeoutError:
+            return ExtractionResult(error=f"Extraction exceeded {self.timeout}s time budget")
+        except MemoryError:
+            return ExtractionResult(error="Extraction exceeded memory budget")
+        except Exception as e:
+            return ExtractionResult(error=f"{type(e).__name__}: {e}")
+
+
+def get_extraction_engine() -> ExtractionEngine:
+    """Get the application's engine, whose worker pool serves this whole process."""
+    engine = current_app.extensions.get("extraction_engine")
+    if engine is None:
+        with _engine_lock:
+            engine = current_app.extensions.get("extraction_engine")
+            if engine is None:
+                engine = ExtractionEngine.from_config(current_app.config)
+                current_app.extensions["extraction_engine"] = engine
+    return engine
+
+
+def extract_pdf(file_path: str) -> ExtractionResult:
+    """Extract text from a PDF file using the application's engine."""
+    result = get_extraction_engine().extract(file_path)
+    if not result.ok:
+        current_app.logger.warning(f"Failed to extract text from PDF {file_path}: {result.error}")
+    return result
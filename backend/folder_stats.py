@@ -0,0 +1,82 @@
+"""Recursive folder size and file-count aggregation.
+
+Totals cover a folder's whole subtree. They are computed from the
+materialized `Folder.path`, so a folder of any size is summarized with one
+aggregate query instead of walking the tree.
+"""
+
+from typing import Iterable
+
+from sqlalchemy import select, func, or_, and_
+from sqlalchemy.orm import aliased
+
+from models import db, File, Folder
+
+EMPTY_STATS = {"total_size": 0, "file_count": 0, "folder_count": 0}
+
+
+def _like_prefix(path):
+    """Build a LIKE pattern matching everything below a path column."""
+    escaped = func.replace(func.replace(func.replace(path, "\\", "\\\\"), "%", "\\%"), "_", "\\_")
+    return escaped + "/%"
+
+
+def get_folder_stats(folder_ids: Iterable[int]) -> dict[int, dict]:
+    """Get subtree totals for several folders with a single aggregate query."""
+    folder_ids = list(folder_ids)
+    if not folder_ids:
+        return {}
+
+    target = aliased(Folder)
+    descendant = aliased(Folder)
+    rows = db.session.execute(
+        select(
+            target.id,
+            func.coalesce(func.sum(File.file_size), 0).label("total_size"),
+            func.count(File.id).label("file_count"),
+            (func.count(descendant.id.distinct()) - 1).label("folder_count"),
+        )
+        .join(descendant, and_(
+            descendant.dataroom_id == target.dataroom_id,
+            or_(descendant.id == target.id, descendant.path.like(_like_prefix(target.path), escape="\\")),
+        ))
+        .outerjoin(File, File.folder_id == descendant.id)
+        .where(target.id.in_(folder_ids))
+        .group_by(target.id)
+    ).all()
+    return {
+        row.id: {"total_size": int(row.total_size), "file_count": row.file_count, "folder_count": row.folder_count}
+        for row in rows
+    }
+
+
+def rollup_folder_stats(folders: Iterable, files: Iterable) -> dict[int, dict]:
+    """Compute subtree totals for a fully loaded tree of folder and file rows."""
+    folders = list(folders)
+    stats = {folder.id: dict(EMPTY_STATS) for folder in folders}
+    for file in files:
+        if file.folder_id in stats:
+            stats[file.folder_id]["total_size"] += file.file_size
+            stats[file.folder_id]["file_count"] += 1
+
+    # Deepest folders first, so each folder is complete before it is added to its parent
+    parents = {folder.id: folder.parent_id for folder in folders}
+    depths = {}
+    for folder_id in parents:
+        chain = []
+        while folder_id in parents and folder_id not in depths:
+            chain.append(folder_id)
+            folder_id = parents[folder_id]
+        depth = depths.get(folder_id, -1)
+        for node in reversed(chain):
+            depth += 1
+            depths[node] = depth
+
+    for folder_id in sorted(depths, key=depths.get, reverse=True):
+        parent_id = parents[folder_id]
+        if parent_id in stats:
+            parent, own = stats[parent_id], stats[folder_id]
+            parent["total_size"] += own["total_size"]
+            parent["file_count"] += own["file_count"]
+            parent["folder_count"] += own["folder_count"] + 1
+    return stats
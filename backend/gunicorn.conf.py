@@ -0,0 +1,74 @@
+"""Gunicorn configuration for production serving.
+
+One pool serves every request: processes with a few threads each. Uploads,
+downloads and change streams hold a thread for as long as the client takes,
+so deployments with many slow clients should raise GUNICORN_THREADS (and
+DB_POOL_SIZE with it); the gthread worker's timeout only applies to a
+stuck worker, not to a long request.
+
+Every worker process also starts its own PDF_EXTRACT_WORKERS extraction
+processes on first use. Unless set explicitly, that number is derived here
+as cores // workers (at least 1), so the extraction processes of all
+workers together stay near the core count instead of multiplying with it.
+
+Graceful reload: `kill -HUP <master>` replaces workers after they finish
+in-flight requests. Because the app is preloaded, deploying new code needs
+`kill -USR2 <master>` (start a new master) followed by `kill -QUIT` on the
+old one.
+"""
+
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()  # Settings below may come from .env, like the app's (config.py)
+
+cores = multiprocessing.cpu_count()
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", cores * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+
+# Read by config.py when the app is loaded, after this file
+os.environ.setdefault("PDF_EXTRACT_WORKERS", str(max(1, cores // workers)))
+
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = max_requests // 10
+
+# Reload on code changes (development only); incompatible with preloading
+reload = os.getenv("GUNICORN_RELOAD", "false").lower() == "true"
+
+# Load the app once in the master so workers share its memory pages
+preload_app = not reload
+
+accesslog = "-"
+errorlog = "-"
+proc_name = "dataroom"
+
+
+def post_fork(server, worker):
+    """Drop database connections (primary and replicas) inherited from the master.
+
+    The master connects while preloading (migrations), and a socket shared
+    between processes corrupts the protocol stream. close=False leaves the
+    master's connections alone and gives this worker a fresh pool.
+    """
+    from models import db
+
+    app = worker.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
+    app.extensions["replicas"].dispose()
+
+
+def worker_exit(server, worker):
+    """Write the worker's buffered audit events before it exits."""
+    app = worker.app.wsgi()
+    app.extensions["audit_log"].shutdown()
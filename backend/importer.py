@@ -0,0 +1,451 @@
+"""Bulk import of ZIP archives of PDFs into a dataroom.
+
+An import is a job row (ImportJob) that survives restarts:
+
+- the archive is streamed to disk in chunks, never buffered in memory, and
+  kept under UPLOAD_FOLDER/imports until the job completes;
+- the archive's folder hierarchy is created up front with one bulk insert
+  per depth level, reusing folders that already exist at the same path;
+- PDFs go through a pipeline: the runner decompresses each member into a
+  staging file (zipfile verifies the member's CRC-32 while doing so) while a
+  thread pool extracts text in budgeted worker processes and moves the
+  staged files into storage;
+- every IMPORT_BATCH_SIZE entries the files, their pages and the job's
+  progress are committed together, after reserving the batch's size against
+  the dataroom owner's quota.
+
+Entries are processed in a fixed order and stored under keys derived from
+the job and the entry, so a job that failed or whose process died resumes
+after its last committed batch and simply redoes an interrupted one.
+"""
+
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+from flask import current_app
+from sqlalchemy import and_, insert, or_, select, update
+from werkzeug.utils import secure_filename
+
+from models import db, get_utc_now, DataRoom, File, FilePage, Folder, ImportJob
+from acl import folder_path
+from background import run_in_background
+from changes import record_change
+from extraction import ExtractionResult, get_extraction_engine
+from quota import charge_storage, reserve_storage
+from similarity import index_files
+from storage import StorageBackend, get_storage
+from text_store import store_texts
+from thumbnails import generate_preview
+
+CHUNK_SIZE = 1024 * 1024
+IGNORED_NAMES = {"__MACOSX", "Thumbs.db", "desktop.ini"}  # OS metadata, never user documents
+MAX_PATH_LENGTH = 1000  # Folder.path
+
+
+class ArchiveError(Exception):
+    """The archive cannot be imported."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class ArchiveEntry:
+    """A PDF of the archive and where it goes."""
+
+    index: int  # Position in import order
+    member: zipfile.ZipInfo
+    folder: tuple[str, ...]  # Folder names below the import's target folder
+    name: str
+
+
+def get_archive_path(archive_file: str) -> Path:
+    """Get the path of a saved import archive."""
+    return Path(current_app.config["UPLOAD_FOLDER"]) / "imports" / archive_file
+
+
+def save_archive(stream: BinaryIO, max_size: int) -> tuple[str, int]:
+    """Copy an archive stream to disk in chunks; returns the saved file name and its size.
+
+    Raises ArchiveError, leaving nothing behind, if it exceeds `max_size` bytes
+    or is not a ZIP archive.
+    """
+    archive_file = f"{uuid.uuid4().hex}.zip"
+    path = get_archive_path(archive_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    size = 0
+    try:
+        with open(path, "wb") as fp:
+            while chunk := stream.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise ArchiveError(f"Archive exceeds {max_size} bytes", 413)
+                fp.write(chunk)
+        if not zipfile.is_zipfile(path):
+            raise ArchiveError("Not a ZIP archive")
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return archive_file, size
+
+
+def create_import_job(
+    dataroom_id: int,
+    folder_id: Optional[int],
+    user_id: int,
+    stream: BinaryIO,
+    archive_name: str,
+    declared_size: Optional[int] = None,
+) -> ImportJob:
+    """Save an archive and create its pending import job (committed).
+
+    The archive's declared size (IMPORT_MAX_ARCHIVE_SIZE if unknown) is
+    reserved against the dataroom owner's quota while it is received, so an
+    archive that cannot fit is rejected with a 413 before any of it is read.
+    The reservation is released once the archive is saved; batches reserve
+    the sizes of the files they store. The archive is saved before the job
+    row is inserted, so no transaction stays open while a large body is
+    received.
+    """
+    max_size = current_app.config["IMPORT_MAX_ARCHIVE_SIZE"]
+    reserved = declared_size or max_size
+    owner_id = db.session.execute(select(DataRoom.owner_id).where(DataRoom.id == dataroom_id)).scalar_one()
+    if not reserve_storage(owner_id, reserved):
+        db.session.rollback()
+        raise ArchiveError("Storage quota exceeded", 413)
+    db.session.commit()
+
+    try:
+        archive_file, archive_size = save_archive(stream, min(reserved, max_size))
+    finally:
+        charge_storage(owner_id, -reserved)
+        db.session.commit()
+    job = ImportJob(
+        dataroom_id=dataroom_id,
+        folder_id=folder_id,
+        user_id=user_id,
+        archive_name=archive_name[:255] or "archive.zip",
+        archive_file=archive_file,
+        archive_size=archive_size,
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        get_archive_path(archive_file).unlink(missing_ok=True)
+        raise
+    return job
+
+
+def plan_entries(
+    archive: zipfile.ZipFile, max_file_size: int, base_path: str = ""
+) -> tuple[list[ArchiveEntry], int]:
+    """List the PDFs of an archive in import order; returns them and the number of skipped members.
+
+    Skipped are non-PDFs, hidden files, OS metadata, encrypted members,
+    members larger than `max_file_size`, names escaping the archive root and
+    folders whose path below `base_path` would be too long.
+    """
+    entries = []
+    skipped = 0
+    for member in sorted(archive.infolist(), key=lambda member: member.filename):
+        if member.is_dir():
+            continue
+        parts = [part for part in member.filename.replace("\\", "/").split("/") if part not in ("", ".")]
+        name = secure_filename(parts[-1]) if parts else ""
+        folder = tuple(part[:255] for part in parts[:-1])
+        if (
+            not name.lower().endswith(".pdf")
+            or ".." in parts
+            or any(part.startswith(".") or part in IGNORED_NAMES for part in parts)
+            or member.flag_bits & 0x1  # Encrypted
+            or member.file_size > max_file_size
+            or len(f"{base_path}/{'/'.join(folder)}") > MAX_PATH_LENGTH
+        ):
+            skipped += 1
+            continue
+        entries.append(ArchiveEntry(index=len(entries), member=member, folder=folder, name=name))
+    return entries, skipped
+
+
+def ensure_folders(
+    dataroom_id: int, base: Optional[Folder], folders: set[tuple[str, ...]]
+) -> dict[tuple[str, ...], Optional[int]]:
+    """Create the folders below `base` that do not exist yet, one bulk insert per depth level.
+
+    Returns the folder id of every requested folder and its ancestors, keyed
+    by names relative to `base` (() is `base` itself).
+    """
+    base_path = base.path if base else ""
+    folder_ids: dict[tuple[str, ...], Optional[int]] = {(): base.id if base else None}
+    wanted = {folder[:depth] for folder in folders for depth in range(1, len(folder) + 1)}
+    if not wanted:
+        return folder_ids
+
+    stmt = select(Folder.id, Folder.path).where(Folder.dataroom_id == dataroom_id)
+    if base:
+        stmt = stmt.where(Folder.path.startswith(f"{base_path}/", autoescape=True))
+    existing = {row.path: row.id for row in db.session.execute(stmt)}
+
+    for depth in range(1, max(len(folder) for folder in wanted) + 1):
+        level = sorted(folder for folder in wanted if len(folder) == depth)
+        rows = []
+        for folder in level:
+            path = f"{base_path}/{'/'.join(folder)}"
+            if path in existing:
+                folder_ids[folder] = existing[path]
+            else:
+                now = get_utc_now()
+                rows.append({
+                    "name": folder[-1],
+                    "parent_id": folder_ids[folder[:-1]],
+                    "dataroom_id": dataroom_id,
+                    "path": path,
+                    "created_at": now,
+                    "updated_at": now,
+                })
+        if not rows:
+            continue
+
+        new_ids = db.session.execute(
+            insert(Folder).returning(Folder.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        for row, folder_id in zip(rows, new_ids):
+            folder_ids[tuple(row["path"][len(base_path) + 1:].split("/"))] = folder_id
+            record_change(dataroom_id, "folder", folder_id, "created", {
+                **row,
+                "id": folder_id,
+                "created_at": row["created_at"].isoformat(),
+                "updated_at": row["updated_at"].isoformat(),
+            }, path=row["path"])
+    return folder_ids
+
+
+def unique_name(name: str, taken: set[str]) -> str:
+    """Pick a name not in `taken` ("name (1).pdf", ...) and add it to `taken`."""
+    candidate = name
+    stem, ext = os.path.splitext(name)
+    counter = 1
+    while candidate in taken:
+        candidate = f"{stem} ({counter}){ext}"
+        counter += 1
+    taken.add(candidate)
+    return candidate
+
+
+def stage_entry(archive: zipfile.ZipFile, entry: ArchiveEntry, staging_dir: Path) -> Optional[str]:
+    """Decompress an entry into a staging file; None if the member is corrupt."""
+    fd, staged_path = tempfile.mkstemp(dir=staging_dir, suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as dst, archive.open(entry.member) as src:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError) as e:
+        os.unlink(staged_path)
+        current_app.logger.warning(f"Skipping corrupt archive member {entry.member.filename}: {e}")
+        return None
+    except BaseException:
+        os.unlink(staged_path)
+        raise
+    return staged_path
+
+
+def get_entry_key(storage: StorageBackend, job: ImportJob, entry: ArchiveEntry) -> str:
+    """Get the storage key of an entry; the same on every run of the job."""
+    return storage.make_key(job.dataroom_id, f"import-{job.id}-{entry.index}.pdf")
+
+
+def is_resumable():
+    """SQL condition for jobs that may be (re)started: pending, failed or stale.
+
+    A running job whose heartbeat (updated_at) is older than
+    IMPORT_STALE_SECONDS is assumed to have lost its process.
+    """
+    stale = get_utc_now() - timedelta(seconds=current_app.config["IMPORT_STALE_SECONDS"])
+    return or_(
+        ImportJob.status.in_(("pending", "failed")),
+        and_(ImportJob.status == "running", ImportJob.updated_at < stale),
+    )
+
+
+def get_resumable_jobs() -> list[int]:
+    """Get the ids of all jobs that may be (re)started, oldest first."""
+    return db.session.execute(select(ImportJob.id).where(is_resumable()).order_by(ImportJob.id)).scalars().all()
+
+
+def claim_job(job_id: int) -> bool:
+    """Mark a job running unless it is completed or another process is running it."""
+    claimed = db.session.execute(
+        update(ImportJob)
+        .where(ImportJob.id == job_id, is_resumable())
+        .values(status="running", error=None, updated_at=get_utc_now())
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    db.session.commit()
+    return claimed
+
+
+def run_import(
+    job_id: int, progress: Optional[Callable[[ImportJob], None]] = None, previews: bool = True
+) -> Optional[ImportJob]:
+    """Run or resume an import job; `progress` is called after every committed batch.
+
+    With `previews`, thumbnails are rendered in the background as batches
+    commit; otherwise `flask generate-previews` fills them in later. Returns the job, or None if it could not be claimed.
+    """
+    if not claim_job(job_id):
+        return None
+    job = db.session.get(ImportJob, job_id)
+
+    try:
+        with zipfile.ZipFile(get_archive_path(job.archive_file)) as archive:
+            import_archive(job, archive, progress, previews)
+    except Exception as e:
+        db.session.rollback()
+        if isinstance(e, (ArchiveError, zipfile.BadZipFile, FileNotFoundError)):
+            error = str(e)
+        else:
+            current_app.logger.exception(f"Import job {job_id} failed")
+            error = f"{type(e).__name__}: {e}"
+        job = db.session.get(ImportJob, job_id)
+        if job is None:
+            return None  # Deleted with its dataroom
+        job.status = "failed"
+        job.error = error
+        db.session.commit()
+        return job
+
+    job.status = "completed"
+    job.completed_at = get_utc_now()
+    db.session.commit()
+    get_archive_path(job.archive_file).unlink(missing_ok=True)
+    return job
+
+
+def import_archive(
+    job: ImportJob,
+    archive: zipfile.ZipFile,
+    progress: Optional[Callable[[ImportJob], None]] = None,
+    previews: bool = True,
+) -> None:
+    """Import the entries of an archive not yet committed by earlier runs of the job."""
+    config = current_app.config
+    storage = get_storage()
+    staging_dir = storage.staging_dir()
+
+    base = db.session.get(Folder, job.folder_id) if job.folder_id else None
+    entries, skipped = plan_entries(archive, config["MAX_CONTENT_LENGTH"], base.path if base else "")
+    folder_ids = ensure_folders(job.dataroom_id, base, {entry.folder for entry in entries})
+    job.total_entries = len(entries)
+    job.skipped_entries = skipped
+    db.session.commit()
+    if progress:
+        progress(job)
+
+    # Files count toward the dataroom owner's quota
+    owner_id = db.session.execute(select(DataRoom.owner_id).where(DataRoom.id == job.dataroom_id)).scalar_one()
+    taken_names: dict[Optional[int], set[str]] = {}
+
+    def get_taken_names(folder_id: Optional[int]) -> set[str]:
+        if folder_id not in taken_names:
+            taken_names[folder_id] = set(db.session.execute(
+                select(File.name).where(File.dataroom_id == job.dataroom_id, File.folder_id == folder_id)
+            ).scalars())
+        return taken_names[folder_id]
+
+    # Parallelism is across documents, extracted by the process's shared
+    # pool of budgeted workers
+    engine = get_extraction_engine()
+
+    def ingest(staged_path: str, key: str) -> ExtractionResult:
+        try:
+            extraction = engine.extract(staged_path)
+            storage.put_file(Path(staged_path), key)
+        finally:
+            Path(staged_path).unlink(missing_ok=True)
+        return extraction
+
+    batch_size = config["IMPORT_BATCH_SIZE"]
+    with ThreadPoolExecutor(max_workers=config["PDF_EXTRACT_WORKERS"]) as executor:
+        for start in range(job.processed_entries, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            reserved = sum(entry.member.file_size for entry in batch)
+            if not reserve_storage(owner_id, reserved):
+                db.session.rollback()
+                raise ArchiveError("Storage quota exceeded", 413)
+            db.session.commit()
+
+            try:
+                # Decompression here overlaps with extraction and storing in the pool
+                pending: list[tuple[ArchiveEntry, str, Optional[Future]]] = []
+                for entry in batch:
+                    key = get_entry_key(storage, job, entry)
+                    staged_path = stage_entry(archive, entry, staging_dir)
+                    pending.append((entry, key, executor.submit(ingest, staged_path, key) if staged_path else None))
+
+                files = []
+                texts = []
+                for entry, key, future in pending:
+                    if future is None:
+                        continue
+                    extraction = future.result()
+                    if not extraction.ok:
+                        current_app.logger.warning(
+                            f"Failed to extract text from {entry.member.filename}: {extraction.error}"
+                        )
+                    folder_id = folder_ids[entry.folder]
+                    files.append(File(
+                        name=unique_name(entry.name, get_taken_names(folder_id)),
+                        original_name=entry.name,
+                        folder_id=folder_id,
+                        dataroom_id=job.dataroom_id,
+                        file_path=key,
+                        file_size=entry.member.file_size,
+                        mime_type="application/pdf",
+                        page_count=extraction.page_count if extraction.ok else None,
+                        pages=[
+                            FilePage(page_number=number, text_offset=offset, text_length=length)
+                            for number, (offset, length) in enumerate(extraction.page_spans, start=1)
+                        ],
+                    ))
+                    texts.append(extraction.text)
+
+                db.session.add_all(files)
+                db.session.flush()
+                documents = [(file.id, text) for file, text in zip(files, texts)]
+                store_texts(documents)
+                index_files(documents)
+                for file in files:
+                    record_change(job.dataroom_id, "file", file.id, "created", file.to_dict(), path=folder_path(file))
+
+                # True up the reservation; corrupt members were never stored
+                stored = sum(file.file_size for file in files)
+                charge_storage(owner_id, stored - reserved)
+                job.processed_entries = start + len(batch)
+                job.imported_files += len(files)
+                job.failed_entries += len(batch) - len(files)
+                job.bytes_imported += stored
+                db.session.commit()
+            except BaseException:
+                db.session.rollback()
+                taken_names.clear()
+                charge_storage(owner_id, -reserved)
+                db.session.commit()
+                raise
+
+            # Thumbnails are rendered after the batch
+            if previews:
+                for file in files:
+                    run_in_background(generate_preview, file.id)
+            if progress:
+                progress(job)
@@ -0,0 +1,183 @@
+"""Local stand-in for Google's OAuth endpoints, for offline load tests.
+
+Implements just enough of the authorization-code flow used by
+routes/auth.py:
+
+- GET  /authorize  redirects to redirect_uri with a code; the identity is
+  taken from the `login_hint` parameter (any email), so every virtual user
+  of a load test can log in as someone different without a consent screen;
+- POST /token      exchanges the code for an access token and an RS256 ID
+  token, signed with a key generated at startup;
+- GET  /certs      serves that key as a JWKS;
+- GET  /userinfo   returns the profile for a bearer access token.
+
+Codes and tokens encode the email itself, so the server keeps no state and
+handles any number of concurrent logins. Point the backend at it with:
+
+    GOOGLE_AUTH_URL=http://localhost:8090/authorize
+    GOOGLE_TOKEN_URL=http://localhost:8090/token
+    GOOGLE_USERINFO_URL=http://localhost:8090/userinfo
+    GOOGLE_JWKS_URL=http://localhost:8090/certs
+    GOOGLE_ISSUERS=http://localhost:8090
+    GOOGLE_CLIENT_ID=loadtest
+
+`--delay` slows the token endpoint down, to exercise the backend's timeouts.
+
+Never expose it outside a test environment: it authenticates anyone as
+anyone.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+CODE_PREFIX = "fake-code-"
+TOKEN_PREFIX = "fake-token-"
+KEY_ID = "fake-oauth-key"
+
+
+def encode_identity(prefix: str, email: str) -> str:
+    return prefix + base64.urlsafe_b64encode(email.encode()).decode().rstrip("=")
+
+
+def user_id(email: str) -> str:
+    return hashlib.sha256(email.encode()).hexdigest()[:21]
+
+
+def decode_identity(prefix: str, value: str) -> str | None:
+    if not value.startswith(prefix):
+        return None
+    encoded = value[len(prefix):]
+    try:
+        return base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+    except ValueError:
+        return None
+
+
+class FakeOAuthHandler(BaseHTTPRequestHandler):
+    """Request handler for the three OAuth endpoints."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoints
+    issuer = "http://localhost:8090"
+    delay = 0.0
+    signing_key = None  # Set by main()
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/authorize":
+            self.authorize(params)
+        elif url.path == "/userinfo":
+            self.userinfo()
+        elif url.path == "/certs":
+            self.certs()
+        else:
+            self.send_json(404, {"error": "not_found"})
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != "/token":
+            self.send_json(404, {"error": "not_found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        email = decode_identity(CODE_PREFIX, form.get("code", ""))
+        if form.get("grant_type") != "authorization_code" or email is None:
+            self.send_json(400, {"error": "invalid_grant"})
+            return
+        if self.delay:
+            time.sleep(self.delay)
+        now = int(time.time())
+        id_token = jwt.encode(
+            {
+                "iss": self.issuer,
+                "aud": form.get("client_id", ""),
+                "sub": user_id(email),
+                "email": email,
+                "email_verified": True,
+                "name": email.split("@")[0],
+                "iat": now,
+                "exp": now + 3600,
+            },
+            self.signing_key,
+            algorithm="RS256",
+            headers={"kid": KEY_ID},
+        )
+        self.send_json(200, {
+            "access_token": encode_identity(TOKEN_PREFIX, email),
+            "id_token": id_token,
+            "token_type": "Bearer",
+            "expires_in": 3600,
+        })
+
+    def authorize(self, params: dict) -> None:
+        email = params.get("login_hint")
+        redirect_uri = params.get("redirect_uri")
+        if not email or not redirect_uri:
+            self.send_json(400, {"error": "login_hint and redirect_uri are required"})
+            return
+        separator = "&" if "?" in redirect_uri else "?"
+        code = encode_identity(CODE_PREFIX, email)
+        self.send_response(302)
+        self.send_header("Location", f"{redirect_uri}{separator}{urlencode({'code': code})}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def userinfo(self) -> None:
+        authorization = self.headers.get("Authorization", "")
+        email = decode_identity(TOKEN_PREFIX, authorization.removeprefix("Bearer "))
+        if email is None:
+            self.send_json(401, {"error": "invalid_token"})
+            return
+        self.send_json(200, {
+            "id": user_id(email),
+            "email": email,
+            "verified_email": True,
+            "name": email.split("@")[0],
+        })
+
+    def certs(self) -> None:
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.signing_key.public_key()))
+        self.send_json(200, {"keys": [{**jwk, "kid": KEY_ID, "use": "sig", "alg": "RS256"}]})
+
+    def send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # One line per request would dominate a load test's output
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--issuer", default=None, help="ID-token issuer (default: http://localhost:PORT).")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds the token endpoint waits before answering.")
+    args = parser.parse_args()
+
+    FakeOAuthHandler.issuer = args.issuer or f"http://localhost:{args.port}"
+    FakeOAuthHandler.delay = args.delay
+    FakeOAuthHandler.signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeOAuthHandler)
+    server.daemon_threads = True
+    print(f"Fake OAuth server listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""Concurrent end-to-end load test of the backend API.
+
+Each virtual user logs in through the OAuth flow (against loadtest/fake_oauth.py),
+creates a dataroom with a few folders and files, then loops over a weighted
+mix of browse, search, upload and download requests until the test ends.
+Per-endpoint throughput, p50/p99 latency and error rate are printed at the
+end (and optionally written as JSON).
+
+Usage, against the docker-compose stack started with the loadtest profile:
+
+    python loadtest/run.py --base-url http://localhost:5001 --users 50 --duration 60
+
+Only `requests` is needed; the script does not import the backend.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import requests
+
+# Words the generated PDFs are made of; searches pick from the same list so they match
+VOCABULARY = (
+    "agreement balance capital diligence escrow financial guarantee indemnity liability "
+    "merger notice obligation payment quarterly revenue schedule termination valuation warranty"
+).split()
+
+# Relative weight of each action in a virtual user's loop
+ACTIONS = {"browse": 5, "search": 2, "upload": 1, "download": 2}
+
+
+def make_pdf(words: int, rng: random.Random) -> bytes:
+    """Build a small valid single-page PDF with random vocabulary text."""
+    text = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+    stream = f"BT /F1 10 Tf 40 760 Td ({text}) Tj ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return pdf
+
+
+@dataclass
+class EndpointStats:
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    statuses: dict = field(default_factory=lambda: defaultdict(int))
+
+
+class Recorder:
+    """Thread-safe collection of request outcomes per endpoint."""
+
+    def __init__(self):
+        self.endpoints: dict[str, EndpointStats] = defaultdict(EndpointStats)
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record(self, endpoint: str, latency: float, status: int | None) -> None:
+        with self.lock:
+            stats = self.endpoints[endpoint]
+            stats.latencies.append(latency)
+            stats.statuses[status or "exception"] += 1
+            if status is None or status >= 400:
+                stats.errors += 1
+
+    def report(self) -> dict:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        rows = {}
+        with self.lock:
+            for endpoint, stats in sorted(self.endpoints.items()):
+                rows[endpoint] = summarize(stats.latencies, stats.errors, elapsed, dict(stats.statuses))
+            everything = [latency for stats in self.endpoints.values() for latency in stats.latencies]
+            errors = sum(stats.errors for stats in self.endpoints.values())
+        return {"elapsed_s": round(elapsed, 1), "endpoints": rows, "total": summarize(everything, errors, elapsed, {})}
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def summarize(latencies: list, errors: int, elapsed: float, statuses: dict) -> dict:
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        **({"statuses": {str(status): n for status, n in statuses.items()}} if statuses else {}),
+    }
+
+
+class VirtualUser(threading.Thread):
+    """One simulated user with its own HTTP session."""
+
+    def __init__(self, number: int, args: argparse.Namespace, recorder: Recorder, stop: threading.Event):
+        super().__init__(name=f"vu-{number}", daemon=True)
+        self.number = number
+        self.args = args
+        self.recorder = recorder
+        self.stop = stop
+        self.rng = random.Random(args.seed * 100003 + number)
+        self.session = requests.Session()
+        self.dataroom_id = None
+        self.folder_ids: list[int] = []
+        self.file_ids: list[int] = []
+        self.failed: str | None = None
+
+    def request(self, endpoint: str, method: str, path: str, **kwargs) -> requests.Response | None:
+        """Send a request to the backend and record it under an endpoint label."""
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, self.args.base_url + path, timeout=self.args.timeout, **kwargs)
+            if not kwargs.get("stream"):
+                response.content  # Latency includes reading the whole body
+            else:
+                for _ in response.iter_content(65536):
+                    pass
+        except requests.RequestException:
+            self.recorder.record(endpoint, time.monotonic() - started, None)
+            return None
+        self.recorder.record(endpoint, time.monotonic() - started, response.status_code)
+        return response
+
+    def login(self) -> None:
+        """Log in through /api/auth/login, the OAuth stand-in and /api/auth/callback."""
+        response = self.request("GET /api/auth/login", "GET", "/api/auth/login")
+        if response is None or response.status_code != 200:
+            raise RuntimeError("login URL request failed (is GOOGLE_CLIENT_ID set?)")
+        auth_url = response.json()["auth_url"]
+        email = f"vu-{self.args.run_id}-{self.number}@{self.args.email_domain}"
+        consent = self.session.get(f"{auth_url}&{urlencode({'login_hint': email})}", allow_redirects=False,
+                                   timeout=self.args.timeout)
+        code = parse_qs(urlparse(consent.headers.get("Location", "")).query).get("code")
+        if not code:
+            raise RuntimeError(f"OAuth stand-in returned no code (status {consent.status_code}); "
+                               "is GOOGLE_AUTH_URL pointing at loadtest/fake_oauth.py?")
+
+        response = self.request("GET /api/auth/callback", "GET", "/api/auth/callback",
+                                params={"code": code[0]}, allow_redirects=False)
+        location = response.headers.get("Location", "") if response is not None else ""
+        token = parse_qs(urlparse(location).query).get("token")
+        if not token:
+            raise RuntimeError("OAuth callback returned no token")
+        self.session.headers["Authorization"] = f"Bearer {token[0]}"
+
+    def setup(self) -> None:
+        """Create the user's dataroom with a few folders and files."""
+        response = self.request("POST /api/datarooms", "POST", "/api/datarooms",
+                                json={"name": f"Load test {self.args.run_id} #{self.number}"})
+        if response is None or response.status_code != 201:
+            raise RuntimeError("could not create a dataroom")
+        self.dataroom_id = response.json()["dataroom"]["id"]
+        for i in range(self.args.folders):
+            response = self.request("POST /api/folders", "POST", "/api/folders",
+                                    json={"name": f"folder-{i}", "dataroom_id": self.dataroom_id})
+            if response is not None and response.status_code == 201:
+                self.folder_ids.append(response.json()["folder"]["id"])
+        for _ in range(self.args.initial_files):
+            self.upload()
+
+    def browse(self) -> None:
+        self.request("GET /api/datarooms", "GET", "/api/datarooms")
+        self.request("GET /api/datarooms/:id/structure", "GET", f"/api/datarooms/{self.dataroom_id}/structure")
+        if self.folder_ids:
+            folder_id = self.rng.choice(self.folder_ids)
+            self.request("GET /api/folders/:id/contents", "GET", f"/api/folders/{folder_id}/contents")
+
+    def search(self) -> None:
+        params = {"q": self.rng.choice(VOCABULARY)}
+        if self.rng.random() < 0.5:
+            params["dataroom_id"] = self.dataroom_id
+        self.request("GET /api/search", "GET", "/api/search", params=params)
+
+    def upload(self) -> None:
+        data = {"dataroom_id": self.dataroom_id}
+        if self.folder_ids:
+            data["folder_id"] = self.rng.choice(self.folder_ids)
+        pdf = make_pdf(self.args.pdf_words, self.rng)
+        name = f"doc-{self.rng.getrandbits(48):012x}.pdf"
+        response = self.request("POST /api/files", "POST", "/api/files", data=data,
+                                files={"file": (name, pdf, "application/pdf")})
+        if response is not None and response.status_code == 201:
+            self.file_ids.append(response.json()["file"]["id"])
+
+    def download(self) -> None:
+        if not self.file_ids:
+            self.upload()
+            return
+        file_id = self.rng.choice(self.file_ids)
+        self.request("GET /api/files/:id/download", "GET", f"/api/files/{file_id}/download", stream=True)
+
+    def cleanup(self) -> None:
+        if self.dataroom_id is not None:
+            self.request("DELETE /api/datarooms/:id", "DELETE", f"/api/datarooms/{self.dataroom_id}")
+
+    def run(self) -> None:
+        try:
+            self.login()
+            self.setup()
+        except (RuntimeError, requests.RequestException, ValueError, KeyError) as e:
+            self.failed = str(e)
+            return
+
+        actions = list(ACTIONS)
+        weights = [ACTIONS[action] for action in actions]
+        while not self.stop.is_set():
+            getattr(self, self.rng.choices(actions, weights)[0])()
+            if self.args.think_time:
+                self.stop.wait(self.rng.expovariate(1 / self.args.think_time))
+
+        if self.args.cleanup:
+            self.cleanup()
+        self.session.close()
+
+
+def print_report(report: dict) -> None:
+    header = f"{'Endpoint':<36} {'Requests':>9} {'Req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'Max ms':>9} {'Errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, row in [*report["endpoints"].items(), ("Total", report["total"])]:
+        print(
+            f"{endpoint:<36} {row['requests']:>9} {row['throughput_rps']:>8.1f} {row['p50_ms']:>9.1f} "
+            f"{row['p99_ms']:>9.1f} {row['max_ms']:>9.1f} {row['error_rate']:>8.2%}"
+        )
+    print(f"\nElapsed {report['elapsed_s']}s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Concurrent end-to-end load test of the backend API.")
+    parser.add_argument("--base-url", default="http://localhost:5001", help="Backend URL (default: %(default)s).")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users (default: %(default)s).")
+    parser.add_argument("--duration", type=float, default=60,
+                        help="Seconds of load, ramp-up included (default: %(default)s).")
+    parser.add_argument("--ramp-up", type=float, default=10,
+                        help="Seconds over which users start (default: %(default)s).")
+    parser.add_argument("--think-time", type=float, default=0.2,
+                        help="Mean seconds between a user's actions, 0 for none (default: %(default)s).")
+    parser.add_argument("--folders", type=int, default=5, help="Folders each user creates (default: %(default)s).")
+    parser.add_argument("--initial-files", type=int, default=5,
+                        help="Files each user uploads first (default: %(default)s).")
+    parser.add_argument("--pdf-words", type=int, default=200, help="Words per uploaded PDF (default: %(default)s).")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="Per-request timeout in seconds (default: %(default)s).")
+    parser.add_argument("--email-domain", default="loadtest.example.com", help="Domain of virtual users' emails.")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: %(default)s).")
+    parser.add_argument("--no-cleanup", dest="cleanup", action="store_false", help="Keep the datarooms created.")
+    parser.add_argument("--json", dest="json_path", help="Also write the report as JSON to this file.")
+    parser.add_argument("--max-error-rate", type=float, default=None,
+                        help="Exit with status 1 if the overall error rate is higher (e.g. 0.01).")
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+    args.run_id = f"{int(time.time()):x}"
+
+    recorder = Recorder()
+    stop = threading.Event()
+    users = [VirtualUser(number, args, recorder, stop) for number in range(args.users)]
+    print(f"Starting {args.users} virtual users against {args.base_url} for {args.duration:.0f}s")
+    for user in users:
+        user.start()
+        if stop.wait(args.ramp_up / max(args.users, 1)):
+            break
+    try:
+        stop.wait(max(0.0, args.duration - args.ramp_up))
+    except KeyboardInterrupt:
+        print("Interrupted, stopping virtual users")
+    stop.set()
+    recorder.finished = time.monotonic()
+    for user in users:
+        user.join(timeout=args.timeout + 5)
+
+    failed = [user for user in users if user.failed]
+    if failed:
+        print(f"{len(failed)} virtual users could not start, e.g. {failed[0].name}: {failed[0].failed}")
+
+    report = recorder.report()
+    report["failed_users"] = len(failed)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.max_error_rate is not None and report["total"]["error_rate"] > args.max_error_rate:
+        print(f"Error rate {report['total']['error_rate']:.2%} exceeds {args.max_error_rate:.2%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Schema migrations (Alembic) applied from the application.
+
+The schema is defined by the models and versioned in migrations/. A
+database created before migrations existed (by `db.create_all()`) has the
+baseline tables but no alembic_version table: it is stamped at the
+baseline revision first, then upgraded like any other.
+
+On PostgreSQL, migrations run under an advisory lock, so several processes
+starting at once (gunicorn masters, containers) apply them only once.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from alembic import command
+from alembic.config import Config as AlembicConfig
+from flask import Flask
+from sqlalchemy import inspect, text
+
+from models import db
+
+BACKEND_DIR = Path(__file__).parent
+BASELINE_REVISION = "0001"
+MIGRATION_LOCK_ID = 7311041742  # Arbitrary key for pg_advisory_lock
+
+
+@contextmanager
+def migration_lock(connection) -> Iterator[None]:
+    """Hold the migration lock on a connection (no-op outside PostgreSQL; re-entrant)."""
+    if connection.dialect.name != "postgresql":
+        yield
+        return
+    connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_ID})
+    connection.commit()
+    try:
+        yield
+        connection.commit()
+    except Exception:
+        connection.rollback()  # A failed migration leaves the transaction aborted
+        raise
+    finally:
+        connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_ID})
+        connection.commit()
+
+
+def get_alembic_config(connection=None) -> AlembicConfig:
+    """Alembic configuration for backend/migrations, optionally bound to a connection."""
+    config = AlembicConfig(str(BACKEND_DIR / "alembic.ini"))
+    config.set_main_option("script_location", str(BACKEND_DIR / "migrations"))
+    config.attributes["configure_logger"] = False  # Keep the application's logging setup
+    config.attributes["connection"] = connection
+    return config
+
+
+def upgrade_database(app: Flask, revision: str = "head") -> None:
+    """Bring the application's database schema up to a revision."""
+    with app.app_context():
+        with db.engine.connect() as connection, migration_lock(connection):
+            tables = set(inspect(connection).get_table_names())
+            connection.commit()  # Alembic must own the transactions (some migrations leave them)
+            config = get_alembic_config(connection)
+            if "alembic_version" not in tables and "users" in tables:
+                app.logger.warning(f"Unversioned schema found, stamping revision {BASELINE_REVISION}")
+                command.stamp(config, BASELINE_REVISION)
+                connection.commit()
+            command.upgrade(config, revision)
+            connection.commit()
@@ -0,0 +1,54 @@
+"""Alembic environment: migrates the database configured in config.py."""
+
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from config import get_config
+from migrate import migration_lock
+from models import db
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
+
+target_metadata = db.metadata
+
+
+def get_url() -> str:
+    """Database URL: explicit -x url=..., else the application's DATABASE_URL."""
+    return context.get_x_argument(as_dictionary=True).get("url") or get_config().SQLALCHEMY_DATABASE_URI
+
+
+def run_migrations_offline() -> None:
+    """Emit migration SQL without connecting (alembic upgrade head --sql)."""
+    context.configure(url=get_url(), target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations(connection) -> None:
+    """Run migrations on a connection, serialized across processes."""
+    with migration_lock(connection):
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    """Run migrations on the application's database (or a connection passed in by migrate.py)."""
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        run_migrations(connection)
+        return
+
+    engine = create_engine(get_url(), poolclass=pool.NullPool)
+    with engine.connect() as connection:
+        run_migrations(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
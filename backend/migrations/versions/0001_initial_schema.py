@@ -0,0 +1,94 @@
+"""initial schema
+
+The schema as first released, before migrations existed. Databases created
+by `db.create_all()` at that point are stamped at this revision (see
+migrate.py); later tables and columns are added by the revisions after it.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 09:27:26.424280
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(length=255), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=True),
+    sa.Column('oauth_provider', sa.String(length=50), nullable=False),
+    sa.Column('oauth_id', sa.String(length=255), nullable=False),
+    sa.Column('avatar_url', sa.String(length=500), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('oauth_provider', 'oauth_id', name='unique_oauth_user')
+    )
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    op.create_table('datarooms',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_datarooms_owner_id'), 'datarooms', ['owner_id'], unique=False)
+    op.create_table('folders',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('parent_id', sa.Integer(), nullable=True),
+    sa.Column('dataroom_id', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(length=1000), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['dataroom_id'], ['datarooms.id'], ),
+    sa.ForeignKeyConstraint(['parent_id'], ['folders.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('dataroom_id', 'parent_id', 'name', name='unique_folder_per_parent')
+    )
+    op.create_index(op.f('ix_folders_dataroom_id'), 'folders', ['dataroom_id'], unique=False)
+    op.create_index(op.f('ix_folders_parent_id'), 'folders', ['parent_id'], unique=False)
+    op.create_index(op.f('ix_folders_path'), 'folders', ['path'], unique=False)
+    op.create_table('files',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('original_name', sa.String(length=255), nullable=False),
+    sa.Column('folder_id', sa.Integer(), nullable=True),
+    sa.Column('dataroom_id', sa.Integer(), nullable=False),
+    sa.Column('file_path', sa.String(length=500), nullable=False),
+    sa.Column('file_size', sa.BigInteger(), nullable=False),
+    sa.Column('mime_type', sa.String(length=100), nullable=False),
+    sa.Column('content_text', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['dataroom_id'], ['datarooms.id'], ),
+    sa.ForeignKeyConstraint(['folder_id'], ['folders.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_files_dataroom_id'), 'files', ['dataroom_id'], unique=False)
+    op.create_index(op.f('ix_files_folder_id'), 'files', ['folder_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_files_folder_id'), table_name='files')
+    op.drop_index(op.f('ix_files_dataroom_id'), table_name='files')
+    op.drop_table('files')
+    op.drop_index(op.f('ix_folders_path'), table_name='folders')
+    op.drop_index(op.f('ix_folders_parent_id'), table_name='folders')
+    op.drop_index(op.f('ix_folders_dataroom_id'), table_name='folders')
+    op.drop_table('folders')
+    op.drop_index(op.f('ix_datarooms_owner_id'), table_name='datarooms')
+    op.drop_table('datarooms')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.drop_table('users')
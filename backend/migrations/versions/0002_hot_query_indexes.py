@@ -0,0 +1,64 @@
+"""hot query indexes
+
+Composite indexes matching the hot query shapes, replacing single-column
+indexes they make redundant:
+
+- files (dataroom_id, folder_id, name): folder and dataroom-root listings
+  ordered by name, without a sort;
+- folders (dataroom_id, path text_pattern_ops): subtree lookups with
+  LIKE '/a/%' under any database collation;
+- datarooms (owner_id, created_at): a user's datarooms, newest first.
+
+folders (dataroom_id, parent_id, name) is already covered by the
+unique_folder_per_parent constraint.
+
+On PostgreSQL the indexes are built CONCURRENTLY, so large tables stay
+writable while the migration runs.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:27:50.321555
+"""
+
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+NEW_INDEXES = [
+    ('ix_files_dataroom_folder_name', 'files', ['dataroom_id', 'folder_id', 'name'], {}),
+    ('ix_folders_dataroom_path', 'folders', ['dataroom_id', 'path'], {'postgresql_ops': {'path': 'text_pattern_ops'}}),
+    ('ix_datarooms_owner_created', 'datarooms', ['owner_id', 'created_at'], {}),
+]
+
+OLD_INDEXES = [
+    ('ix_files_dataroom_id', 'files', ['dataroom_id']),
+    ('ix_folders_dataroom_id', 'folders', ['dataroom_id']),
+    ('ix_folders_path', 'folders', ['path']),
+    ('ix_datarooms_owner_id', 'datarooms', ['owner_id']),
+]
+
+
+def concurrently() -> dict:
+    """Index options for building without blocking writes (PostgreSQL only)."""
+    return {'postgresql_concurrently': True} if op.get_context().dialect.name == 'postgresql' else {}
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in NEW_INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, **options, **concurrently())
+        # New indexes first, so the hot queries are never left without one
+        for name, table, _ in OLD_INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, **concurrently())
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in OLD_INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, **concurrently())
+        for name, table, _, _ in NEW_INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, **concurrently())
@@ -0,0 +1,50 @@
+"""import jobs
+
+Tracks bulk ZIP imports (importer.py) so interrupted imports can resume.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 09:39:43.740067
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('import_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('dataroom_id', sa.Integer(), nullable=False),
+    sa.Column('folder_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('archive_name', sa.String(length=255), nullable=False),
+    sa.Column('archive_file', sa.String(length=255), nullable=False),
+    sa.Column('archive_size', sa.BigInteger(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('total_entries', sa.Integer(), nullable=True),
+    sa.Column('processed_entries', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('imported_files', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('failed_entries', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('skipped_entries', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('bytes_imported', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['dataroom_id'], ['datarooms.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['folder_id'], ['folders.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_import_jobs_dataroom_id'), 'import_jobs', ['dataroom_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_import_jobs_dataroom_id'), table_name='import_jobs')
+    op.drop_table('import_jobs')
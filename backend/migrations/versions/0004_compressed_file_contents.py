@@ -0,0 +1,213 @@
+"""compressed file contents
+
+Moves extracted text out of files.content_text (see text_store.py):
+
+- file_contents: each text as one zstd frame, compressed with a dictionary
+  trained on a sample of the existing texts (when there are enough);
+- file_terms: the distinct lowercase words of each text, which content
+  search looks up instead of scanning the text;
+- content_dictionaries: the trained dictionaries.
+
+Existing texts are compressed BATCH_SIZE files at a time, each batch
+committed on its own, so memory stays flat and an interrupted upgrade
+resumes after the last stored file. On PostgreSQL the frames are stored
+without TOAST compression, which cannot shrink them any further.
+
+The format is spelled out here rather than imported from text_store.py, so
+this revision keeps working if the application's format changes.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 09:56:14.859758
+"""
+
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Optional
+
+from alembic import op
+import sqlalchemy as sa
+import zstandard
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 200
+COMPRESSION_LEVEL = 9
+MAX_TERM_LENGTH = 64
+DICTIONARY_SIZE = 112640
+TRAINING_FILES = 2000
+TRAINING_CHUNK_SIZE = 16384
+TRAINING_CHUNKS_PER_FILE = 8
+WORD_RE = re.compile(r"\w+")
+
+log = logging.getLogger("alembic.runtime.migration")
+
+files = sa.table('files', sa.column('id', sa.Integer), sa.column('content_text', sa.Text))
+content_dictionaries = sa.table(
+    'content_dictionaries',
+    sa.column('id', sa.Integer),
+    sa.column('data', sa.LargeBinary),
+    sa.column('sample_count', sa.Integer),
+    sa.column('created_at', sa.DateTime),
+)
+file_contents = sa.table(
+    'file_contents',
+    sa.column('file_id', sa.Integer),
+    sa.column('dictionary_id', sa.Integer),
+    sa.column('data', sa.LargeBinary),
+    sa.column('text_size', sa.Integer),
+)
+file_terms = sa.table('file_terms', sa.column('term', sa.String), sa.column('file_id', sa.Integer))
+
+
+def create_tables() -> None:
+    op.create_table('content_dictionaries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('sample_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('file_contents',
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('dictionary_id', sa.Integer(), nullable=True),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('text_size', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['dictionary_id'], ['content_dictionaries.id'], ),
+    sa.ForeignKeyConstraint(['file_id'], ['files.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('file_id')
+    )
+    op.create_table('file_terms',
+    sa.Column('term', sa.String(length=64).with_variant(sa.String(length=64, collation='C'), 'postgresql'), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['file_id'], ['files.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('term', 'file_id')
+    )
+    op.create_index('ix_file_terms_file_id', 'file_terms', ['file_id'], unique=False)
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE file_contents ALTER COLUMN data SET STORAGE EXTERNAL')
+
+
+def train_dictionary(connection) -> Optional[int]:
+    """Train and store a dictionary on a sample of the existing texts (None if too few)."""
+    sample_ids = connection.execute(
+        sa.select(files.c.id).where(files.c.content_text.is_not(None)).order_by(sa.func.random()).limit(TRAINING_FILES)
+    ).scalars().all()
+    samples = []
+    for start in range(0, len(sample_ids), BATCH_SIZE):
+        texts = connection.execute(
+            sa.select(files.c.content_text).where(files.c.id.in_(sample_ids[start:start + BATCH_SIZE]))
+        ).scalars()
+        for text in texts:
+            data = text.encode(errors='replace')
+            samples.extend(
+                data[offset:offset + TRAINING_CHUNK_SIZE]
+                for offset in range(0, min(len(data), TRAINING_CHUNK_SIZE * TRAINING_CHUNKS_PER_FILE), TRAINING_CHUNK_SIZE)
+            )
+    try:
+        dictionary = zstandard.train_dictionary(DICTIONARY_SIZE, samples)
+    except zstandard.ZstdError as e:
+        log.info(f"Not training a content dictionary: {e}")
+        return None
+    return connection.execute(
+        sa.insert(content_dictionaries)
+        .values(data=dictionary.as_bytes(), sample_count=len(samples), created_at=datetime.now(timezone.utc))
+        .returning(content_dictionaries.c.id)
+    ).scalar_one()
+
+
+def compress_texts(connection) -> None:
+    """Copy every text into file_contents and file_terms, resuming after the last stored file."""
+    dictionary_id = connection.execute(sa.select(sa.func.max(content_dictionaries.c.id))).scalar()
+    if dictionary_id is None:
+        dictionary_id = train_dictionary(connection)
+    dict_data = None
+    if dictionary_id is not None:
+        dict_data = zstandard.ZstdCompressionDict(connection.execute(
+            sa.select(content_dictionaries.c.data).where(content_dictionaries.c.id == dictionary_id)
+        ).scalar_one())
+    compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dict_data)
+
+    last_id = connection.execute(sa.select(sa.func.coalesce(sa.func.max(file_contents.c.file_id), 0))).scalar()
+    stored = 0
+    while True:
+        rows = connection.execute(
+            sa.select(files.c.id, files.c.content_text)
+            .where(files.c.id > last_id, files.c.content_text.is_not(None))
+            .order_by(files.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        rows = [row for row in rows if row.content_text]
+        if not rows:
+            continue
+
+        # Terms first: a file counts as done once its content row exists
+        file_ids = [row.id for row in rows]
+        connection.execute(sa.delete(file_terms).where(file_terms.c.file_id.in_(file_ids)))
+        terms = [
+            {'term': term, 'file_id': row.id}
+            for row in rows
+            for term in {word[:MAX_TERM_LENGTH] for word in WORD_RE.findall(row.content_text.lower())}
+        ]
+        if terms:
+            connection.execute(sa.insert(file_terms), terms)
+        contents = []
+        for row in rows:
+            data = row.content_text.encode(errors='replace')
+            contents.append({
+                'file_id': row.id, 'dictionary_id': dictionary_id, 'data': compressor.compress(data), 'text_size': len(data),
+            })
+        connection.execute(sa.insert(file_contents), contents)
+        stored += len(rows)
+        log.info(f"Compressed {stored} texts (up to file {last_id})")
+
+
+def restore_texts(connection) -> None:
+    """Decompress every text back into files.content_text."""
+    dictionaries = {
+        row.id: zstandard.ZstdCompressionDict(row.data)
+        for row in connection.execute(sa.select(content_dictionaries.c.id, content_dictionaries.c.data))
+    }
+    decompressors = {None: zstandard.ZstdDecompressor()}
+    decompressors.update({key: zstandard.ZstdDecompressor(dict_data=value) for key, value in dictionaries.items()})
+
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(file_contents.c.file_id, file_contents.c.dictionary_id, file_contents.c.data)
+            .where(file_contents.c.file_id > last_id)
+            .order_by(file_contents.c.file_id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].file_id
+        for row in rows:
+            text = decompressors[row.dictionary_id].decompress(row.data).decode()
+            connection.execute(sa.update(files).where(files.c.id == row.file_id).values(content_text=text))
+
+
+def upgrade() -> None:
+    if 'file_contents' not in sa.inspect(op.get_bind()).get_table_names():
+        create_tables()
+    # Batches commit on their own, so an interrupted upgrade keeps its progress
+    with op.get_context().autocommit_block():
+        compress_texts(op.get_bind())
+    op.drop_column('files', 'content_text')
+
+
+def downgrade() -> None:
+    op.add_column('files', sa.Column('content_text', sa.TEXT(), nullable=True))
+    restore_texts(op.get_bind())
+    op.drop_index('ix_file_terms_file_id', table_name='file_terms')
+    op.drop_table('file_terms')
+    op.drop_table('file_contents')
+    op.drop_table('content_dictionaries')
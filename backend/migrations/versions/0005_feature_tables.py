@@ -0,0 +1,189 @@
+"""feature tables
+
+The tables and columns added by the application between the initial schema
+and the first migrations: change feed, page texts, thumbnails and page
+counts, storage quotas, near-duplicate signatures, access log and sharing.
+
+Databases created before migrations existed were stamped at 0001 without
+any of them (`db.create_all()` never adds columns to existing tables), while
+databases created from an earlier version of 0001 already have them all, so
+every table, column and index is only created if it is missing. Existing
+data is backfilled:
+
+- every dataroom owner gets their owner permission row;
+- users' storage_used is computed from the files of their datarooms.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 11:02:37.118204
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+OWNER = 3
+
+users = sa.table('users', sa.column('id', sa.Integer), sa.column('storage_used', sa.BigInteger))
+datarooms = sa.table('datarooms', sa.column('id', sa.Integer), sa.column('owner_id', sa.Integer))
+files = sa.table('files', sa.column('dataroom_id', sa.Integer), sa.column('file_size', sa.BigInteger))
+permissions = sa.table(
+    'permissions',
+    sa.column('user_id', sa.Integer),
+    sa.column('dataroom_id', sa.Integer),
+    sa.column('path_prefix', sa.String),
+    sa.column('level', sa.SmallInteger),
+)
+
+
+def create_tables(existing: set[str]) -> None:
+    if 'access_events' not in existing:
+        op.create_table('access_events',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('dataroom_id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('file_name', sa.String(length=255), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('action', sa.String(length=20), nullable=False),
+        sa.Column('ip_address', sa.String(length=45), nullable=True),
+        sa.Column('user_agent', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['dataroom_id'], ['datarooms.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_access_events_dataroom_id', 'access_events', ['dataroom_id', 'id'], unique=False)
+    if 'change_events' not in existing:
+        op.create_table('change_events',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('dataroom_id', sa.Integer(), nullable=False),
+        sa.Column('entity_type', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('action', sa.String(length=20), nullable=False),
+        sa.Column('data', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['dataroom_id'], ['datarooms.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_change_events_dataroom_cursor', 'change_events', ['dataroom_id', 'id'], unique=False)
+    if 'permissions' not in existing:
+        op.create_table('permissions',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('dataroom_id', sa.Integer(), nullable=False),
+        sa.Column('path_prefix', sa.String(length=1000), nullable=False),
+        sa.Column('level', sa.SmallInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['dataroom_id'], ['datarooms.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'dataroom_id', 'path_prefix')
+        )
+        op.create_index('ix_permissions_dataroom_prefix', 'permissions', ['dataroom_id', 'path_prefix'], unique=False)
+    if 'grants' not in existing:
+        op.create_table('grants',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('dataroom_id', sa.Integer(), nullable=False),
+        sa.Column('folder_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('role', sa.String(length=20), nullable=False),
+        sa.Column('created_by', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['dataroom_id'], ['datarooms.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['folder_id'], ['folders.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_grants_dataroom_id'), 'grants', ['dataroom_id'], unique=False)
+        op.create_index(op.f('ix_grants_user_id'), 'grants', ['user_id'], unique=False)
+    if 'file_pages' not in existing:
+        op.create_table('file_pages',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('page_number', sa.Integer(), nullable=False),
+        sa.Column('content_text', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['file_id'], ['files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('file_id', 'page_number', name='unique_page_per_file')
+        )
+    if 'file_signatures' not in existing:
+        op.create_table('file_signatures',
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('signature', sa.LargeBinary(), nullable=False),
+        sa.Column('shingle_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('file_id')
+        )
+    if 'similarity_buckets' not in existing:
+        op.create_table('similarity_buckets',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('band', sa.SmallInteger(), nullable=False),
+        sa.Column('bucket', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_similarity_buckets_band_bucket', 'similarity_buckets', ['band', 'bucket'], unique=False)
+        op.create_index(op.f('ix_similarity_buckets_file_id'), 'similarity_buckets', ['file_id'], unique=False)
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    create_tables(set(inspector.get_table_names()))
+
+    user_columns = {column['name'] for column in inspector.get_columns('users')}
+    if 'storage_used' not in user_columns:
+        op.add_column('users', sa.Column('storage_used', sa.BigInteger(), server_default='0', nullable=False))
+        usage = (
+            sa.select(sa.func.coalesce(sa.func.sum(files.c.file_size), 0))
+            .select_from(files.join(datarooms, files.c.dataroom_id == datarooms.c.id))
+            .where(datarooms.c.owner_id == users.c.id)
+            .scalar_subquery()
+        )
+        op.execute(sa.update(users).values(storage_used=usage))
+    if 'storage_quota' not in user_columns:
+        op.add_column('users', sa.Column('storage_quota', sa.BigInteger(), nullable=True))
+
+    file_columns = {column['name'] for column in inspector.get_columns('files')}
+    if 'page_count' not in file_columns:
+        op.add_column('files', sa.Column('page_count', sa.Integer(), nullable=True))
+    if 'thumbnail_path' not in file_columns:
+        op.add_column('files', sa.Column('thumbnail_path', sa.String(length=500), nullable=True))
+
+    # Owners reach their datarooms through the permission index (acl.py)
+    owner_row = sa.exists().where(
+        permissions.c.user_id == datarooms.c.owner_id,
+        permissions.c.dataroom_id == datarooms.c.id,
+        permissions.c.path_prefix == '',
+    )
+    op.execute(sa.insert(permissions).from_select(
+        ['user_id', 'dataroom_id', 'path_prefix', 'level'],
+        sa.select(datarooms.c.owner_id, datarooms.c.id, sa.literal(''), sa.literal(OWNER)).where(~owner_row),
+    ))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('thumbnail_path')
+        batch_op.drop_column('page_count')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('storage_quota')
+        batch_op.drop_column('storage_used')
+    op.drop_index(op.f('ix_similarity_buckets_file_id'), table_name='similarity_buckets')
+    op.drop_index('ix_similarity_buckets_band_bucket', table_name='similarity_buckets')
+    op.drop_table('similarity_buckets')
+    op.drop_table('file_signatures')
+    op.drop_table('file_pages')
+    op.drop_index(op.f('ix_grants_user_id'), table_name='grants')
+    op.drop_index(op.f('ix_grants_dataroom_id'), table_name='grants')
+    op.drop_table('grants')
+    op.drop_index('ix_permissions_dataroom_prefix', table_name='permissions')
+    op.drop_table('permissions')
+    op.drop_index('ix_change_events_dataroom_cursor', table_name='change_events')
+    op.drop_table('change_events')
+    op.drop_index('ix_access_events_dataroom_id', table_name='access_events')
+    op.drop_table('access_events')
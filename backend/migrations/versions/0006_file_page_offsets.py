@@ -0,0 +1,133 @@
+"""file page offsets
+
+Pages no longer keep a second, uncompressed copy of their text: each
+file_pages row records where its page lies in the file's text in
+file_contents instead (text_offset and text_length, in characters). Texts
+are stored as the non-empty pages joined by newlines, so the offsets are
+computed from the existing page texts the same way before content_text is
+dropped.
+
+Files are backfilled BATCH_SIZE at a time, each batch committed on its own.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 14:21:08.530417
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import zstandard
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 200
+
+file_pages = sa.table(
+    'file_pages',
+    sa.column('id', sa.Integer),
+    sa.column('file_id', sa.Integer),
+    sa.column('page_number', sa.Integer),
+    sa.column('content_text', sa.Text),
+    sa.column('text_offset', sa.Integer),
+    sa.column('text_length', sa.Integer),
+)
+content_dictionaries = sa.table('content_dictionaries', sa.column('id', sa.Integer), sa.column('data', sa.LargeBinary))
+file_contents = sa.table(
+    'file_contents',
+    sa.column('file_id', sa.Integer),
+    sa.column('dictionary_id', sa.Integer),
+    sa.column('data', sa.LargeBinary),
+)
+
+
+def file_batches(connection):
+    """Yield the ids of files with pages, BATCH_SIZE at a time."""
+    last_id = 0
+    while True:
+        file_ids = connection.execute(
+            sa.select(file_pages.c.file_id).distinct()
+            .where(file_pages.c.file_id > last_id)
+            .order_by(file_pages.c.file_id)
+            .limit(BATCH_SIZE)
+        ).scalars().all()
+        if not file_ids:
+            break
+        last_id = file_ids[-1]
+        yield file_ids
+
+
+def compute_offsets(connection) -> None:
+    """Fill in the offsets of every page from its text."""
+    for file_ids in file_batches(connection):
+        rows = connection.execute(
+            sa.select(file_pages.c.id, file_pages.c.file_id, file_pages.c.content_text)
+            .where(file_pages.c.file_id.in_(file_ids))
+            .order_by(file_pages.c.file_id, file_pages.c.page_number)
+        ).all()
+        updates = []
+        offsets = {}
+        for row in rows:
+            offset = offsets.get(row.file_id, 0)
+            length = len(row.content_text or '')
+            updates.append({'page_id': row.id, 'offset': offset, 'length': length})
+            if length:
+                offsets[row.file_id] = offset + length + 1
+        connection.execute(
+            sa.update(file_pages)
+            .where(file_pages.c.id == sa.bindparam('page_id'))
+            .values(text_offset=sa.bindparam('offset'), text_length=sa.bindparam('length')),
+            updates,
+        )
+
+
+def restore_texts(connection) -> None:
+    """Copy every page's slice of the file text back into content_text."""
+    decompressors = {None: zstandard.ZstdDecompressor()}
+    for row in connection.execute(sa.select(content_dictionaries.c.id, content_dictionaries.c.data)):
+        decompressors[row.id] = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(row.data))
+
+    for file_ids in file_batches(connection):
+        texts = {
+            row.file_id: decompressors[row.dictionary_id].decompress(row.data).decode()
+            for row in connection.execute(
+                sa.select(file_contents.c.file_id, file_contents.c.dictionary_id, file_contents.c.data)
+                .where(file_contents.c.file_id.in_(file_ids))
+            )
+        }
+        rows = connection.execute(
+            sa.select(file_pages.c.id, file_pages.c.file_id, file_pages.c.text_offset, file_pages.c.text_length)
+            .where(file_pages.c.file_id.in_(file_ids))
+        ).all()
+        connection.execute(
+            sa.update(file_pages)
+            .where(file_pages.c.id == sa.bindparam('page_id'))
+            .values(content_text=sa.bindparam('text')),
+            [
+                {'page_id': row.id, 'text': texts.get(row.file_id, '')[row.text_offset:row.text_offset + row.text_length]}
+                for row in rows
+            ],
+        )
+
+
+def upgrade() -> None:
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('file_pages')}
+    if 'text_offset' not in columns:
+        op.add_column('file_pages', sa.Column('text_offset', sa.Integer(), server_default='0', nullable=False))
+        op.add_column('file_pages', sa.Column('text_length', sa.Integer(), server_default='0', nullable=False))
+    if 'content_text' in columns:
+        # Batches commit on their own; a rerun recomputes them from the texts
+        with op.get_context().autocommit_block():
+            compute_offsets(op.get_bind())
+        op.drop_column('file_pages', 'content_text')
+
+
+def downgrade() -> None:
+    op.add_column('file_pages', sa.Column('content_text', sa.Text(), nullable=True))
+    restore_texts(op.get_bind())
+    with op.batch_alter_table('file_pages') as batch_op:
+        batch_op.drop_column('text_length')
+        batch_op.drop_column('text_offset')
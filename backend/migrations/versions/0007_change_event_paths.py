@@ -0,0 +1,67 @@
+"""change event paths
+
+Change events record the folder path governing access to the changed item
+(path) and its path before a move or rename (old_path), so the change feed
+can send members of single folders the changes within their subtrees.
+
+Existing events are backfilled with the current path of their folder, file
+or grant. Events on items that no longer exist keep a NULL path, which only
+members of the whole dataroom are sent.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 15:02:44.270913
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+change_events = sa.table(
+    'change_events',
+    sa.column('entity_type', sa.String),
+    sa.column('entity_id', sa.Integer),
+    sa.column('path', sa.String),
+)
+folders = sa.table('folders', sa.column('id', sa.Integer), sa.column('path', sa.String))
+files = sa.table('files', sa.column('id', sa.Integer), sa.column('folder_id', sa.Integer))
+grants = sa.table('grants', sa.column('id', sa.Integer), sa.column('folder_id', sa.Integer))
+
+
+def backfill_paths() -> None:
+    paths = {
+        'folder': sa.select(folders.c.path).where(folders.c.id == change_events.c.entity_id),
+        'file': (
+            sa.select(folders.c.path)
+            .select_from(files.join(folders, files.c.folder_id == folders.c.id))
+            .where(files.c.id == change_events.c.entity_id)
+        ),
+        'member': (
+            sa.select(folders.c.path)
+            .select_from(grants.join(folders, grants.c.folder_id == folders.c.id))
+            .where(grants.c.id == change_events.c.entity_id)
+        ),
+    }
+    for entity_type, path in paths.items():
+        op.execute(
+            sa.update(change_events)
+            .where(change_events.c.entity_type == entity_type)
+            .values(path=path.scalar_subquery())
+        )
+
+
+def upgrade() -> None:
+    op.add_column('change_events', sa.Column('path', sa.String(length=1000), nullable=True))
+    op.add_column('change_events', sa.Column('old_path', sa.String(length=1000), nullable=True))
+    backfill_paths()
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('change_events') as batch_op:
+        batch_op.drop_column('old_path')
+        batch_op.drop_column('path')
@@ -0,0 +1,56 @@
+"""member change data
+
+Member change events used to carry the whole grant, including the member's
+email and name, and every member of the dataroom is sent them. Their data
+is rewritten to what new events carry: the grant's id, role and path.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 15:40:12.604381
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+change_events = sa.table(
+    'change_events',
+    sa.column('id', sa.Integer),
+    sa.column('entity_type', sa.String),
+    sa.column('entity_id', sa.Integer),
+    sa.column('data', sa.JSON),
+    sa.column('path', sa.String),
+)
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(change_events.c.id, change_events.c.entity_id, change_events.c.data, change_events.c.path)
+            .where(change_events.c.entity_type == 'member', change_events.c.id > last_id)
+            .order_by(change_events.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        connection.execute(
+            sa.update(change_events).where(change_events.c.id == sa.bindparam('event_id')).values(data=sa.bindparam('new_data')),
+            [
+                {'event_id': row.id, 'new_data': {'id': row.entity_id, 'role': (row.data or {}).get('role'), 'path': row.path}}
+                for row in rows
+            ],
+        )
+
+
+def downgrade() -> None:
+    pass  # The removed member details are not restored
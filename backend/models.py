@@ -3,8 +3,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
 
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+# Initialize SQLAlchemy (reads may be routed to replicas, see replicas.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 def get_utc_now() -> datetime:
@@ -23,6 +25,8 @@ class User(db.Model):
     oauth_provider = db.Column(db.String(50), nullable=False)  # 'github', 'google', etc.
     oauth_id = db.Column(db.String(255), nullable=False)
     avatar_url = db.Column(db.String(500), nullable=True)
+    storage_used = db.Column(db.BigInteger, default=0, server_default="0", nullable=False)  # Bytes, see quota.py
+    storage_quota = db.Column(db.BigInteger, nullable=True)  # Bytes; NULL uses USER_STORAGE_QUOTA
     created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
     updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now, nullable=False)
 
@@ -40,6 +44,7 @@ class User(db.Model):
             "email": self.email,
             "name": self.name,
             "avatar_url": self.avatar_url,
+            "storage_used": self.storage_used,
             "created_at": self.created_at.isoformat(),
         }
 
@@ -52,7 +57,7 @@ class DataRoom(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    owner_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
     updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now, nullable=False)
 
@@ -61,6 +66,10 @@ class DataRoom(db.Model):
     folders = db.relationship("Folder", back_populates="dataroom", cascade="all, delete-orphan")
     files = db.relationship("File", back_populates="dataroom", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index("ix_datarooms_owner_created", "owner_id", "created_at"),  # A user's datarooms, newest first
+    )
+
     def to_dict(self, include_stats: bool = False) -> dict:
         """Convert dataroom to dictionary."""
         result = {
@@ -87,8 +96,8 @@ class Folder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
     parent_id = db.Column(db.Integer, db.ForeignKey("folders.id"), nullable=True, index=True)
-    dataroom_id = db.Column(db.Integer, db.ForeignKey("datarooms.id"), nullable=False, index=True)
-    path = db.Column(db.String(1000), nullable=False, index=True)  # For efficient querying
+    dataroom_id = db.Column(db.Integer, db.ForeignKey("datarooms.id"), nullable=False)
+    path = db.Column(db.String(1000), nullable=False)  # Materialized, e.g. /Contracts/2024
     created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
     updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now, nullable=False)
 
@@ -102,7 +111,10 @@ class Folder(db.Model):
     files = db.relationship("File", back_populates="folder", cascade="all, delete-orphan")
 
     __table_args__ = (
+        # Also serves listings of a folder's children by name
         db.UniqueConstraint("dataroom_id", "parent_id", "name", name="unique_folder_per_parent"),
+        # Subtree lookups: path = '/a' OR path LIKE '/a/%' (text_pattern_ops works under any collation)
+        db.Index("ix_folders_dataroom_path", "dataroom_id", "path", postgresql_ops={"path": "text_pattern_ops"}),
     )
 
     def to_dict(self, include_children: bool = False) -> dict:
@@ -131,21 +143,33 @@ class File(db.Model):
     name = db.Column(db.String(255), nullable=False)
     original_name = db.Column(db.String(255), nullable=False)
     folder_id = db.Column(db.Integer, db.ForeignKey("folders.id"), nullable=True, index=True)
-    dataroom_id = db.Column(db.Integer, db.ForeignKey("datarooms.id"), nullable=False, index=True)
+    dataroom_id = db.Column(db.Integer, db.ForeignKey("datarooms.id"), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)  # Relative path on disk
     file_size = db.Column(db.BigInteger, nullable=False)  # Size in bytes
     mime_type = db.Column(db.String(100), default="application/pdf", nullable=False)
-    content_text = db.Column(db.Text, nullable=True)  # Extracted text for search
+    page_count = db.Column(db.Integer, nullable=True)  # Set at extraction (null if it failed)
+    thumbnail_path = db.Column(db.String(500), nullable=True)  # Relative path of first-page thumbnail
     created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
     updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now, nullable=False)
 
     # Relationships
     dataroom = db.relationship("DataRoom", back_populates="files")
     folder = db.relationship("Folder", back_populates="files")
+    pages = db.relationship(
+        "FilePage",
+        back_populates="file",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="FilePage.page_number",
+    )
+
+    # Extracted text lives compressed in file_contents and is searched
+    # through file_terms (see text_store.py)
 
-    # Note: For better search performance, enable pg_trgm extension:
-    # CREATE EXTENSION IF NOT EXISTS pg_trgm;
-    # Then add GIN index: CREATE INDEX idx_file_search ON files USING gin(name gin_trgm_ops, content_text gin_trgm_ops);
+    __table_args__ = (
+        # Folder and dataroom-root listings by name (folder_id IS NULL at the root)
+        db.Index("ix_files_dataroom_folder_name", "dataroom_id", "folder_id", "name"),
+    )
 
     def to_dict(self) -> dict:
         """Convert file to dictionary."""
@@ -157,6 +181,303 @@ class File(db.Model):
             "dataroom_id": self.dataroom_id,
             "file_size": self.file_size,
             "mime_type": self.mime_type,
+            "page_count": self.page_count,
+            # Thumbnails are fetched lazily by URL, never inlined in listings
+            "thumbnail_url": f"/api/files/{self.id}/thumbnail" if self.thumbnail_path else None,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+
+class FilePage(db.Model):
+    """File page model - where a PDF page's text lies in the file's stored text (see text_store.py)."""
+
+    __tablename__ = "file_pages"
+
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(
+        db.Integer,
+        db.ForeignKey("files.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    page_number = db.Column(db.Integer, nullable=False)  # 1-based
+    text_offset = db.Column(db.Integer, nullable=False, default=0)  # In characters
+    text_length = db.Column(db.Integer, nullable=False, default=0)
+
+    # Relationships
+    file = db.relationship("File", back_populates="pages")
+
+    __table_args__ = (
+        db.UniqueConstraint("file_id", "page_number", name="unique_page_per_file"),
+    )
+
+    def to_dict(self, text: str) -> dict:
+        """Convert page to dictionary, given the file's stored text."""
+        return {
+            "file_id": self.file_id,
+            "page_number": self.page_number,
+            "content_text": text[self.text_offset:self.text_offset + self.text_length],
+        }
+
+
+class ContentDictionary(db.Model):
+    """Zstandard dictionary trained on extracted texts - never changed once stored."""
+
+    __tablename__ = "content_dictionaries"
+
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False)  # Text chunks it was trained on
+    created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
+
+
+class FileContent(db.Model):
+    """Extracted text of a file, zstd-compressed (see text_store.py)."""
+
+    __tablename__ = "file_contents"
+
+    file_id = db.Column(db.Integer, db.ForeignKey("files.id", ondelete="CASCADE"), primary_key=True)
+    dictionary_id = db.Column(db.Integer, db.ForeignKey("content_dictionaries.id"), nullable=True)  # NULL: no dictionary
+    data = db.Column(db.LargeBinary, nullable=False)  # One zstd frame
+    text_size = db.Column(db.Integer, nullable=False)  # Bytes of UTF-8 text once decompressed
+
+
+class FileTerm(db.Model):
+    """Distinct word of a file's text - the content search index."""
+
+    __tablename__ = "file_terms"
+
+    # Binary collation, so prefix ranges on terms follow code point order
+    term = db.Column(db.String(64).with_variant(db.String(64, collation="C"), "postgresql"), primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey("files.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (
+        db.Index("ix_file_terms_file_id", "file_id"),
+    )
+
+
+class ChangeEvent(db.Model):
+    """Change log entry - append-only record of structural changes in a dataroom."""
+
+    __tablename__ = "change_events"
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)  # Monotonic cursor
+    dataroom_id = db.Column(
+        db.Integer,
+        db.ForeignKey("datarooms.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    entity_type = db.Column(db.String(20), nullable=False)  # 'dataroom', 'folder', 'file'
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(20), nullable=False)  # 'created', 'renamed', 'moved', 'updated', 'deleted'
+    data = db.Column(db.JSON, nullable=True)  # Snapshot of the entity after the change
+    path = db.Column(db.String(1000), nullable=True)  # Folder path governing access, NULL at the root
+    old_path = db.Column(db.String(1000), nullable=True)  # Before a move or rename
+    created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_change_events_dataroom_cursor", "dataroom_id", "id"),
+    )
+
+    def to_dict(self) -> dict:
+        """Convert change event to dictionary."""
+        return {
+            "cursor": self.id,
+            "entity_type": self.entity_type,
+            "entity_id": self.entity_id,
+            "action": self.action,
+            "data": self.data,
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+class Grant(db.Model):
+    """Sharing grant - a user's role in a whole dataroom or a folder subtree."""
+
+    __tablename__ = "grants"
+
+    id = db.Column(db.Integer, primary_key=True)
+    dataroom_id = db.Column(
+        db.Integer,
+        db.ForeignKey("datarooms.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    folder_id = db.Column(
+        db.Integer,
+        db.ForeignKey("folders.id", ondelete="CASCADE"),
+        nullable=True,  # NULL grants the whole dataroom
+    )
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    role = db.Column(db.String(20), nullable=False)  # 'viewer', 'editor'
+    created_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
+    updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now, nullable=False)
+
+    # Relationships
+    user = db.relationship("User", foreign_keys=[user_id])
+    folder = db.relationship("Folder")
+
+    def to_dict(self) -> dict:
+        """Convert grant to dictionary."""
+        return {
+            "id": self.id,
+            "dataroom_id": self.dataroom_id,
+            "folder_id": self.folder_id,
+            "folder_path": self.folder.path if self.folder else None,
+            "role": self.role,
+            "user": {"id": self.user.id, "email": self.user.email, "name": self.user.name},
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+
+class Permission(db.Model):
+    """Materialized effective access of a user below a path prefix of a dataroom.
+
+    Derived from the owner and grants by acl.py; never edited directly.
+    """
+
+    __tablename__ = "permissions"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    dataroom_id = db.Column(db.Integer, db.ForeignKey("datarooms.id", ondelete="CASCADE"), primary_key=True)
+    path_prefix = db.Column(db.String(1000), primary_key=True)  # Folder path, '' for the whole dataroom
+    level = db.Column(db.SmallInteger, nullable=False)  # 1 viewer, 2 editor, 3 owner
+
+    __table_args__ = (
+        db.Index("ix_permissions_dataroom_prefix", "dataroom_id", "path_prefix"),
+    )
+
+
+class FileSignature(db.Model):
+    """MinHash signature of a file's text, used for near-duplicate detection."""
+
+    __tablename__ = "file_signatures"
+
+    file_id = db.Column(db.Integer, db.ForeignKey("files.id", ondelete="CASCADE"), primary_key=True)
+    signature = db.Column(db.LargeBinary, nullable=False)  # NUM_PERM little-endian uint32 values
+    shingle_count = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
+
+
+class SimilarityBucket(db.Model):
+    """LSH bucket membership - one row per file and signature band."""
+
+    __tablename__ = "similarity_buckets"
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    file_id = db.Column(
+        db.Integer,
+        db.ForeignKey("files.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    band = db.Column(db.SmallInteger, nullable=False)
+    bucket = db.Column(db.BigInteger, nullable=False)  # Hash of the band's signature values
+
+    __table_args__ = (
+        db.Index("ix_similarity_buckets_band_bucket", "band", "bucket"),
+    )
+
+
+class AccessEvent(db.Model):
+    """Audit log entry - a user viewing or downloading a file.
+
+    File and user ids are kept without foreign keys so the history outlives
+    deleted files; the file name is copied for the same reason.
+    """
+
+    __tablename__ = "access_events"
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    dataroom_id = db.Column(
+        db.Integer,
+        db.ForeignKey("datarooms.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    file_id = db.Column(db.Integer, nullable=False)
+    file_name = db.Column(db.String(255), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(20), nullable=False)  # 'viewed', 'downloaded'
+    ip_address = db.Column(db.String(45), nullable=True)
+    user_agent = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)  # When the access happened
+
+    __table_args__ = (
+        db.Index("ix_access_events_dataroom_id", "dataroom_id", "id"),
+    )
+
+    def to_dict(self) -> dict:
+        """Convert access event to dictionary."""
+        return {
+            "id": self.id,
+            "file_id": self.file_id,
+            "file_name": self.file_name,
+            "user_id": self.user_id,
+            "action": self.action,
+            "ip_address": self.ip_address,
+            "user_agent": self.user_agent,
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+class ImportJob(db.Model):
+    """Bulk import of a ZIP archive into a dataroom, see importer.py."""
+
+    __tablename__ = "import_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    dataroom_id = db.Column(
+        db.Integer,
+        db.ForeignKey("datarooms.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    folder_id = db.Column(
+        db.Integer,
+        db.ForeignKey("folders.id", ondelete="CASCADE"),
+        nullable=True,  # NULL imports into the dataroom root
+    )
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    archive_name = db.Column(db.String(255), nullable=False)  # Name of the uploaded archive
+    archive_file = db.Column(db.String(255), nullable=False)  # Saved copy under UPLOAD_FOLDER/imports
+    archive_size = db.Column(db.BigInteger, nullable=False)
+    status = db.Column(db.String(20), default="pending", nullable=False)  # 'pending', 'running', 'completed', 'failed'
+    total_entries = db.Column(db.Integer, nullable=True)  # PDFs to import, known once the archive is read
+    processed_entries = db.Column(db.Integer, default=0, server_default="0", nullable=False)  # Resume point
+    imported_files = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    failed_entries = db.Column(db.Integer, default=0, server_default="0", nullable=False)  # Corrupt members
+    skipped_entries = db.Column(db.Integer, default=0, server_default="0", nullable=False)  # Not PDFs, hidden, too large
+    bytes_imported = db.Column(db.BigInteger, default=0, server_default="0", nullable=False)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=get_utc_now, nullable=False)
+    updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now, nullable=False)  # Heartbeat
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self) -> dict:
+        """Convert import job to dictionary."""
+        return {
+            "id": self.id,
+            "dataroom_id": self.dataroom_id,
+            "folder_id": self.folder_id,
+            "user_id": self.user_id,
+            "archive_name": self.archive_name,
+            "archive_size": self.archive_size,
+            "status": self.status,
+            "total_entries": self.total_entries,
+            "processed_entries": self.processed_entries,
+            "imported_files": self.imported_files,
+            "failed_entries": self.failed_entries,
+            "skipped_entries": self.skipped_entries,
+            "bytes_imported": self.bytes_imported,
+            "error": self.error,
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat(),
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
         }
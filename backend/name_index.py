@@ -0,0 +1,326 @@
+"""Typo-tolerant file and folder name search over in-memory n-gram signatures.
+
+Every name is reduced to the character trigrams of its words, padded with
+spaces so short words and word starts count ("stmt" gives " st", "stm",
+"tmt", "mt "). The trigrams are hashed into a SIGNATURE_BITS-bit signature.
+The signatures of a dataroom's names form one NumPy array. A query is scored
+against all of them at once (bitwise AND and popcount), and the best are
+picked with argpartition. The score is a Tversky index, which favors names
+containing most of the query's trigrams and only lightly penalizes names
+that are longer than the query:
+
+    score = shared / (shared + (query - shared) + NAME_WEIGHT * (name - shared))
+
+Each process keeps the indexes of recently searched datarooms. An index is
+built from the dataroom's tree (tree_index.py) and then follows the tree's
+change cursor:
+
+- created, renamed and moved files and folders get a new signature and
+  deleted ones are dropped, from the dataroom's change events;
+- the contents of a deleted folder are dropped once a query reaches them
+  and finds them gone from the tree;
+- more than MAX_EVENTS pending changes rebuild the index from the tree.
+
+Matches are checked against the user's permission prefixes in the same
+vectorized pass. Results are tree nodes, so no query touches the files
+table. Indexes are evicted least recently used once the cached names exceed
+FUZZY_SEARCH_MAX_NAMES.
+"""
+
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+from flask import Flask, current_app
+from sqlalchemy import select
+
+from models import db, ChangeEvent, Permission
+from tree_index import FileNode, FolderNode, TreeIndex, get_tree
+
+SIGNATURE_BITS = 1024
+WORDS = SIGNATURE_BITS // 64
+NAME_WEIGHT = 0.25  # Weight of name trigrams missing from the query
+MAX_EVENTS = 1000  # Pending changes applied one by one; more rebuild the index
+
+FOLDER = 1
+FILE = 2
+
+_ASCII_WORD = np.array([chr(code).isalnum() for code in range(128)] + [False])  # Last: looked up separately
+_GRAM_MULTIPLIER = np.uint64(0x10FFFF + 1)  # One step per code point
+_GRAM_MIX = np.uint64(0x9E3779B97F4A7C15)  # Fibonacci hashing: the top bits pick the position
+_POSITION_SHIFT = np.uint64(64 - (SIGNATURE_BITS - 1).bit_length())  # SIGNATURE_BITS is a power of two
+
+
+def name_bits(names: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Hash the padded trigrams of names' words to signature bit positions.
+
+    Returns (name index, bit position) pairs. All names are hashed in one
+    pass over their code points: names are joined with NUL characters and
+    every non-alphanumeric character becomes a space, so a trigram belongs
+    to a single padded word exactly when its middle character is part of a
+    word. Underscores separate words too, as they do in file names.
+    """
+    text = " \0 ".join(names)
+    if text.count("\0") != max(len(names) - 1, 0):
+        text = " \0 ".join(name.replace("\0", " ") for name in names)
+    chars = np.frombuffer(f" {text.lower()} ".encode("utf-32-le"), dtype=np.uint32)
+
+    is_word = _ASCII_WORD[np.minimum(chars, 128)]
+    other = chars > 127
+    if other.any():
+        codes = np.unique(chars[other])
+        is_word[other] = np.isin(chars[other], codes[[chr(code).isalnum() for code in codes]])
+    chars = np.where(is_word | (chars == 0), chars, ord(" ")).astype(np.uint64)
+    if len(chars) < 3:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+
+    valid = is_word[1:-1]
+    owners = np.cumsum(chars == 0)[1:-1][valid]
+    grams = (chars[:-2] * _GRAM_MULTIPLIER + chars[1:-1]) * _GRAM_MULTIPLIER + chars[2:]  # Wraps mod 2**64
+    return owners, (grams[valid] * _GRAM_MIX) >> _POSITION_SHIFT
+
+
+def set_bits(signatures: np.ndarray, rows: np.ndarray, positions: np.ndarray) -> None:
+    """Set bit positions in rows of a signature array."""
+    np.bitwise_or.at(
+        signatures,
+        (rows, (positions >> np.uint64(6)).astype(np.int64)),
+        np.uint64(1) << (positions & np.uint64(63)),
+    )
+
+
+class Match(NamedTuple):
+    score: float
+    dataroom_id: int
+    node: FileNode | FolderNode
+    parent: Optional[FolderNode]  # Folder holding the file or folder, None at the dataroom root
+
+
+class NameIndex:
+    """Name signatures of one dataroom at one change cursor."""
+
+    def __init__(self, dataroom_id: int, version: int, capacity: int = 1024):
+        self.dataroom_id = dataroom_id
+        self.version = version
+        self.signatures = np.zeros((capacity, WORDS), dtype=np.uint64)
+        self.gram_counts = np.zeros(capacity, dtype=np.int32)
+        self.kinds = np.zeros(capacity, dtype=np.int8)  # 0 for free rows
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.scopes = np.zeros(capacity, dtype=np.int64)  # Folder deciding access (0: dataroom root)
+        self.rows: dict[tuple[int, int], int] = {}
+        self.free: list[int] = []
+        self.end = 0  # Rows past this one were never used
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_tree(cls, tree: TreeIndex) -> "NameIndex":
+        """Build the index of a tree."""
+        index = cls(tree.dataroom_id, tree.version, max(1024, tree.size))
+        index.put(
+            [(FOLDER, folder.id, folder.name, folder.id) for folder in tree.folders.values()]
+            + [(FILE, file.id, file.name, file.folder_id or 0) for file in tree.files.values()]
+        )
+        return index
+
+    @property
+    def size(self) -> int:
+        return len(self.rows)
+
+    def put(self, entries: Iterable[tuple[int, int, str, int]]) -> None:
+        """Add or replace entries: (kind, id, name, scope)."""
+        entries = list(entries)
+        if not entries:
+            return
+        row_numbers = []
+        for kind, entity_id, _, _ in entries:
+            row = self.rows.get((kind, entity_id))
+            if row is None:
+                row = self.free.pop() if self.free else self._append()
+                self.rows[(kind, entity_id)] = row
+            row_numbers.append(row)
+
+        # All rows and signatures in one vectorized step
+        rows = np.array(row_numbers, dtype=np.int64)
+        kinds, ids, names, scopes = zip(*entries)
+        self.kinds[rows] = kinds
+        self.ids[rows] = ids
+        self.scopes[rows] = scopes
+        owners, positions = name_bits(list(names))
+        self.signatures[rows] = 0
+        set_bits(self.signatures, rows[owners], positions)
+        self.gram_counts[rows] = np.bitwise_count(self.signatures[rows]).sum(axis=1)
+
+    def remove(self, kind: int, entity_id: int) -> None:
+        """Drop an entry if present."""
+        row = self.rows.pop((kind, entity_id), None)
+        if row is not None:
+            self.kinds[row] = 0
+            self.free.append(row)
+
+    def apply(self, events: Iterable[ChangeEvent]) -> None:
+        """Apply file and folder change events, in cursor order."""
+        for event in events:
+            kind = {"file": FILE, "folder": FOLDER}.get(event.entity_type)
+            if kind is not None and event.action == "deleted":
+                self.remove(kind, event.entity_id)
+            elif kind is not None and event.data and "name" in event.data:
+                scope = (event.data.get("folder_id") or 0) if kind == FILE else event.entity_id
+                self.put([(kind, event.entity_id, event.data["name"], scope)])
+            self.version = event.id
+
+    def search(
+        self, query: str, limit: int, min_score: float, scopes: Optional[np.ndarray] = None, kind: Optional[int] = None
+    ) -> list[tuple[float, int, int]]:
+        """Score every name against a query; returns the best (score, kind, id), best first.
+
+        `scopes` restricts matches to entries whose scope is in the array.
+        """
+        owners, positions = name_bits([query])
+        if not len(positions):
+            return []
+        signature = np.zeros((1, WORDS), dtype=np.uint64)
+        set_bits(signature, owners, positions)
+        signature = signature[0]
+        query_count = int(np.bitwise_count(signature).sum())
+
+        end = self.end
+        shared = np.bitwise_count(self.signatures[:end] & signature).sum(axis=1, dtype=np.int32)
+        scores = shared / (query_count + NAME_WEIGHT * (self.gram_counts[:end] - shared))
+        valid = (self.kinds[:end] != 0) if kind is None else (self.kinds[:end] == kind)
+        if scopes is not None:
+            valid &= np.isin(self.scopes[:end], scopes)
+        candidates = np.flatnonzero(valid & (scores >= min_score))
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(float(scores[row]), int(self.kinds[row]), int(self.ids[row])) for row in candidates]
+
+    def _append(self) -> int:
+        """Take the next never used row, growing the arrays when full."""
+        if self.end == len(self.kinds):
+            for name in ("signatures", "gram_counts", "kinds", "ids", "scopes"):
+                array = getattr(self, name)
+                grown = np.zeros((len(array) * 2, *array.shape[1:]), dtype=array.dtype)
+                grown[:len(array)] = array
+                setattr(self, name, grown)
+        self.end += 1
+        return self.end - 1
+
+
+def allowed_scopes(tree: TreeIndex, prefixes: dict[str, int]) -> Optional[np.ndarray]:
+    """Scopes of a tree a user can read, from acl.get_user_prefixes (None for all)."""
+    if prefixes.get(""):
+        return None
+    scopes = []
+    pending = [tree.paths[path] for path, level in prefixes.items() if level and path in tree.paths]
+    while pending:
+        folder = pending.pop()
+        scopes.append(folder.id)
+        pending.extend(folder.children)
+    return np.array(scopes, dtype=np.int64)
+
+
+class NameIndexCache:
+    """Least recently used name indexes of a process, bounded by their total names."""
+
+    def __init__(self, max_names: int):
+        self.max_names = max_names
+        self._indexes: OrderedDict[int, NameIndex] = OrderedDict()
+        self._names = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_names > 0
+
+    def get(self, tree: TreeIndex) -> NameIndex:
+        """Get the index of a dataroom, brought up to its tree's version."""
+        with self._lock:
+            index = self._indexes.get(tree.dataroom_id)
+            if index is not None:
+                self._indexes.move_to_end(tree.dataroom_id)
+        if index is None:
+            index = NameIndex.from_tree(tree)
+        elif index.version < tree.version:
+            events = db.session.execute(
+                select(ChangeEvent)
+                .where(
+                    ChangeEvent.dataroom_id == tree.dataroom_id,
+                    ChangeEvent.id > index.version,
+                    ChangeEvent.id <= tree.version,
+                )
+                .order_by(ChangeEvent.id)
+                .limit(MAX_EVENTS + 1)
+            ).scalars().all()
+            if len(events) > MAX_EVENTS:
+                index = NameIndex.from_tree(tree)
+            else:
+                with index.lock:
+                    # Another request may have caught up meanwhile
+                    index.apply(event for event in events if event.id > index.version)
+        self._store(index)
+        return index
+
+    def _store(self, index: NameIndex) -> None:
+        with self._lock:
+            previous = self._indexes.pop(index.dataroom_id, None)
+            if previous is not None:
+                self._names -= previous.size
+                if previous is not index and previous.version > index.version:
+                    index = previous  # Keep the newer one
+            if index.size > self.max_names:
+                return
+            self._indexes[index.dataroom_id] = index
+            self._names += index.size
+            while self._names > self.max_names:
+                _, evicted = self._indexes.popitem(last=False)
+                self._names -= evicted.size
+
+
+def init_name_index(app: Flask) -> None:
+    """Create the name index of an application."""
+    app.extensions["name_index"] = NameIndexCache(app.config["FUZZY_SEARCH_MAX_NAMES"])
+
+
+def fuzzy_enabled() -> bool:
+    """Whether fuzzy name search is enabled."""
+    return current_app.extensions["name_index"].enabled
+
+
+def find_names(
+    user_id: int, query: str, dataroom_id: Optional[int] = None, limit: int = 50, kind: Optional[int] = None
+) -> list[Match]:
+    """Find the files and folders a user can read whose names best match a query, best first."""
+    cache: NameIndexCache = current_app.extensions["name_index"]
+    min_score = current_app.config["FUZZY_SEARCH_MIN_SCORE"]
+
+    permissions = select(Permission.dataroom_id, Permission.path_prefix, Permission.level).where(
+        Permission.user_id == user_id
+    )
+    if dataroom_id:
+        permissions = permissions.where(Permission.dataroom_id == dataroom_id)
+    prefixes = defaultdict(dict)
+    for row in db.session.execute(permissions):
+        prefixes[row.dataroom_id][row.path_prefix] = row.level
+
+    matches = []
+    for room_id, room_prefixes in prefixes.items():
+        tree = get_tree(room_id, required=True)
+        index = cache.get(tree)
+        # Extra candidates make up for entries found stale below
+        with index.lock:
+            hits = index.search(query, limit * 2, min_score, allowed_scopes(tree, room_prefixes), kind)
+            current = index.version == tree.version
+        for score, hit_kind, entity_id in hits:
+            node = (tree.files if hit_kind == FILE else tree.folders).get(entity_id)
+            if node is None:
+                if current:  # In a folder deleted since the index was built
+                    with index.lock:
+                        index.remove(hit_kind, entity_id)
+                continue
+            parent = node.parent if hit_kind == FOLDER else tree.folders.get(node.folder_id)
+            matches.append(Match(score, room_id, node, parent))
+
+    matches.sort(key=lambda match: (-match.score, match.node.name.lower()))
+    return matches[:limit]
@@ -0,0 +1,210 @@
+"""Google OAuth code exchange and ID-token verification.
+
+Logging in costs one outbound request: the authorization code is exchanged
+for tokens, and the returned OpenID Connect ID token is verified locally
+(RS256 signature, audience, issuer, expiry) against Google's signing keys
+instead of a second round trip to the userinfo endpoint.
+
+- Outbound calls share a pooled keep-alive session per process with strict
+  connect/read timeouts, so a slow identity provider fails logins quickly
+  instead of tying up workers.
+- The JWKS is cached for OAUTH_JWKS_TTL seconds (or the provider's
+  Cache-Control max-age). When it expires one thread refreshes it while the
+  others keep verifying with the cached keys; a refresh failure keeps the
+  cached keys. A token signed with an unknown key id (key rotation) forces
+  a refresh, at most once per OAUTH_JWKS_MIN_REFRESH seconds.
+
+Every URL is configurable, so the flow runs against loadtest/fake_oauth.py.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import jwt
+import requests
+from flask import Flask
+from requests.adapters import HTTPAdapter
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class OAuthError(Exception):
+    """The identity provider rejected the login or could not be reached."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class JWKSCache:
+    """Signing keys of the identity provider, fetched and refreshed lazily."""
+
+    def __init__(self, client: "OAuthClient", url: str, ttl: float, min_refresh: float):
+        self.client = client
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self._keys: dict[str, jwt.PyJWK] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def get_key(self, kid: Optional[str]) -> jwt.PyJWK:
+        """Get the key for a key id, refreshing the key set when needed."""
+        now = time.monotonic()
+        if not self._keys:
+            with self._lock:
+                if not self._keys:
+                    self._refresh()
+        elif now >= self._expires_at and self._lock.acquire(blocking=False):
+            # Stale: this thread refreshes, the others use the cached keys meanwhile
+            try:
+                self._refresh(keep_on_error=True)
+            finally:
+                self._lock.release()
+
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._fetched_at >= self.min_refresh:
+            # Possibly a rotated key the cache has not seen yet
+            with self._lock:
+                if kid not in self._keys and time.monotonic() - self._fetched_at >= self.min_refresh:
+                    self._refresh(keep_on_error=True)
+            key = self._keys.get(kid)
+        if key is None:
+            raise OAuthError("ID token signed with an unknown key")
+        return key
+
+    def _refresh(self, keep_on_error: bool = False) -> None:
+        """Fetch the key set; with keep_on_error, a failure keeps the cached keys."""
+        self._fetched_at = time.monotonic()
+        try:
+            response = self.client.session.get(self.url, timeout=self.client.timeout)
+            response.raise_for_status()
+            key_set = jwt.PyJWKSet.from_dict(response.json())
+        except (requests.RequestException, ValueError, jwt.PyJWKSetError) as e:
+            if keep_on_error and self._keys:
+                self.client.logger.warning(f"JWKS refresh failed, keeping cached keys: {e}")
+                self._expires_at = time.monotonic() + self.min_refresh
+                return
+            raise OAuthError("Could not fetch the identity provider's signing keys", 502) from e
+
+        self._keys = {key.key_id: key for key in key_set.keys}
+        max_age = _MAX_AGE_RE.search(response.headers.get("Cache-Control", ""))
+        ttl = min(int(max_age.group(1)), self.ttl) if max_age else self.ttl
+        self._expires_at = time.monotonic() + ttl
+
+
+class OAuthClient:
+    """Code exchange and ID-token verification for one application."""
+
+    def __init__(self, app: Flask):
+        self.logger = app.logger
+        self.client_id = app.config["GOOGLE_CLIENT_ID"]
+        self.client_secret = app.config["GOOGLE_CLIENT_SECRET"]
+        self.redirect_uri = app.config["OAUTH_REDIRECT_URI"]
+        self.token_url = app.config["GOOGLE_TOKEN_URL"]
+        self.userinfo_url = app.config["GOOGLE_USERINFO_URL"]
+        self.issuers = [issuer.strip() for issuer in app.config["GOOGLE_ISSUERS"].split(",") if issuer.strip()]
+        self.timeout = (app.config["OAUTH_CONNECT_TIMEOUT"], app.config["OAUTH_READ_TIMEOUT"])
+        self.clock_skew = app.config["OAUTH_CLOCK_SKEW"]
+        self.pool_size = app.config["OAUTH_POOL_SIZE"]
+        self.jwks = JWKSCache(
+            self, app.config["GOOGLE_JWKS_URL"], app.config["OAUTH_JWKS_TTL"], app.config["OAUTH_JWKS_MIN_REFRESH"]
+        )
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """Pooled keep-alive session of this process (connections do not survive fork)."""
+        if self._session_pid != os.getpid():
+            with self._session_lock:
+                if self._session_pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def exchange_code(self, code: str) -> dict:
+        """Exchange an authorization code for the provider's token response."""
+        try:
+            response = self.session.post(
+                self.token_url,
+                data={
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                    "code": code,
+                    "grant_type": "authorization_code",
+                    "redirect_uri": self.redirect_uri,
+                },
+                timeout=self.timeout,
+            )
+            tokens = response.json()
+        except requests.Timeout as e:
+            raise OAuthError("Identity provider timed out", 504) from e
+        except (requests.RequestException, ValueError) as e:
+            raise OAuthError("Identity provider unavailable", 502) from e
+
+        if "access_token" not in tokens:
+            raise OAuthError("Failed to get access token")
+        return tokens
+
+    def verify_id_token(self, id_token: str) -> dict:
+        """Verify an ID token's signature and claims; returns its claims."""
+        try:
+            header = jwt.get_unverified_header(id_token)
+            key = self.jwks.get_key(header.get("kid"))
+            return jwt.decode(
+                id_token,
+                key=key,
+                algorithms=["RS256"],
+                audience=self.client_id,
+                issuer=self.issuers,
+                leeway=self.clock_skew,
+                options={"require": ["exp", "iat", "iss", "aud", "sub"]},
+            )
+        except jwt.InvalidTokenError as e:
+            raise OAuthError(f"Invalid ID token: {e}") from e
+
+    def fetch_userinfo(self, access_token: str) -> dict:
+        """Fetch the profile from the userinfo endpoint (for token responses without an ID token)."""
+        try:
+            response = self.session.get(
+                self.userinfo_url, headers={"Authorization": f"Bearer {access_token}"}, timeout=self.timeout
+            )
+            return response.json()
+        except requests.Timeout as e:
+            raise OAuthError("Identity provider timed out", 504) from e
+        except (requests.RequestException, ValueError) as e:
+            raise OAuthError("Identity provider unavailable", 502) from e
+
+    def authenticate(self, code: str) -> dict:
+        """Turn an authorization code into a profile: id, email, name and picture."""
+        tokens = self.exchange_code(code)
+        if "id_token" not in tokens:
+            profile = self.fetch_userinfo(tokens["access_token"])
+            if "email" not in profile:
+                raise OAuthError("Could not retrieve email from Google")
+            return profile
+
+        claims = self.verify_id_token(tokens["id_token"])
+        if not claims.get("email"):
+            raise OAuthError("Could not retrieve email from Google")
+        if claims.get("email_verified") is False:
+            raise OAuthError("Email address is not verified")
+        # The ID token's subject is the account id the userinfo endpoint returns as `id`
+        profile = {"id": claims["sub"], "email": claims["email"]}
+        profile.update({field: claims[field] for field in ("name", "picture") if claims.get(field)})
+        return profile
+
+
+def init_oauth(app: Flask) -> None:
+    """Create the OAuth client of an application."""
+    app.extensions["oauth"] = OAuthClient(app)
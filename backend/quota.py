@@ -0,0 +1,82 @@
+"""Per-user storage quotas.
+
+Every user has a `storage_used` counter holding the bytes of all files in
+their datarooms. It is changed with single-row UPDATEs, never by summing
+files, so checking a quota costs one indexed write:
+
+- uploads reserve their declared size with a conditional UPDATE that only
+  succeeds while the user stays within quota, before any bytes are read;
+  uploads into a shared dataroom move the reservation to its owner, whose
+  quota the files count toward;
+- the reservation is trued up to the stored size in the transaction that
+  inserts the file, and released if the upload fails;
+- deletes subtract in the transaction that removes the rows.
+
+`flask quota-reconcile` recomputes the counters from the files table to
+repair drift from crashes between a reservation and its release.
+"""
+
+from typing import Optional
+
+from flask import current_app
+from sqlalchemy import select, update, func, or_
+
+from models import db, DataRoom, File, User
+
+
+def get_quota(user: User) -> int:
+    """Get a user's quota in bytes (0 means unlimited)."""
+    if user.storage_quota is not None:
+        return user.storage_quota
+    return current_app.config["USER_STORAGE_QUOTA"]
+
+
+def reserve_storage(user_id: int, size: int) -> bool:
+    """Atomically add `size` bytes to a user's usage if it stays within quota.
+
+    Returns False, changing nothing, if the quota would be exceeded.
+    """
+    quota = func.coalesce(User.storage_quota, current_app.config["USER_STORAGE_QUOTA"])
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, or_(quota <= 0, User.storage_used + size <= quota))
+        .values(storage_used=User.storage_used + size)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def charge_storage(user_id: int, size: int) -> None:
+    """Add `size` bytes (negative to release) to a user's usage unconditionally."""
+    if size:
+        db.session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(storage_used=User.storage_used + size)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def transfer_storage(from_user_id: int, to_user_id: int, size: int) -> bool:
+    """Move a reservation to another user if it fits their quota.
+
+    Returns False, changing nothing, if the receiving user's quota would be exceeded.
+    """
+    if not reserve_storage(to_user_id, size):
+        return False
+    charge_storage(from_user_id, -size)
+    return True
+
+
+def reconcile_storage(user_id: Optional[int] = None) -> int:
+    """Recompute usage counters from stored files; returns the number corrected."""
+    actual = (
+        select(func.coalesce(func.sum(File.file_size), 0))
+        .join(DataRoom, File.dataroom_id == DataRoom.id)
+        .where(DataRoom.owner_id == User.id)
+        .scalar_subquery()
+    )
+    stmt = update(User).where(User.storage_used != actual).values(storage_used=actual)
+    if user_id is not None:
+        stmt = stmt.where(User.id == user_id)
+    return db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
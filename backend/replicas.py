@@ -0,0 +1,187 @@
+"""Routing of read-only requests to database replicas.
+
+With DATABASE_REPLICA_URLS set, SELECTs issued while handling GET and HEAD
+requests run on a healthy replica; everything else uses the primary:
+
+- writes, SELECT ... FOR UPDATE and anything after the session's first
+  write in a request stay on the primary;
+- after a successful mutation the response sets a short-lived cookie, and
+  requests carrying it read from the primary for REPLICA_STICKY_SECONDS so
+  users see their own changes despite replication lag;
+- views that write during GET opt out with `@use_primary`.
+
+Replicas are health-checked lazily (at most every REPLICA_HEALTH_INTERVAL
+seconds per process) with a ping and, on PostgreSQL, a replay-lag query;
+unreachable or lagging replicas are skipped until they recover, and with
+none healthy reads fall back to the primary. A read that fails on a replica
+mid-request is retried once on the primary.
+"""
+
+import random
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Optional
+
+import sqlalchemy as sa
+from flask import Flask, Response, current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+
+STICKY_COOKIE = "db_primary_until"
+READ_METHODS = {"GET", "HEAD"}
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+_LAG_QUERY = sa.text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+    """A replica engine with its last known health."""
+
+    def __init__(self, url: str, engine_options: dict):
+        self.url = url
+        self.engine = sa.create_engine(url, **engine_options)
+        self.healthy = True
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at = 0.0
+
+    def check(self, max_lag: float) -> bool:
+        """Ping the replica and measure its replay lag; returns whether it is usable."""
+        try:
+            with self.engine.connect() as connection:
+                if self.engine.dialect.name == "postgresql":
+                    # NULL on a server that is not replaying WAL (e.g. a plain local database)
+                    self.lag = float(connection.execute(_LAG_QUERY).scalar() or 0)
+                else:
+                    connection.execute(sa.text("SELECT 1"))
+                    self.lag = 0.0
+            self.error = None if self.lag <= max_lag else f"Replication lag {self.lag:.1f}s exceeds {max_lag}s"
+        except sa.exc.SQLAlchemyError as e:
+            self.lag = None
+            self.error = str(e.__cause__ or e).strip().splitlines()[0]
+        self.healthy = self.error is None
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+
+class ReplicaSet:
+    """The replicas of an application and the lazy health checking of them."""
+
+    def __init__(self, app: Flask):
+        urls = [url.strip() for url in app.config["DATABASE_REPLICA_URLS"].split(",") if url.strip()]
+        self.replicas = [Replica(url, app.config["SQLALCHEMY_ENGINE_OPTIONS"]) for url in urls]
+        self.health_interval = app.config["REPLICA_HEALTH_INTERVAL"]
+        self.max_lag = app.config["REPLICA_MAX_LAG"]
+        self._lock = threading.Lock()
+
+    def choose(self) -> Optional[sa.engine.Engine]:
+        """Pick a healthy replica engine, or None to use the primary."""
+        if not self.replicas:
+            return None
+        self._refresh()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        return random.choice(healthy).engine if healthy else None
+
+    def check_all(self) -> None:
+        """Check every replica now."""
+        for replica in self.replicas:
+            replica.check(self.max_lag)
+
+    def dispose(self) -> None:
+        """Drop pooled connections (after fork, connections must not be shared)."""
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
+
+    def _refresh(self) -> None:
+        """Re-check replicas whose status is older than the interval; one thread checks at a time."""
+        now = time.monotonic()
+        stale = [replica for replica in self.replicas if now - replica.checked_at >= self.health_interval]
+        if stale and self._lock.acquire(blocking=False):
+            try:
+                for replica in stale:
+                    if not replica.check(self.max_lag):
+                        current_app.logger.warning(f"Replica {replica.engine.url!r} unavailable: {replica.error}")
+            finally:
+                self._lock.release()
+
+    def mark_failed(self, engine: sa.engine.Engine) -> None:
+        """Stop routing to a replica that failed a query until its next check passes."""
+        for replica in self.replicas:
+            if replica.engine is engine:
+                replica.healthy = False
+                replica.checked_at = time.monotonic()
+
+
+class RoutingSession(Session):
+    """Session that sends reads to the replica chosen for the current request."""
+
+    def get_bind(self, mapper: Any = None, clause: Any = None, bind: Any = None, **kwargs: Any) -> Any:
+        if bind is None and has_app_context():
+            replica = g.get("db_replica")
+            if (
+                replica is not None
+                and not self._flushing
+                and not self.info.get("wrote")
+                and isinstance(clause, sa.Select)
+                and clause._for_update_arg is None
+            ):
+                return replica
+            if not isinstance(clause, sa.Select):
+                # Reads after a write in the same request must see it
+                self.info["wrote"] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_primary(f: Callable) -> Callable:
+    """Decorator for GET views that write: run all their queries on the primary."""
+    @wraps(f)
+    def decorated_function(*args: Any, **kwargs: Any) -> Any:
+        g.db_replica = None
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def route_request() -> None:
+    """Choose the database for the current request's reads."""
+    g.db_replica = None
+    if request.method not in READ_METHODS:
+        return
+    sticky_until = request.cookies.get(STICKY_COOKIE, type=float)
+    if sticky_until is not None and sticky_until > time.time():
+        return
+    g.db_replica = current_app.extensions["replicas"].choose()
+
+
+def mark_sticky(response: Response) -> Response:
+    """After a successful mutation, keep this client's reads on the primary for a while."""
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        seconds = current_app.config["REPLICA_STICKY_SECONDS"]
+        response.set_cookie(
+            STICKY_COOKIE, f"{time.time() + seconds:.3f}",
+            max_age=seconds, httponly=True, samesite="Lax", secure=request.is_secure,
+        )
+    return response
+
+
+def retry_on_primary(error: sa.exc.OperationalError) -> Any:
+    """Run a read request again on the primary when its replica fails mid-request."""
+    if g.get("db_replica") is None:
+        raise error
+    current_app.logger.warning(f"Replica query failed, retrying on the primary: {error.orig}")
+    current_app.extensions["replicas"].mark_failed(g.db_replica)
+    current_app.extensions["sqlalchemy"].session.rollback()
+    g.db_replica = None
+    return current_app.dispatch_request()
+
+
+def init_replicas(app: Flask) -> None:
+    """Set up read-replica routing for an application (no-op without replicas)."""
+    replicas = ReplicaSet(app)
+    app.extensions["replicas"] = replicas
+    if replicas.replicas:
+        app.before_request(route_request)
+        app.after_request(mark_sticky)
+        app.register_error_handler(sa.exc.OperationalError, retry_on_primary)
@@ -1,9 +1,11 @@
 """Authentication routes for OAuth 2.0."""
 
 from flask import Blueprint, request, jsonify, current_app, redirect
-import requests
 from models import db, User
 from auth_utils import create_jwt_token, get_current_user
+from quota import get_quota
+from replicas import use_primary
+from oauth import OAuthError
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -19,7 +21,7 @@ def login():
 
     # Google OAuth authorization URL
     google_auth_url = (
-        f"https://accounts.google.com/o/oauth2/v2/auth"
+        f"{current_app.config['GOOGLE_AUTH_URL']}"
         f"?client_id={client_id}"
         f"&redirect_uri={redirect_uri}"
         f"&response_type=code"
@@ -32,6 +34,7 @@ def login():
 
 
 @auth_bp.route("/callback", methods=["GET"])
+@use_primary
 def oauth_callback():
     """Handle OAuth callback from Google."""
     print("[OAuth] Callback received")
@@ -40,37 +43,12 @@ def oauth_callback():
     if not code:
         return jsonify({"error": "No authorization code provided"}), 400
 
-    client_id = current_app.config["GOOGLE_CLIENT_ID"]
-    client_secret = current_app.config["GOOGLE_CLIENT_SECRET"]
-    redirect_uri = current_app.config["OAUTH_REDIRECT_URI"]
-
-    # Exchange code for access token
-    token_url = "https://oauth2.googleapis.com/token"
-    token_data = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "code": code,
-        "grant_type": "authorization_code",
-        "redirect_uri": redirect_uri,
-    }
-    token_headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
-    token_response = requests.post(token_url, data=token_data, headers=token_headers)
-    token_json = token_response.json()
-
-    if "access_token" not in token_json:
-        return jsonify({"error": "Failed to get access token"}), 400
-
-    access_token = token_json["access_token"]
-
-    # Get user info from Google
-    user_url = "https://www.googleapis.com/oauth2/v2/userinfo"
-    user_headers = {"Authorization": f"Bearer {access_token}"}
-    user_response = requests.get(user_url, headers=user_headers)
-    user_data = user_response.json()
-
-    if "email" not in user_data:
-        return jsonify({"error": "Could not retrieve email from Google"}), 400
+    # One round trip: the code exchange; the ID token is verified locally
+    try:
+        user_data = current_app.extensions["oauth"].authenticate(code)
+    except OAuthError as e:
+        current_app.logger.warning(f"OAuth login failed: {e}")
+        return jsonify({"error": str(e)}), e.status
 
     # Create or update user
     user = User.query.filter_by(oauth_provider="google", oauth_id=str(user_data["id"])).first()
@@ -110,7 +88,7 @@ def get_current_user_info():
     if not user:
         return jsonify({"error": "Not authenticated"}), 401
 
-    return jsonify({"user": user.to_dict()})
+    return jsonify({"user": {**user.to_dict(), "storage_quota": get_quota(user)}})
 
 
 @auth_bp.route("/logout", methods=["POST"])
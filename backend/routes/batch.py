@@ -0,0 +1,358 @@
+"""Routes for bulk operations on files and folders."""
+
+from collections import defaultdict
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import select, update, delete, and_, or_, func, literal
+from models import db, File, FileContent, FilePage, FileSignature, FileTerm, Folder, DataRoom, Permission, SimilarityBucket
+from auth_utils import login_required
+from changes import record_change
+from thumbnails import delete_thumbnail
+from storage import get_storage
+from quota import charge_storage
+from acl import EDITOR, drop_subtree_permissions, folder_name_error, level_at, move_permission_prefixes
+
+batch_bp = Blueprint("batch", __name__)
+
+OPERATIONS = {"move", "rename", "delete"}
+ENTITY_TYPES = {"file", "folder"}
+
+
+def subtree_condition(dataroom_id: int, folder_id: int, path: str):
+    """SQL condition matching a folder and all of its descendants."""
+    return or_(
+        Folder.id == folder_id,
+        and_(Folder.dataroom_id == dataroom_id, Folder.path.startswith(f"{path}/", autoescape=True)),
+    )
+
+
+def rewrite_folder_paths(dataroom_id: int, folder_id: int, old_path: str, new_path: str) -> None:
+    """Rewrite the path prefix of a folder and its descendants (and their permissions)."""
+    db.session.execute(
+        update(Folder)
+        .where(subtree_condition(dataroom_id, folder_id, old_path))
+        .values(path=literal(new_path) + func.substr(Folder.path, len(old_path) + 1))
+        .execution_options(synchronize_session=False)
+    )
+    move_permission_prefixes(dataroom_id, old_path, new_path)
+
+
+@batch_bp.route("", methods=["POST"])
+@login_required
+def run_batch(current_user):
+    """Apply a list of move, rename and delete operations in one transaction.
+
+    Each operation is {"op": "move"|"rename"|"delete", "type": "file"|"folder",
+    "id": ..., "name": ... (rename), "folder_id": ... (move, null for root)}.
+    Operations are validated in order against the effect of the earlier ones;
+    invalid operations are reported and skipped. Deletes are applied after all
+    moves and renames.
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations")
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+
+    max_operations = current_app.config["BATCH_MAX_OPERATIONS"]
+    if len(operations) > max_operations:
+        return jsonify({"error": f"At most {max_operations} operations are allowed per batch"}), 400
+
+    results = [None] * len(operations)
+    seen = set()
+    valid = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            results[index] = {"index": index, "status": 400, "error": "Operation must be an object"}
+            continue
+        op, entity_type, entity_id = operation.get("op"), operation.get("type"), operation.get("id")
+        if op not in OPERATIONS or entity_type not in ENTITY_TYPES or not isinstance(entity_id, int):
+            results[index] = {"index": index, "status": 400, "error": "Invalid op, type or id"}
+        elif op == "rename" and not operation.get("name"):
+            results[index] = {"index": index, "status": 400, "error": "Name is required"}
+        elif op == "rename" and entity_type == "folder" and (error := folder_name_error(operation["name"])):
+            results[index] = {"index": index, "status": 400, "error": error}
+        elif op == "move" and "folder_id" not in operation:
+            results[index] = {"index": index, "status": 400, "error": "folder_id is required"}
+        elif (entity_type, entity_id) in seen:
+            results[index] = {"index": index, "status": 400, "error": "Item appears more than once in the batch"}
+        else:
+            seen.add((entity_type, entity_id))
+            valid.append((index, operation))
+
+    # Load every referenced file and folder up front
+    file_ids = {op["id"] for _, op in valid if op["type"] == "file"}
+    folder_ids = {op["id"] for _, op in valid if op["type"] == "folder"}
+    folder_ids |= {op["folder_id"] for _, op in valid if op["op"] == "move" and op["folder_id"]}
+
+    files = {
+        row.id: row._asdict() for row in db.session.execute(
+            select(File.id, File.name, File.folder_id, File.dataroom_id, Folder.path.label("folder_path"))
+            .outerjoin(Folder, File.folder_id == Folder.id)
+            .where(File.id.in_(file_ids))
+        )
+    } if file_ids else {}
+    folders = {
+        row.id: row._asdict() for row in db.session.execute(
+            select(Folder.id, Folder.name, Folder.parent_id, Folder.dataroom_id, Folder.path)
+            .where(Folder.id.in_(folder_ids))
+        )
+    } if folder_ids else {}
+
+    # The user's permissions in every dataroom involved, with one query
+    dataroom_ids = {item["dataroom_id"] for item in [*files.values(), *folders.values()]}
+    prefixes = defaultdict(dict)
+    if dataroom_ids:
+        for row in db.session.execute(
+            select(Permission.dataroom_id, Permission.path_prefix, Permission.level)
+            .where(Permission.user_id == current_user.id, Permission.dataroom_id.in_(dataroom_ids))
+        ):
+            prefixes[row.dataroom_id][row.path_prefix] = row.level
+
+    def level(dataroom_id: int, path) -> int:
+        return level_at(prefixes[dataroom_id], path)
+
+    # Items the user cannot see are reported as not found
+    files = {key: f for key, f in files.items() if level(f["dataroom_id"], f["folder_path"])}
+    folders = {key: f for key, f in folders.items() if level(f["dataroom_id"], f["path"])}
+
+    # Names taken in every location an operation can write to, to detect conflicts
+    file_locations = {(f["dataroom_id"], f["folder_id"]) for f in files.values()}
+    folder_locations = {(f["dataroom_id"], f["parent_id"]) for f in folders.values()}
+    for _, op in valid:
+        if op["op"] == "move" and op["folder_id"] in folders:
+            dataroom_id = folders[op["folder_id"]]["dataroom_id"]
+        elif op["op"] == "move" and not op["folder_id"]:
+            source = files.get(op["id"]) if op["type"] == "file" else folders.get(op["id"])
+            dataroom_id = source["dataroom_id"] if source else None
+        else:
+            continue
+        location = (dataroom_id, op["folder_id"] or None)
+        (file_locations if op["type"] == "file" else folder_locations).add(location)
+
+    def load_names(model, parent_column, locations) -> dict:
+        names = {location: {} for location in locations}
+        if not locations:
+            return names
+        rows = db.session.execute(
+            select(model.id, model.name, model.dataroom_id, parent_column.label("parent_id")).where(or_(*(
+                and_(model.dataroom_id == dataroom_id, parent_column.is_(None) if parent_id is None else parent_column == parent_id)
+                for dataroom_id, parent_id in locations
+            )))
+        )
+        for row in rows:
+            names[(row.dataroom_id, row.parent_id)][row.name] = row.id
+        return names
+
+    file_names = load_names(File, File.folder_id, file_locations)
+    folder_names = load_names(Folder, Folder.parent_id, folder_locations)
+
+    file_updates = {}
+    file_changes = []
+    folder_changes = []
+    deleted_files = []
+    deleted_folders = []
+
+    for index, operation in valid:
+        op, entity_type, entity_id = operation["op"], operation["type"], operation["id"]
+        item = files.get(entity_id) if entity_type == "file" else folders.get(entity_id)
+        result = {"index": index, "op": op, "type": entity_type, "id": entity_id}
+        results[index] = result
+
+        if item is None:
+            result.update(status=404, error=f"{entity_type.capitalize()} not found")
+            continue
+
+        item_path = item["folder_path"] if entity_type == "file" else item["path"]
+        if level(item["dataroom_id"], item_path) < EDITOR:
+            result.update(status=403, error="Access denied")
+            continue
+
+        if op == "delete":
+            (deleted_files if entity_type == "file" else deleted_folders).append(item)
+            result["status"] = 200
+            continue
+
+        # Work out the new name and location, then check for conflicts
+        names = file_names if entity_type == "file" else folder_names
+        parent_key = "folder_id" if entity_type == "file" else "parent_id"
+        old_location = (item["dataroom_id"], item[parent_key])
+        name, location = item["name"], old_location
+
+        if op == "rename":
+            name = operation["name"]
+            if entity_type == "file" and not name.lower().endswith(".pdf"):
+                name += ".pdf"
+        else:
+            target_id = operation["folder_id"] or None
+            if target_id is not None:
+                target = folders.get(target_id)
+                if not target or target["dataroom_id"] != item["dataroom_id"]:
+                    result.update(status=400, error="Invalid folder")
+                    continue
+                if entity_type == "folder" and (
+                    target_id == entity_id or target["path"].startswith(f"{item['path']}/")
+                ):
+                    result.update(status=400, error="Cannot move a folder into itself")
+                    continue
+            if level(item["dataroom_id"], folders[target_id]["path"] if target_id else None) < EDITOR:
+                result.update(status=403, error="Access denied")
+                continue
+            location = (item["dataroom_id"], target_id)
+
+        if names[location].get(name, entity_id) != entity_id:
+            kind = "File" if entity_type == "file" else "Folder"
+            result.update(status=409, error=f"{kind} with this name already exists in this location")
+            continue
+
+        del names[old_location][item["name"]]
+        names[location][name] = entity_id
+        item["name"] = name
+        item[parent_key] = location[1]
+        result["status"] = 200
+
+        if entity_type == "file":
+            file_changes.append((entity_id, "renamed" if op == "rename" else "moved", item["folder_path"]))
+            item["folder_path"] = folders[location[1]]["path"] if location[1] else None
+            file_updates[entity_id] = {"id": entity_id, "name": name, "folder_id": location[1]}
+            continue
+
+        # Folder paths are rewritten in order, so later operations see earlier ones
+        if location[1] is None:
+            new_path = f"/{name}"
+        else:
+            new_path = f"{folders[location[1]]['path']}/{name}"
+        old_path = item["path"]
+        db.session.execute(
+            update(Folder)
+            .where(Folder.id == entity_id)
+            .values(name=name, parent_id=location[1])
+            .execution_options(synchronize_session=False)
+        )
+        rewrite_folder_paths(item["dataroom_id"], entity_id, old_path, new_path)
+        for folder in folders.values():
+            if folder["dataroom_id"] == item["dataroom_id"] and (
+                folder["path"] == old_path or folder["path"].startswith(f"{old_path}/")
+            ):
+                folder["path"] = new_path + folder["path"][len(old_path):]
+        for file in files.values():
+            if file["dataroom_id"] == item["dataroom_id"] and file["folder_path"] and (
+                file["folder_path"] == old_path or file["folder_path"].startswith(f"{old_path}/")
+            ):
+                file["folder_path"] = new_path + file["folder_path"][len(old_path):]
+        # Grants on the subtree move with it
+        moved_prefixes = {}
+        for prefix, prefix_level in prefixes[item["dataroom_id"]].items():
+            if prefix == old_path or prefix.startswith(f"{old_path}/"):
+                prefix = new_path + prefix[len(old_path):]
+            moved_prefixes[prefix] = prefix_level
+        prefixes[item["dataroom_id"]] = moved_prefixes
+        folder_changes.append((entity_id, "renamed" if op == "rename" else "moved", old_path))
+
+    if file_updates:
+        db.session.execute(update(File), list(file_updates.values()))
+
+    # Deletes remove whole subtrees: collect every folder and file below them
+    blobs = []
+    if deleted_files or deleted_folders:
+        subtree_ids = db.session.execute(
+            select(Folder.id).where(or_(*(
+                subtree_condition(folder["dataroom_id"], folder["id"], folder["path"])
+                for folder in deleted_folders
+            )))
+        ).scalars().all() if deleted_folders else []
+        conditions = []
+        if deleted_files:
+            conditions.append(File.id.in_([file["id"] for file in deleted_files]))
+        if subtree_ids:
+            conditions.append(File.folder_id.in_(subtree_ids))
+        blobs = db.session.execute(
+            select(File.id, File.file_path, File.thumbnail_path, File.file_size, DataRoom.owner_id)
+            .join(DataRoom, File.dataroom_id == DataRoom.id)
+            .where(or_(*conditions))
+        ).all() if conditions else []
+
+        blob_file_ids = [row.id for row in blobs]
+        # Freed bytes go back to each dataroom's owner
+        freed = defaultdict(int)
+        for row in blobs:
+            freed[row.owner_id] += row.file_size
+        for owner_id, size in freed.items():
+            charge_storage(owner_id, -size)
+        for folder in deleted_folders:
+            drop_subtree_permissions(folder["dataroom_id"], folder["path"])
+        if blob_file_ids:
+            db.session.execute(delete(FilePage).where(FilePage.file_id.in_(blob_file_ids)))
+            db.session.execute(delete(FileTerm).where(FileTerm.file_id.in_(blob_file_ids)))
+            db.session.execute(delete(FileContent).where(FileContent.file_id.in_(blob_file_ids)))
+            db.session.execute(delete(SimilarityBucket).where(SimilarityBucket.file_id.in_(blob_file_ids)))
+            db.session.execute(delete(FileSignature).where(FileSignature.file_id.in_(blob_file_ids)))
+            db.session.execute(
+                delete(File).where(File.id.in_(blob_file_ids)).execution_options(synchronize_session=False)
+            )
+        if subtree_ids:
+            db.session.execute(
+                delete(Folder).where(Folder.id.in_(subtree_ids)).execution_options(synchronize_session=False)
+            )
+
+    # Record changes with snapshots of the updated rows (items deleted by a
+    # later operation only get their delete event)
+    changed_file_ids = [file_id for file_id, _, _ in file_changes]
+    snapshots = {
+        file.id: file.to_dict() for file in db.session.execute(
+            select(File).where(File.id.in_(changed_file_ids)).execution_options(populate_existing=True)
+        ).scalars()
+    } if changed_file_ids else {}
+    for file_id, action, previous_path in file_changes:
+        if file_id not in snapshots:
+            continue
+        file = files[file_id]
+        record_change(
+            file["dataroom_id"], "file", file_id, action, snapshots[file_id],
+            path=file["folder_path"], old_path=previous_path if action == "moved" else None,
+        )
+
+    changed_folder_ids = [folder_id for folder_id, _, _ in folder_changes]
+    snapshots = {
+        folder.id: folder.to_dict() for folder in db.session.execute(
+            select(Folder).where(Folder.id.in_(changed_folder_ids)).execution_options(populate_existing=True)
+        ).scalars()
+    } if changed_folder_ids else {}
+    for folder_id, action, previous_path in folder_changes:
+        if folder_id not in snapshots:
+            continue
+        # Descendant paths change with the folder; clients rewrite the prefix
+        record_change(
+            folders[folder_id]["dataroom_id"], "folder", folder_id, action,
+            {**snapshots[folder_id], "previous_path": previous_path},
+            path=snapshots[folder_id]["path"], old_path=previous_path,
+        )
+
+    for file in deleted_files:
+        record_change(
+            file["dataroom_id"], "file", file["id"], "deleted", {"id": file["id"], "folder_id": file["folder_id"]},
+            path=file["folder_path"],
+        )
+    for folder in deleted_folders:
+        # Deleting a folder implicitly deletes its whole subtree on the client
+        record_change(
+            folder["dataroom_id"], "folder", folder["id"], "deleted", {"id": folder["id"], "path": folder["path"]},
+            path=folder["path"],
+        )
+
+    db.session.commit()
+
+    # Blobs are removed only once the rows are gone for good
+    storage = get_storage()
+    for blob in blobs:
+        try:
+            storage.delete(blob.file_path)
+            delete_thumbnail(blob.file_path, storage, blob.thumbnail_path)
+        except Exception as e:
+            current_app.logger.warning(f"Failed to delete file {blob.file_path}: {e}")
+
+    succeeded = sum(1 for result in results if result["status"] == 200)
+    return jsonify({
+        "results": results,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+    })
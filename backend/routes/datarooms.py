@@ -1,8 +1,26 @@
 """Routes for Data Room CRUD operations."""
 
-from flask import Blueprint, request, jsonify
-from models import db, DataRoom, Folder
+import json
+import time
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from sqlalchemy import select, delete, func
+from werkzeug.utils import secure_filename
+from models import db, AccessEvent, DataRoom, Folder, File, Grant, ImportJob, Permission, User
+from acl import (
+    VIEWER, EDITOR, OWNER, ROLES, ROLE_NAMES, folder_path, get_user_prefixes, has_access, level_at,
+    rebuild_permissions,
+)
 from auth_utils import login_required
+from background import run_in_background
+from changes import record_change, get_changes_since, get_latest_cursor, get_settled_cursor
+from compress import cached_response
+from admission import admission_control
+from folder_stats import EMPTY_STATS, get_folder_stats
+from importer import ArchiveError, create_import_job, run_import
+from quota import charge_storage
+from similarity import find_duplicate_groups
+from serialization import FILE_COLUMNS, file_row, folder_row, json_response
+from tree_index import breadcrumbs, get_tree
 
 datarooms_bp = Blueprint("datarooms", __name__)
 
@@ -11,9 +29,16 @@ datarooms_bp = Blueprint("datarooms", __name__)
 @login_required
 def list_datarooms(current_user):
     """List all datarooms for the current user."""
-    datarooms = DataRoom.query.filter_by(owner_id=current_user.id).order_by(DataRoom.created_at.desc()).all()
+    # Owned and shared datarooms, with the user's highest role in each
+    rows = db.session.execute(
+        select(DataRoom, func.max(Permission.level))
+        .join(Permission, Permission.dataroom_id == DataRoom.id)
+        .where(Permission.user_id == current_user.id)
+        .group_by(DataRoom.id)
+        .order_by(DataRoom.created_at.desc())
+    ).all()
     return jsonify({
-        "datarooms": [dr.to_dict(include_stats=True) for dr in datarooms]
+        "datarooms": [{**dr.to_dict(include_stats=True), "role": ROLE_NAMES[level]} for dr, level in rows]
     })
 
 
@@ -33,6 +58,8 @@ def create_dataroom(current_user):
     )
 
     db.session.add(dataroom)
+    db.session.flush()
+    rebuild_permissions(dataroom.id, current_user.id)
     db.session.commit()
 
     return jsonify({"dataroom": dataroom.to_dict()}), 201
@@ -47,10 +74,11 @@ def get_dataroom(current_user, dataroom_id: int):
     if not dataroom:
         return jsonify({"error": "Dataroom not found"}), 404
 
-    if dataroom.owner_id != current_user.id:
+    prefixes = get_user_prefixes(current_user.id, dataroom_id)
+    if not prefixes:
         return jsonify({"error": "Access denied"}), 403
 
-    return jsonify({"dataroom": dataroom.to_dict(include_stats=True)})
+    return jsonify({"dataroom": {**dataroom.to_dict(include_stats=True), "role": ROLE_NAMES[max(prefixes.values())]}})
 
 
 @datarooms_bp.route("/<int:dataroom_id>", methods=["PUT"])
@@ -62,7 +90,7 @@ def update_dataroom(current_user, dataroom_id: int):
     if not dataroom:
         return jsonify({"error": "Dataroom not found"}), 404
 
-    if dataroom.owner_id != current_user.id:
+    if not has_access(current_user.id, dataroom_id, OWNER):
         return jsonify({"error": "Access denied"}), 403
 
     data = request.get_json()
@@ -72,6 +100,8 @@ def update_dataroom(current_user, dataroom_id: int):
     if "description" in data:
         dataroom.description = data["description"]
 
+    db.session.flush()
+    record_change(dataroom.id, "dataroom", dataroom.id, "updated", dataroom.to_dict())
     db.session.commit()
 
     return jsonify({"dataroom": dataroom.to_dict()})
@@ -86,9 +116,16 @@ def delete_dataroom(current_user, dataroom_id: int):
     if not dataroom:
         return jsonify({"error": "Dataroom not found"}), 404
 
-    if dataroom.owner_id != current_user.id:
+    if not has_access(current_user.id, dataroom_id, OWNER):
         return jsonify({"error": "Access denied"}), 403
 
+    total_size = db.session.execute(
+        select(func.coalesce(func.sum(File.file_size), 0)).where(File.dataroom_id == dataroom_id)
+    ).scalar()
+    charge_storage(dataroom.owner_id, -total_size)
+    db.session.execute(delete(Permission).where(Permission.dataroom_id == dataroom_id))
+    db.session.execute(delete(Grant).where(Grant.dataroom_id == dataroom_id))
+
     db.session.delete(dataroom)
     db.session.commit()
 
@@ -97,6 +134,8 @@ def delete_dataroom(current_user, dataroom_id: int):
 
 @datarooms_bp.route("/<int:dataroom_id>/structure", methods=["GET"])
 @login_required
+@cached_response(lambda current_user, dataroom_id: get_latest_cursor(dataroom_id))
+@admission_control("structure")
 def get_dataroom_structure(current_user, dataroom_id: int):
     """Get complete folder structure for a dataroom."""
     dataroom = db.session.get(DataRoom, dataroom_id)
@@ -104,34 +143,391 @@ def get_dataroom_structure(current_user, dataroom_id: int):
     if not dataroom:
         return jsonify({"error": "Dataroom not found"}), 404
 
-    if dataroom.owner_id != current_user.id:
+    # Members of single folders only see those subtrees
+    prefixes = get_user_prefixes(current_user.id, dataroom_id)
+    if not prefixes:
         return jsonify({"error": "Access denied"}), 403
 
-    # Get root folders (no parent)
-    root_folders = Folder.query.filter_by(
-        dataroom_id=dataroom_id,
-        parent_id=None
-    ).order_by(Folder.name).all()
+    # The whole tree, from the process-local index or loaded as two flat row lists
+    tree = get_tree(dataroom_id, required=True)
+
+    if "" in prefixes:
+        roots, root_files = tree.roots, tree.root_files
+    else:
+        # Granted folders become the roots of the visible tree; their subtrees are visible too
+        roots = [
+            folder for folder in tree.folders.values()
+            if level_at(prefixes, folder.path) and not (folder.parent and level_at(prefixes, folder.parent.path))
+        ]
+        roots.sort(key=lambda folder: folder.name)
+        root_files = []
 
     def build_tree(folder):
-        """Recursively build folder tree."""
-        folder_dict = folder.to_dict()
-        children = Folder.query.filter_by(parent_id=folder.id).order_by(Folder.name).all()
-        folder_dict["children"] = [build_tree(child) for child in children]
-        folder_dict["files"] = [file.to_dict() for file in folder.files]
+        """Build a folder subtree; children are encoded lazily while streaming."""
+        folder_dict = {**folder_row(folder), **folder.stats}
+        folder_dict["children"] = (build_tree(child) for child in folder.children)
+        folder_dict["files"] = (file_row(file) for file in folder.files)
         return folder_dict
 
-    structure = [build_tree(folder) for folder in root_folders]
+    return json_response({
+        "dataroom": dataroom.to_dict(),
+        "structure": (build_tree(folder) for folder in roots),
+        # Also include files at the root level (no folder)
+        "root_files": (file_row(file) for file in root_files),
+    })
+
+
+@datarooms_bp.route("/<int:dataroom_id>/resolve", methods=["GET"])
+@login_required
+def resolve_folder_path(current_user, dataroom_id: int):
+    """Resolve a folder path (e.g. /Contracts/2024) to the folder and its breadcrumbs."""
+    path = request.args.get("path", "")
+    if not path.startswith("/"):
+        return jsonify({"error": "path must start with /"}), 400
+
+    # Access is checked on the requested path before the tree is loaded; same
+    # answer for missing and forbidden paths, so names cannot be probed
+    prefixes = get_user_prefixes(current_user.id, dataroom_id)
+    if not level_at(prefixes, path):
+        return jsonify({"error": "Folder not found"}), 404
+
+    tree = get_tree(dataroom_id)
+    if tree is not None:
+        folder = tree.paths.get(path)
+        stats = folder.stats if folder else EMPTY_STATS
+    else:
+        folder = Folder.query.filter_by(dataroom_id=dataroom_id, path=path).first()
+        stats = get_folder_stats([folder.id]).get(folder.id, EMPTY_STATS) if folder else EMPTY_STATS
+
+    if not folder:
+        return jsonify({"error": "Folder not found"}), 404
+
+    return json_response({
+        "folder": {**folder_row(folder), **stats},
+        "breadcrumbs": breadcrumbs(folder, prefixes),
+    })
+
+
+@datarooms_bp.route("/<int:dataroom_id>/imports", methods=["POST"])
+@login_required
+def create_import(current_user, dataroom_id: int):
+    """Import a ZIP archive of PDFs, recreating its folders.
+
+    The archive is the raw body (Content-Type: application/zip, named by the
+    `name` query parameter) or the `file` field of a multipart form. The
+    optional `folder_id` query parameter is the target folder. The import
+    runs in the background; poll the returned job for progress.
+    """
+    # Archives may be much larger than single uploads
+    request.max_content_length = current_app.config["IMPORT_MAX_ARCHIVE_SIZE"]
+
+    dataroom = db.session.get(DataRoom, dataroom_id)
+
+    if not dataroom:
+        return jsonify({"error": "Dataroom not found"}), 404
+
+    folder = None
+    folder_id = request.args.get("folder_id", type=int)
+    if folder_id:
+        folder = db.session.get(Folder, folder_id)
+        if not folder or folder.dataroom_id != dataroom_id:
+            return jsonify({"error": "Invalid folder"}), 400
+
+    if not has_access(current_user.id, dataroom_id, EDITOR, folder.path if folder else None):
+        return jsonify({"error": "Access denied"}), 403
+    # Release the connection while the archive is received
+    db.session.commit()
+
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            return jsonify({"error": "No file provided"}), 400
+        stream, archive_name = upload.stream, upload.filename
+    else:
+        stream, archive_name = request.stream, request.args.get("name", "archive.zip")
+
+    try:
+        job = create_import_job(
+            dataroom_id, folder_id, current_user.id, stream, secure_filename(archive_name), request.content_length,
+        )
+    except ArchiveError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    run_in_background(run_import, job.id)
+
+    return jsonify({"job": job.to_dict()}), 202
+
+
+@datarooms_bp.route("/<int:dataroom_id>/imports/<int:job_id>", methods=["GET"])
+@login_required
+def get_import(current_user, dataroom_id: int, job_id: int):
+    """Get the status and progress of an import."""
+    job = db.session.get(ImportJob, job_id)
+
+    if not job or job.dataroom_id != dataroom_id:
+        return jsonify({"error": "Import not found"}), 404
+
+    if not has_access(current_user.id, dataroom_id, VIEWER):
+        return jsonify({"error": "Access denied"}), 403
+
+    return jsonify({"job": job.to_dict()})
+
+
+@datarooms_bp.route("/<int:dataroom_id>/duplicates", methods=["GET"])
+@login_required
+def get_dataroom_duplicates(current_user, dataroom_id: int):
+    """List groups of near-duplicate files within a dataroom."""
+    dataroom = db.session.get(DataRoom, dataroom_id)
+
+    if not dataroom:
+        return jsonify({"error": "Dataroom not found"}), 404
+
+    if not has_access(current_user.id, dataroom_id, VIEWER):
+        return jsonify({"error": "Access denied"}), 403
+
+    groups = find_duplicate_groups(dataroom_id)
+    file_ids = {file_id for group in groups for file_id in group["file_ids"]}
+    files = {
+        row.id: file_row(row)
+        for row in db.session.execute(select(*FILE_COLUMNS).where(File.id.in_(file_ids)))
+    } if file_ids else {}
+
+    return json_response({
+        "groups": [
+            {"files": [files[file_id] for file_id in group["file_ids"]], "pairs": group["pairs"]}
+            for group in groups
+        ],
+    })
+
+
+@datarooms_bp.route("/<int:dataroom_id>/changes", methods=["GET"])
+@login_required
+def get_dataroom_changes(current_user, dataroom_id: int):
+    """Get changes made to a dataroom after the given cursor."""
+    dataroom = db.session.get(DataRoom, dataroom_id)
+
+    if not dataroom:
+        return jsonify({"error": "Dataroom not found"}), 404
+
+    # Members of single folders get the changes within their subtrees
+    if not get_user_prefixes(current_user.id, dataroom_id):
+        return jsonify({"error": "Access denied"}), 403
+
+    # Only settled changes are sent, see changes.py
+    settled = get_settled_cursor(dataroom_id)
+    since = request.args.get("since", type=int)
+    if since is None:
+        # No cursor yet - the client should load /structure and continue from here
+        return jsonify({"changes": [], "cursor": settled, "has_more": False})
 
-    # Also include files at the root level (no folder)
-    from models import File
-    root_files = File.query.filter_by(
-        dataroom_id=dataroom_id,
-        folder_id=None
-    ).order_by(File.name).all()
+    page_size = current_app.config["CHANGE_FEED_PAGE_SIZE"]
+    limit = max(1, min(request.args.get("limit", page_size, type=int), page_size))
+    changes = get_changes_since(dataroom_id, since, settled, limit, current_user.id)
+    has_more = len(changes) == limit
 
     return jsonify({
-        "dataroom": dataroom.to_dict(),
-        "structure": structure,
-        "root_files": [file.to_dict() for file in root_files],
+        "changes": [change.to_dict() for change in changes],
+        # Past the changes the caller may not see, too
+        "cursor": changes[-1].id if has_more else max(since, settled),
+        "has_more": has_more,
     })
+
+
+@datarooms_bp.route("/<int:dataroom_id>/activity", methods=["GET"])
+@login_required
+def get_dataroom_activity(current_user, dataroom_id: int):
+    """Get file views and downloads in a dataroom, newest first.
+
+    Pages are keyed by event id: pass the returned `next_cursor` as `before`
+    to get the next page. Events become visible once their process flushes
+    its audit buffer (at most AUDIT_FLUSH_INTERVAL seconds).
+    """
+    dataroom = db.session.get(DataRoom, dataroom_id)
+
+    if not dataroom:
+        return jsonify({"error": "Dataroom not found"}), 404
+
+    if not has_access(current_user.id, dataroom_id, OWNER):
+        return jsonify({"error": "Access denied"}), 403
+
+    action = request.args.get("action")
+    if action is not None and action not in ("viewed", "downloaded"):
+        return jsonify({"error": "action must be 'viewed' or 'downloaded'"}), 400
+
+    page_size = current_app.config["AUDIT_PAGE_SIZE"]
+    limit = max(1, min(request.args.get("limit", page_size, type=int), page_size))
+
+    query = (
+        select(AccessEvent, User.name, User.email)
+        .outerjoin(User, User.id == AccessEvent.user_id)
+        .where(AccessEvent.dataroom_id == dataroom_id)
+    )
+    before = request.args.get("before", type=int)
+    if before is not None:
+        query = query.where(AccessEvent.id < before)
+    file_id = request.args.get("file_id", type=int)
+    if file_id is not None:
+        query = query.where(AccessEvent.file_id == file_id)
+    if action is not None:
+        query = query.where(AccessEvent.action == action)
+
+    # One extra row tells whether another page exists
+    rows = db.session.execute(query.order_by(AccessEvent.id.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return jsonify({
+        "events": [
+            {**event.to_dict(), "user": {"id": event.user_id, "name": name, "email": email}}
+            for event, name, email in rows
+        ],
+        "next_cursor": rows[-1][0].id if has_more else None,
+        "has_more": has_more,
+    })
+
+
+def grant_change(grant: Grant) -> dict:
+    """Change feed data of a grant - members see each other's roles, not who they are."""
+    return {"id": grant.id, "role": grant.role, "path": folder_path(grant)}
+
+
+@datarooms_bp.route("/<int:dataroom_id>/members", methods=["GET"])
+@login_required
+def list_members(current_user, dataroom_id: int):
+    """List the grants of a dataroom."""
+    dataroom = db.session.get(DataRoom, dataroom_id)
+
+    if not dataroom:
+        return jsonify({"error": "Dataroom not found"}), 404
+
+    if not has_access(current_user.id, dataroom_id, OWNER):
+        return jsonify({"error": "Access denied"}), 403
+
+    grants = Grant.query.filter_by(dataroom_id=dataroom_id).order_by(Grant.created_at).all()
+
+    return jsonify({
+        "owner": {"id": dataroom.owner.id, "email": dataroom.owner.email, "name": dataroom.owner.name},
+        "members": [grant.to_dict() for grant in grants],
+    })
+
+
+@datarooms_bp.route("/<int:dataroom_id>/members", methods=["POST"])
+@login_required
+def add_member(current_user, dataroom_id: int):
+    """Grant a user a role in a dataroom or a folder of it.
+
+    Body: {"email": ..., "role": "viewer"|"editor", "folder_id": ... (optional)}.
+    Granting again on the same dataroom or folder changes the role.
+    """
+    dataroom = db.session.get(DataRoom, dataroom_id)
+
+    if not dataroom:
+        return jsonify({"error": "Dataroom not found"}), 404
+
+    if not has_access(current_user.id, dataroom_id, OWNER):
+        return jsonify({"error": "Access denied"}), 403
+
+    data = request.get_json(silent=True) or {}
+    role = data.get("role")
+    folder_id = data.get("folder_id") or None
+
+    if not data.get("email") or role not in ROLES or role == "owner":
+        return jsonify({"error": "email and role ('viewer' or 'editor') are required"}), 400
+
+    user = User.query.filter_by(email=data["email"]).first()
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    if user.id == dataroom.owner_id:
+        return jsonify({"error": "The owner already has full access"}), 400
+
+    if folder_id is not None:
+        folder = db.session.get(Folder, folder_id)
+        if not folder or folder.dataroom_id != dataroom_id:
+            return jsonify({"error": "Invalid folder"}), 400
+
+    grant = Grant.query.filter_by(dataroom_id=dataroom_id, folder_id=folder_id, user_id=user.id).first()
+    action = "updated" if grant else "created"
+    if grant:
+        grant.role = role
+    else:
+        grant = Grant(dataroom_id=dataroom_id, folder_id=folder_id, user_id=user.id, role=role, created_by=current_user.id)
+        db.session.add(grant)
+    db.session.flush()
+
+    rebuild_permissions(dataroom_id, user.id)
+    # Advances the change cursor, which also invalidates cached listings
+    record_change(dataroom_id, "member", grant.id, action, grant_change(grant), path=folder_path(grant))
+    db.session.commit()
+
+    return jsonify({"member": grant.to_dict()}), 201 if action == "created" else 200
+
+
+@datarooms_bp.route("/<int:dataroom_id>/members/<int:grant_id>", methods=["DELETE"])
+@login_required
+def remove_member(current_user, dataroom_id: int, grant_id: int):
+    """Revoke a grant."""
+    grant = db.session.get(Grant, grant_id)
+
+    if not grant or grant.dataroom_id != dataroom_id:
+        return jsonify({"error": "Member not found"}), 404
+
+    if not has_access(current_user.id, dataroom_id, OWNER):
+        return jsonify({"error": "Access denied"}), 403
+
+    user_id = grant.user_id
+    record_change(dataroom_id, "member", grant.id, "deleted", grant_change(grant), path=folder_path(grant))
+    db.session.delete(grant)
+    db.session.flush()
+    rebuild_permissions(dataroom_id, user_id)
+    db.session.commit()
+
+    return jsonify({"message": "Member removed successfully"})
+
+
+@datarooms_bp.route("/<int:dataroom_id>/changes/stream", methods=["GET"])
+@login_required
+def stream_dataroom_changes(current_user, dataroom_id: int):
+    """Stream dataroom changes as Server-Sent Events."""
+    dataroom = db.session.get(DataRoom, dataroom_id)
+
+    if not dataroom:
+        return jsonify({"error": "Dataroom not found"}), 404
+
+    if not get_user_prefixes(current_user.id, dataroom_id):
+        return jsonify({"error": "Access denied"}), 403
+
+    # EventSource reconnects send the last delivered cursor in Last-Event-ID
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", type=int)
+    if since is None:
+        since = get_settled_cursor(dataroom_id)
+
+    page_size = current_app.config["CHANGE_FEED_PAGE_SIZE"]
+    poll_interval = current_app.config["CHANGE_FEED_POLL_INTERVAL"]
+    deadline = time.monotonic() + current_app.config["CHANGE_FEED_STREAM_TIMEOUT"]
+
+    def generate():
+        cursor = since
+        yield f"retry: {int(poll_interval * 1000)}\n\n"
+        while time.monotonic() < deadline:
+            settled = get_settled_cursor(dataroom_id)
+            changes = [
+                change.to_dict()
+                for change in get_changes_since(dataroom_id, cursor, settled, page_size, current_user.id)
+            ]
+            # End the read transaction so the next poll sees new commits
+            db.session.rollback()
+            for change in changes:
+                cursor = change["cursor"]
+                yield f"id: {cursor}\nevent: change\ndata: {json.dumps(change)}\n\n"
+            if not changes:
+                yield ": keep-alive\n\n"
+                time.sleep(poll_interval)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,12 +1,23 @@
 """Routes for File CRUD operations and upload."""
 
 import os
+import tempfile
 from pathlib import Path
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from PyPDF2 import PdfReader
-from models import db, File, DataRoom, Folder
+from models import db, File, FilePage, DataRoom, Folder
 from auth_utils import login_required
+from changes import record_change
+from extraction import extract_pdf
+from background import run_in_background
+from thumbnails import generate_preview, delete_thumbnail
+from storage import get_storage
+from quota import reserve_storage, charge_storage, transfer_storage
+from acl import VIEWER, EDITOR, folder_path, has_access
+from similarity import find_similar, index_files
+from text_store import load_texts, store_texts
+from audit import record_access
+from admission import admission_control
 
 files_bp = Blueprint("files", __name__)
 
@@ -17,21 +28,6 @@ def allowed_file(filename: str) -> bool:
            filename.rsplit(".", 1)[1].lower() in current_app.config["ALLOWED_EXTENSIONS"]
 
 
-def extract_pdf_text(file_path: str) -> str:
-    """Extract text from PDF file."""
-    try:
-        reader = PdfReader(file_path)
-        text_parts = []
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                text_parts.append(text)
-        return "\n".join(text_parts)
-    except Exception as e:
-        current_app.logger.warning(f"Failed to extract text from PDF: {e}")
-        return ""
-
-
 def get_unique_filename(dataroom_id: int, folder_id: int, original_name: str) -> str:
     """Generate unique filename if duplicate exists."""
     name, ext = os.path.splitext(original_name)
@@ -61,8 +57,35 @@ def get_unique_filename(dataroom_id: int, folder_id: int, original_name: str) ->
 
 @files_bp.route("", methods=["POST"])
 @login_required
+@admission_control("upload")
 def upload_file(current_user):
     """Upload a file to a dataroom."""
+    # Reserve quota for the declared size before any of the body is read
+    reserved = request.content_length or current_app.config["MAX_CONTENT_LENGTH"]
+    if not reserve_storage(current_user.id, reserved):
+        db.session.rollback()
+        return jsonify({"error": "Storage quota exceeded"}), 413
+    db.session.commit()
+
+    # Moved to the dataroom owner once the dataroom is known
+    reservation = {"user_id": current_user.id, "size": reserved}
+    try:
+        response, status = store_upload(current_user, reservation)
+    except Exception:
+        db.session.rollback()
+        charge_storage(reservation["user_id"], -reserved)
+        db.session.commit()
+        raise
+
+    if status != 201:
+        db.session.rollback()
+        charge_storage(reservation["user_id"], -reserved)
+        db.session.commit()
+    return response, status
+
+
+def store_upload(current_user, reservation: dict):
+    """Validate and store an upload whose size is already reserved against a quota."""
     # Check if file is in request
     if "file" not in request.files:
         return jsonify({"error": "No file provided"}), 400
@@ -82,39 +105,52 @@ def upload_file(current_user):
     if not dataroom_id:
         return jsonify({"error": "dataroom_id is required"}), 400
 
-    # Verify dataroom access
-    dataroom = db.session.get(DataRoom, dataroom_id)
-    if not dataroom or dataroom.owner_id != current_user.id:
-        return jsonify({"error": "Invalid dataroom or access denied"}), 403
-
     # Verify folder if provided
+    folder = None
     if folder_id:
         folder = db.session.get(Folder, folder_id)
         if not folder or folder.dataroom_id != dataroom_id:
             return jsonify({"error": "Invalid folder"}), 400
 
+    # Verify dataroom access
+    dataroom = db.session.get(DataRoom, dataroom_id)
+    if not dataroom or not has_access(current_user.id, dataroom_id, EDITOR, folder.path if folder else None):
+        return jsonify({"error": "Invalid dataroom or access denied"}), 403
+
+    # Files count toward the dataroom owner's quota
+    if dataroom.owner_id != reservation["user_id"]:
+        if not transfer_storage(reservation["user_id"], dataroom.owner_id, reservation["size"]):
+            db.session.rollback()
+            return jsonify({"error": "Storage quota exceeded"}), 413
+        db.session.commit()
+        reservation["user_id"] = dataroom.owner_id
+
     # Generate unique filename if needed
     original_name = secure_filename(file.filename)
     unique_name = get_unique_filename(dataroom_id, folder_id, original_name)
 
-    # Create dataroom-specific directory
-    upload_dir = Path(current_app.config["UPLOAD_FOLDER"]) / str(dataroom_id)
-    upload_dir.mkdir(parents=True, exist_ok=True)
-
     # Save file with unique ID-based name to avoid conflicts
     import uuid
+    storage = get_storage()
     file_id = str(uuid.uuid4())
     file_ext = os.path.splitext(unique_name)[1]
-    disk_filename = f"{file_id}{file_ext}"
-    file_path = upload_dir / disk_filename
+    storage_key = storage.make_key(dataroom_id, f"{file_id}{file_ext}")
+
+    # Stage the upload locally, extract text from the staged copy, then move it into storage
+    fd, staged_path = tempfile.mkstemp(dir=storage.staging_dir(), suffix=file_ext)
+    os.close(fd)
+    try:
+        file.save(staged_path)
 
-    file.save(str(file_path))
+        # Get file size
+        file_size = os.path.getsize(staged_path)
 
-    # Get file size
-    file_size = file_path.stat().st_size
+        # Extract text for search
+        extraction = extract_pdf(staged_path)
 
-    # Extract text for search
-    content_text = extract_pdf_text(str(file_path))
+        storage.put_file(Path(staged_path), storage_key)
+    finally:
+        Path(staged_path).unlink(missing_ok=True)
 
     # Create file record
     file_record = File(
@@ -122,15 +158,28 @@ def upload_file(current_user):
         original_name=original_name,
         folder_id=folder_id,
         dataroom_id=dataroom_id,
-        file_path=f"{dataroom_id}/{disk_filename}",
+        file_path=storage_key,
         file_size=file_size,
         mime_type="application/pdf",
-        content_text=content_text,
+        page_count=extraction.page_count if extraction.ok else None,
+        pages=[
+            FilePage(page_number=number, text_offset=offset, text_length=length)
+            for number, (offset, length) in enumerate(extraction.page_spans, start=1)
+        ],
     )
 
     db.session.add(file_record)
+    db.session.flush()  # Get the ID
+    store_texts([(file_record.id, extraction.text)])
+    index_files([(file_record.id, extraction.text)])
+    record_change(dataroom_id, "file", file_record.id, "created", file_record.to_dict(), path=folder_path(file_record))
+    # True up the reservation (request size) to the stored size
+    charge_storage(reservation["user_id"], file_size - reservation["size"])
     db.session.commit()
 
+    # The thumbnail is rendered after the response
+    run_in_background(generate_preview, file_record.id)
+
     return jsonify({"file": file_record.to_dict()}), 201
 
 
@@ -143,12 +192,97 @@ def get_file_info(current_user, file_id: int):
     if not file:
         return jsonify({"error": "File not found"}), 404
 
-    if file.dataroom.owner_id != current_user.id:
+    if not has_access(current_user.id, file.dataroom_id, VIEWER, folder_path(file)):
         return jsonify({"error": "Access denied"}), 403
 
+    record_access(current_user, file, "viewed")
     return jsonify({"file": file.to_dict()})
 
 
+@files_bp.route("/<int:file_id>/pages", methods=["GET"])
+@login_required
+def get_file_pages(current_user, file_id: int):
+    """Get extracted text per page (optionally a single page)."""
+    file = db.session.get(File, file_id)
+
+    if not file:
+        return jsonify({"error": "File not found"}), 404
+
+    if not has_access(current_user.id, file.dataroom_id, VIEWER, folder_path(file)):
+        return jsonify({"error": "Access denied"}), 403
+
+    query = FilePage.query.filter_by(file_id=file.id)
+    page_number = request.args.get("page", type=int)
+    if page_number:
+        query = query.filter_by(page_number=page_number)
+
+    pages = query.order_by(FilePage.page_number).all()
+    # Pages are slices of the file's compressed text
+    text = load_texts([file.id]).get(file.id, "") if pages else ""
+
+    return jsonify({"pages": [page.to_dict(text) for page in pages]})
+
+
+@files_bp.route("/<int:file_id>/thumbnail", methods=["GET"])
+@login_required
+def get_file_thumbnail(current_user, file_id: int):
+    """Get the first-page thumbnail of a file."""
+    file = db.session.get(File, file_id)
+
+    if not file:
+        return jsonify({"error": "File not found"}), 404
+
+    if not has_access(current_user.id, file.dataroom_id, VIEWER, folder_path(file)):
+        return jsonify({"error": "Access denied"}), 403
+
+    if not file.thumbnail_path:
+        return jsonify({"error": "Thumbnail not available"}), 404
+
+    storage = get_storage()
+
+    if not storage.exists(file.thumbnail_path):
+        return jsonify({"error": "Thumbnail not found in storage"}), 404
+
+    response = storage.send(
+        file.thumbnail_path,
+        mimetype="image/jpeg",
+        max_age=current_app.config["THUMBNAIL_CACHE_MAX_AGE"],
+    )
+    # Thumbnails are per-user content: browsers may cache them, shared caches may not
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
+@files_bp.route("/<int:file_id>/duplicates", methods=["GET"])
+@login_required
+def get_file_duplicates(current_user, file_id: int):
+    """List near-duplicates of a file across the user's datarooms."""
+    file = db.session.get(File, file_id)
+
+    if not file:
+        return jsonify({"error": "File not found"}), 404
+
+    if not has_access(current_user.id, file.dataroom_id, VIEWER, folder_path(file)):
+        return jsonify({"error": "Access denied"}), 403
+
+    matches = find_similar(file.id, current_user.id)
+    files = {
+        f.id: f for f in File.query.filter(File.id.in_([file_id for file_id, _ in matches])).all()
+    } if matches else {}
+
+    duplicates = []
+    for match_id, similarity in matches:
+        match = files[match_id]
+        duplicates.append({
+            **match.to_dict(),
+            "similarity": round(similarity, 3),
+            "dataroom": {"id": match.dataroom.id, "name": match.dataroom.name},
+        })
+
+    return jsonify({"file": file.to_dict(), "duplicates": duplicates})
+
+
 @files_bp.route("/<int:file_id>/download", methods=["GET"])
 @login_required
 def download_file(current_user, file_id: int):
@@ -158,16 +292,17 @@ def download_file(current_user, file_id: int):
     if not file:
         return jsonify({"error": "File not found"}), 404
 
-    if file.dataroom.owner_id != current_user.id:
+    if not has_access(current_user.id, file.dataroom_id, VIEWER, folder_path(file)):
         return jsonify({"error": "Access denied"}), 403
 
-    file_path = Path(current_app.config["UPLOAD_FOLDER"]) / file.file_path
+    storage = get_storage()
 
-    if not file_path.exists():
-        return jsonify({"error": "File not found on disk"}), 404
+    if not storage.exists(file.file_path):
+        return jsonify({"error": "File not found in storage"}), 404
 
-    return send_file(
-        str(file_path),
+    record_access(current_user, file, "downloaded")
+    return storage.send(
+        file.file_path,
         mimetype=file.mime_type,
         as_attachment=True,
         download_name=file.name
@@ -183,7 +318,7 @@ def update_file(current_user, file_id: int):
     if not file:
         return jsonify({"error": "File not found"}), 404
 
-    if file.dataroom.owner_id != current_user.id:
+    if not has_access(current_user.id, file.dataroom_id, EDITOR, folder_path(file)):
         return jsonify({"error": "Access denied"}), 403
 
     data = request.get_json()
@@ -206,6 +341,8 @@ def update_file(current_user, file_id: int):
             return jsonify({"error": "File with this name already exists in this location"}), 409
 
         file.name = new_name
+        db.session.flush()
+        record_change(file.dataroom_id, "file", file.id, "renamed", file.to_dict(), path=folder_path(file))
 
     if "folder_id" in data:
         # Move file to different folder
@@ -216,7 +353,16 @@ def update_file(current_user, file_id: int):
             if not folder or folder.dataroom_id != file.dataroom_id:
                 return jsonify({"error": "Invalid folder"}), 400
 
+        target_path = folder.path if new_folder_id else None
+        if not has_access(current_user.id, file.dataroom_id, EDITOR, target_path):
+            return jsonify({"error": "Access denied"}), 403
+
+        previous_path = folder_path(file)
         file.folder_id = new_folder_id
+        db.session.flush()
+        record_change(
+            file.dataroom_id, "file", file.id, "moved", file.to_dict(), path=target_path, old_path=previous_path,
+        )
 
     db.session.commit()
 
@@ -232,16 +378,21 @@ def delete_file(current_user, file_id: int):
     if not file:
         return jsonify({"error": "File not found"}), 404
 
-    if file.dataroom.owner_id != current_user.id:
+    if not has_access(current_user.id, file.dataroom_id, EDITOR, folder_path(file)):
         return jsonify({"error": "Access denied"}), 403
 
-    # Delete file from disk
-    file_path = Path(current_app.config["UPLOAD_FOLDER"]) / file.file_path
-    if file_path.exists():
-        file_path.unlink()
+    record_change(
+        file.dataroom_id, "file", file.id, "deleted", {"id": file.id, "folder_id": file.folder_id}, path=folder_path(file),
+    )
+    charge_storage(file.dataroom.owner_id, -file.file_size)
 
-    # Delete database record
+    # Delete database record, then the file and its thumbnail from storage
+    file_path, thumbnail_path = file.file_path, file.thumbnail_path
     db.session.delete(file)
     db.session.commit()
 
+    storage = get_storage()
+    storage.delete(file_path)
+    delete_thumbnail(file_path, storage, thumbnail_path)
+
     return jsonify({"message": "File deleted successfully"})
@@ -1,13 +1,44 @@
 """Routes for Folder CRUD operations."""
 
 import os
-from pathlib import Path
+from typing import Optional
 from flask import Blueprint, request, jsonify, current_app
-from models import db, Folder, DataRoom
+from sqlalchemy import func, select
+from models import db, Folder, DataRoom, File
 from auth_utils import login_required
+from changes import record_change, get_folder_cursor
+from thumbnails import delete_thumbnail
+from storage import get_storage
+from compress import cached_response
+from folder_stats import EMPTY_STATS, get_folder_stats
+from quota import charge_storage
+from acl import (
+    VIEWER, EDITOR, drop_subtree_permissions, folder_name_error, get_user_prefixes, has_access, level_at,
+    move_permission_prefixes,
+)
+from serialization import FILE_COLUMNS, FOLDER_COLUMNS, file_row, folder_row, json_response, stream_rows
+from tree_index import breadcrumbs, get_folder_tree
 
 folders_bp = Blueprint("folders", __name__)
 
+# Sort keys for folder listings: (folder key, file key)
+SORT_KEYS = {
+    "name": (lambda folder: folder["name"].lower(), lambda file: file["name"].lower()),
+    "size": (lambda folder: folder["total_size"], lambda file: file["file_size"]),
+    "file_count": (lambda folder: folder["file_count"], lambda file: file["name"].lower()),
+    "created_at": (lambda folder: folder["created_at"], lambda file: file["created_at"]),
+    "updated_at": (lambda folder: folder["updated_at"], lambda file: file["updated_at"]),
+}
+
+# The file keys above as SQL, for listings sorted by the database
+FILE_SORT_COLUMNS = {
+    "name": func.lower(File.name),
+    "size": File.file_size,
+    "file_count": func.lower(File.name),
+    "created_at": File.created_at,
+    "updated_at": File.updated_at,
+}
+
 
 def update_folder_path(folder: Folder) -> None:
     """Update folder path based on parent hierarchy."""
@@ -30,19 +61,23 @@ def create_folder(current_user):
 
     if not data or not data.get("name") or not data.get("dataroom_id"):
         return jsonify({"error": "Name and dataroom_id are required"}), 400
-
-    # Verify dataroom access
-    dataroom = db.session.get(DataRoom, data["dataroom_id"])
-    if not dataroom or dataroom.owner_id != current_user.id:
-        return jsonify({"error": "Invalid dataroom or access denied"}), 403
+    error = folder_name_error(data["name"])
+    if error:
+        return jsonify({"error": error}), 400
 
     # Verify parent folder if provided
     parent_id = data.get("parent_id")
+    parent = None
     if parent_id:
         parent = db.session.get(Folder, parent_id)
-        if not parent or parent.dataroom_id != dataroom.id:
+        if not parent or parent.dataroom_id != data["dataroom_id"]:
             return jsonify({"error": "Invalid parent folder"}), 400
 
+    # Verify dataroom access
+    dataroom = db.session.get(DataRoom, data["dataroom_id"])
+    if not dataroom or not has_access(current_user.id, dataroom.id, EDITOR, parent.path if parent else None):
+        return jsonify({"error": "Invalid dataroom or access denied"}), 403
+
     # Check for duplicate name in same location
     existing = Folder.query.filter_by(
         dataroom_id=dataroom.id,
@@ -65,6 +100,7 @@ def create_folder(current_user):
 
     # Update path
     update_folder_path(folder)
+    record_change(dataroom.id, "folder", folder.id, "created", folder.to_dict(), path=folder.path)
     db.session.commit()
 
     return jsonify({"folder": folder.to_dict()}), 201
@@ -74,16 +110,56 @@ def create_folder(current_user):
 @login_required
 def get_folder(current_user, folder_id: int):
     """Get a specific folder with its contents."""
+    tree = get_folder_tree(folder_id)
+    if tree is not None:
+        # Served from the in-memory tree index
+        node = tree.folders.get(folder_id)
+        if not node:
+            return jsonify({"error": "Folder not found"}), 404
+        prefixes = get_user_prefixes(current_user.id, node.dataroom_id)
+        if level_at(prefixes, node.path) < VIEWER:
+            return jsonify({"error": "Access denied"}), 403
+        return json_response({
+            "folder": {
+                **folder_row(node),
+                **node.stats,
+                "children": [{**folder_row(child), **child.stats} for child in node.children],
+                "files": [file_row(file) for file in node.files],
+            },
+            "breadcrumbs": breadcrumbs(node, prefixes),
+        })
+
     folder = db.session.get(Folder, folder_id)
 
     if not folder:
         return jsonify({"error": "Folder not found"}), 404
 
     # Verify access through dataroom
-    if folder.dataroom.owner_id != current_user.id:
+    prefixes = get_user_prefixes(current_user.id, folder.dataroom_id)
+    if level_at(prefixes, folder.path) < VIEWER:
         return jsonify({"error": "Access denied"}), 403
 
-    return jsonify({"folder": folder.to_dict(include_children=True)})
+    # Subtree totals for the folder and its children in one aggregate
+    child_folders = db.session.execute(
+        select(*FOLDER_COLUMNS).where(Folder.dataroom_id == folder.dataroom_id, Folder.parent_id == folder.id)
+        .order_by(Folder.name)
+    ).all()
+    stats = get_folder_stats([folder.id, *(child.id for child in child_folders)])
+    files = stream_rows(
+        select(*FILE_COLUMNS).where(File.dataroom_id == folder.dataroom_id, File.folder_id == folder.id)
+        .order_by(File.name),
+        file_row,
+    )
+
+    return json_response({
+        "folder": {
+            **folder_row(folder),
+            **stats.get(folder.id, EMPTY_STATS),
+            "children": [{**folder_row(child), **stats.get(child.id, EMPTY_STATS)} for child in child_folders],
+            "files": files,
+        },
+        "breadcrumbs": breadcrumbs(folder, prefixes),
+    })
 
 
 @folders_bp.route("/<int:folder_id>", methods=["PUT"])
@@ -95,12 +171,16 @@ def update_folder(current_user, folder_id: int):
     if not folder:
         return jsonify({"error": "Folder not found"}), 404
 
-    if folder.dataroom.owner_id != current_user.id:
+    if not has_access(current_user.id, folder.dataroom_id, EDITOR, folder.path):
         return jsonify({"error": "Access denied"}), 403
 
     data = request.get_json()
 
     if "name" in data:
+        error = folder_name_error(data["name"])
+        if error:
+            return jsonify({"error": error}), 400
+
         # Check for duplicate name
         existing = Folder.query.filter_by(
             dataroom_id=folder.dataroom_id,
@@ -111,28 +191,29 @@ def update_folder(current_user, folder_id: int):
         if existing:
             return jsonify({"error": "Folder with this name already exists in this location"}), 409
 
+        previous_path = folder.path
         folder.name = data["name"]
         update_folder_path(folder)
+        move_permission_prefixes(folder.dataroom_id, previous_path, folder.path)
+        db.session.flush()
+        # Descendant paths change with the folder; clients rewrite the prefix
+        record_change(
+            folder.dataroom_id, "folder", folder.id, "renamed",
+            {**folder.to_dict(), "previous_path": previous_path},
+            path=folder.path, old_path=previous_path,
+        )
 
     db.session.commit()
 
     return jsonify({"folder": folder.to_dict()})
 
 
-def delete_physical_files_recursive(folder: Folder, upload_folder: Path) -> None:
-    """Recursively delete all physical files in a folder and its subfolders."""
-    # Delete files in this folder
-    for file in folder.files:
-        file_path = upload_folder / file.file_path
-        if file_path.exists():
-            try:
-                file_path.unlink()
-            except Exception as e:
-                current_app.logger.warning(f"Failed to delete file {file_path}: {e}")
-
-    # Recursively delete files in child folders
+def collect_blobs_recursive(folder: Folder) -> list[tuple[str, Optional[str]]]:
+    """Collect the (file_path, thumbnail_path) of every file in a folder and its subfolders."""
+    blobs = [(file.file_path, file.thumbnail_path) for file in folder.files]
     for child in folder.children:
-        delete_physical_files_recursive(child, upload_folder)
+        blobs.extend(collect_blobs_recursive(child))
+    return blobs
 
 
 @folders_bp.route("/<int:folder_id>", methods=["DELETE"])
@@ -144,40 +225,101 @@ def delete_folder(current_user, folder_id: int):
     if not folder:
         return jsonify({"error": "Folder not found"}), 404
 
-    if folder.dataroom.owner_id != current_user.id:
+    if not has_access(current_user.id, folder.dataroom_id, EDITOR, folder.path):
         return jsonify({"error": "Access denied"}), 403
 
-    # Delete all physical files recursively before deleting database records
-    upload_folder = Path(current_app.config["UPLOAD_FOLDER"])
-    delete_physical_files_recursive(folder, upload_folder)
+    # Physical files are deleted once the database records are gone for good
+    blobs = collect_blobs_recursive(folder)
+
+    # Deleting a folder implicitly deletes its whole subtree on the client
+    record_change(
+        folder.dataroom_id, "folder", folder.id, "deleted", {"id": folder.id, "path": folder.path}, path=folder.path,
+    )
+    stats = get_folder_stats([folder.id]).get(folder.id, EMPTY_STATS)
+    charge_storage(folder.dataroom.owner_id, -stats["total_size"])
+    drop_subtree_permissions(folder.dataroom_id, folder.path)
 
     # Delete folder (cascade will handle database cleanup of children and files)
     db.session.delete(folder)
     db.session.commit()
 
+    storage = get_storage()
+    for file_path, thumbnail_path in blobs:
+        try:
+            storage.delete(file_path)
+            delete_thumbnail(file_path, storage, thumbnail_path)
+        except Exception as e:
+            current_app.logger.warning(f"Failed to delete file {file_path}: {e}")
+
     return jsonify({"message": "Folder and all its contents deleted successfully"})
 
 
 @folders_bp.route("/<int:folder_id>/contents", methods=["GET"])
 @login_required
+@cached_response(lambda current_user, folder_id: get_folder_cursor(folder_id))
 def get_folder_contents(current_user, folder_id: int):
-    """Get immediate contents of a folder (non-recursive)."""
+    """Get immediate contents of a folder (non-recursive).
+
+    Child folders carry subtree totals; `sort` orders both lists by name,
+    size, file_count, created_at or updated_at (`order` asc or desc).
+    """
+    sort = request.args.get("sort", "name")
+    order = request.args.get("order", "asc")
+    if sort not in SORT_KEYS or order not in ("asc", "desc"):
+        return jsonify({"error": f"sort must be one of {', '.join(SORT_KEYS)} and order asc or desc"}), 400
+
+    folder_key, file_key = SORT_KEYS[sort]
+    tree = get_folder_tree(folder_id)
+    if tree is not None:
+        # Served from the in-memory tree index
+        node = tree.folders.get(folder_id)
+        if not node:
+            return jsonify({"error": "Folder not found"}), 404
+        prefixes = get_user_prefixes(current_user.id, node.dataroom_id)
+        if level_at(prefixes, node.path) < VIEWER:
+            return jsonify({"error": "Access denied"}), 403
+        folders = [{**folder_row(child), **child.stats} for child in node.children]
+        files = [file_row(file) for file in node.files]
+        folders.sort(key=folder_key, reverse=order == "desc")
+        files.sort(key=file_key, reverse=order == "desc")
+        return json_response({
+            "folder": {**folder_row(node), **node.stats},
+            "breadcrumbs": breadcrumbs(node, prefixes),
+            "folders": folders,
+            "files": files,
+        })
+
     folder = db.session.get(Folder, folder_id)
 
     if not folder:
         return jsonify({"error": "Folder not found"}), 404
 
-    if folder.dataroom.owner_id != current_user.id:
+    prefixes = get_user_prefixes(current_user.id, folder.dataroom_id)
+    if level_at(prefixes, folder.path) < VIEWER:
         return jsonify({"error": "Access denied"}), 403
 
-    # Get child folders
-    child_folders = Folder.query.filter_by(parent_id=folder.id).order_by(Folder.name).all()
-
-    # Get files in this folder
-    files = folder.files
+    # Get child folders and files as plain rows
+    # Filtering on dataroom_id too lets the (dataroom_id, parent, name) indexes find the rows
+    child_folders = db.session.execute(
+        select(*FOLDER_COLUMNS).where(Folder.dataroom_id == folder.dataroom_id, Folder.parent_id == folder.id)
+        .order_by(Folder.name)
+    ).all()
+
+    # Child folders sort on subtree totals, so they are sorted here; files,
+    # the long list, are sorted by the database and streamed from its cursor
+    stats = get_folder_stats([folder.id, *(f.id for f in child_folders)])
+    folders = [{**folder_row(f), **stats.get(f.id, EMPTY_STATS)} for f in child_folders]
+    folders.sort(key=folder_key, reverse=order == "desc")
+    file_order = FILE_SORT_COLUMNS[sort]
+    files = stream_rows(
+        select(*FILE_COLUMNS).where(File.dataroom_id == folder.dataroom_id, File.folder_id == folder.id)
+        .order_by(file_order.desc() if order == "desc" else file_order, File.name),
+        file_row,
+    )
 
-    return jsonify({
-        "folder": folder.to_dict(),
-        "folders": [f.to_dict() for f in child_folders],
-        "files": [f.to_dict() for f in files],
+    return json_response({
+        "folder": {**folder.to_dict(), **stats.get(folder.id, EMPTY_STATS)},
+        "breadcrumbs": breadcrumbs(folder, prefixes),
+        "folders": folders,
+        "files": files,
     })
@@ -1,15 +1,26 @@
 """Routes for search functionality."""
 
-from flask import Blueprint, request, jsonify
-from sqlalchemy import or_
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import false, or_, select
+from sqlalchemy.orm import aliased
 from models import db, File, Folder, DataRoom
 from auth_utils import login_required
+from changes import get_user_cursor
+from acl import accessible, get_user_prefixes
+from compress import cached_response
+from admission import admission_control
+from serialization import FILE_COLUMNS, FOLDER_COLUMNS, file_row, folder_row, json_response
+from text_store import confirm_matches, match_condition
+from name_index import FILE, Match, find_names, fuzzy_enabled
+from tree_index import FolderNode
 
 search_bp = Blueprint("search", __name__)
 
 
 @search_bp.route("", methods=["GET"])
 @login_required
+@cached_response(lambda current_user: get_user_cursor(current_user.id))
+@admission_control("search")
 def search_files(current_user):
     """Search files and folders by name and/or content."""
     query = request.args.get("q", "").strip()
@@ -17,128 +28,191 @@ def search_files(current_user):
     search_names = request.args.get("search_names", "true").lower() == "true"
     search_content = request.args.get("search_content", "true").lower() == "true"
     case_insensitive = request.args.get("case_insensitive", "true").lower() == "true"
+    fuzzy = request.args.get("fuzzy", "false").lower() == "true"
 
     if not query:
         return jsonify({"error": "Search query is required"}), 400
 
+    if fuzzy and not fuzzy_enabled():
+        return jsonify({"error": "Fuzzy search is disabled"}), 400
+
     # At least one search type must be selected
     if not search_names and not search_content:
         return jsonify({"error": "At least one search type must be selected"}), 400
 
-    # Base query - files in datarooms owned by current user
-    files_query = File.query.join(DataRoom).filter(DataRoom.owner_id == current_user.id)
-
-    # Base query - folders in datarooms owned by current user
-    folders_query = Folder.query.join(DataRoom).filter(DataRoom.owner_id == current_user.id)
-
     # Filter by dataroom if provided
     if dataroom_id:
         dataroom = db.session.get(DataRoom, dataroom_id)
-        if not dataroom or dataroom.owner_id != current_user.id:
+        if not dataroom or not get_user_prefixes(current_user.id, dataroom_id):
             return jsonify({"error": "Invalid dataroom"}), 400
-        files_query = files_query.filter(File.dataroom_id == dataroom_id)
-        folders_query = folders_query.filter(Folder.dataroom_id == dataroom_id)
 
-    # Search in filename and/or content for files based on filters
     search_pattern = f"%{query}%"
-    file_conditions = []
-    
-    if search_names:
-        if case_insensitive:
-            file_conditions.append(File.name.ilike(search_pattern))
-        else:
-            file_conditions.append(File.name.like(search_pattern))
-    
-    if search_content:
-        if case_insensitive:
-            file_conditions.append(File.content_text.ilike(search_pattern))
-        else:
-            file_conditions.append(File.content_text.like(search_pattern))
-    
-    if file_conditions:
-        files_query = files_query.filter(or_(*file_conditions))
-    else:
-        # If no file search conditions, return no files
-        files_query = files_query.filter(False)
 
-    # Search in folder name only if name search is enabled
-    if search_names:
-        if case_insensitive:
-            folders_query = folders_query.filter(Folder.name.ilike(search_pattern))
-        else:
-            folders_query = folders_query.filter(Folder.name.like(search_pattern))
-    else:
-        # If name search is disabled, return no folders
-        folders_query = folders_query.filter(False)
+    def matches(column):
+        return column.ilike(search_pattern) if case_insensitive else column.like(search_pattern)
+
+    # Fuzzy name matches come from the in-memory name index; SQL then only matches content
+    name_matches = find_names(current_user.id, query, dataroom_id) if fuzzy and search_names else []
+    sql_names = search_names and not fuzzy
+
+    # Match type is computed in SQL; content is matched against the term
+    # index, so file text is only decompressed to confirm phrase matches
+    name_match = matches(File.name) if sql_names else false()
+
+    def find_files(content_match) -> tuple[list, bool]:
+        """Find up to 50 readable files matching by name or content, as (row, matches content) pairs.
+
+        Candidates are scanned 50 at a time until 50 are confirmed or the scan
+        budget is spent (phrases matching few of many candidates stop early);
+        also returns whether the budget ran out.
+        """
+        if content_match is None:  # No words to look up
+            content_match = false()
+
+        # Files the current user can read, as plain rows
+        files_query = (
+            select(
+                *FILE_COLUMNS,
+                DataRoom.name.label("dataroom_name"),
+                Folder.name.label("folder_name"),
+                Folder.path.label("folder_path"),
+                name_match.label("matches_name"),
+                content_match.label("matches_content"),
+            )
+            .join(DataRoom, File.dataroom_id == DataRoom.id)
+            .outerjoin(Folder, File.folder_id == Folder.id)
+            .where(accessible(current_user.id, File.dataroom_id, Folder.path), or_(name_match, content_match))
+        )
+        if dataroom_id:
+            files_query = files_query.where(File.dataroom_id == dataroom_id)
+
+        files = []
+        files_query = files_query.order_by(File.name, File.id).limit(50)
+        max_scanned = max(50, current_app.config["SEARCH_MAX_SCANNED_FILES"])
+        offset = 0
+        truncated = False
+        while (sql_names or search_content) and len(files) < 50:
+            rows = db.session.execute(files_query.offset(offset)).all()
+            candidates = [row.id for row in rows if row.matches_content]
+            confirmed = confirm_matches(query, candidates, case_insensitive) if candidates else set()
+            files.extend((row, row.id in confirmed) for row in rows if row.matches_name or row.id in confirmed)
+            if len(rows) < 50:
+                break
+            offset += 50
+            if offset >= max_scanned:
+                truncated = len(files) < 50
+                break
+        return files[:50], truncated
+
+    # Folders the current user can read, with their parent folder
+    parent = aliased(Folder)
+    folders_query = (
+        select(
+            *FOLDER_COLUMNS,
+            DataRoom.name.label("dataroom_name"),
+            parent.name.label("parent_name"),
+            parent.path.label("parent_path"),
+        )
+        .join(DataRoom, Folder.dataroom_id == DataRoom.id)
+        .outerjoin(parent, Folder.parent_id == parent.id)
+        .where(accessible(current_user.id, Folder.dataroom_id, Folder.path))
+    )
+    # Folders only match by name
+    folders_query = folders_query.where(matches(Folder.name) if sql_names else false())
 
-    # Execute queries with limits
-    files = files_query.order_by(File.name).limit(50).all()
-    folders = folders_query.order_by(Folder.name).limit(50).all()
+    if dataroom_id:
+        folders_query = folders_query.where(Folder.dataroom_id == dataroom_id)
+
+    # Content matches start at a word boundary; only if none do are words
+    # matched anywhere inside, which scans the terms instead of looking them up
+    content_match = match_condition(query) if search_content else None
+    content_mode = "word_prefix" if content_match is not None else None
+    files, truncated = find_files(content_match)
+    if content_match is not None and not any(matches_content for _, matches_content in files):
+        content_mode = "substring"
+        files, truncated = find_files(match_condition(query, substring=True))
+    folders = db.session.execute(folders_query.order_by(Folder.name).limit(50)).all() if sql_names else []
 
     # Format results with dataroom and folder context
     results = []
-    
+
     # Add file results
-    for file in files:
-        file_dict = file.to_dict()
+    for row, matches_content in files:
+        file_dict = file_row(row)
         file_dict["type"] = "file"
-        
-        # Determine match type
-        query_lower = query.lower()
-        matches_name = query_lower in file.name.lower()
-        matches_content = file.content_text and query_lower in file.content_text.lower()
-        
         file_dict["match_type"] = []
-        if matches_name and search_names:
+        if row.matches_name:
             file_dict["match_type"].append("name")
-        if matches_content and search_content:
+        if matches_content:
             file_dict["match_type"].append("content")
-        
-        file_dict["dataroom"] = {
-            "id": file.dataroom.id,
-            "name": file.dataroom.name,
-        }
-        if file.folder:
-            file_dict["folder"] = {
-                "id": file.folder.id,
-                "name": file.folder.name,
-                "path": file.folder.path,
-            }
+        file_dict["dataroom"] = {"id": row.dataroom_id, "name": row.dataroom_name}
+        if row.folder_id:
+            file_dict["folder"] = {"id": row.folder_id, "name": row.folder_name, "path": row.folder_path}
         else:
             file_dict["folder"] = None
         results.append(file_dict)
 
     # Add folder results
-    for folder in folders:
-        folder_dict = folder.to_dict()
+    for row in folders:
+        folder_dict = folder_row(row)
         folder_dict["type"] = "folder"
-        folder_dict["match_type"] = ["name"]  # Folders only match by name
-        folder_dict["dataroom"] = {
-            "id": folder.dataroom.id,
-            "name": folder.dataroom.name,
-        }
-        if folder.parent:
-            folder_dict["parent_folder"] = {
-                "id": folder.parent.id,
-                "name": folder.parent.name,
-                "path": folder.parent.path,
-            }
+        folder_dict["match_type"] = ["name"]
+        folder_dict["dataroom"] = {"id": row.dataroom_id, "name": row.dataroom_name}
+        if row.parent_id:
+            folder_dict["parent_folder"] = {"id": row.parent_id, "name": row.parent_name, "path": row.parent_path}
         else:
             folder_dict["parent_folder"] = None
         results.append(folder_dict)
 
-    # Sort results by name
-    results.sort(key=lambda x: x["name"].lower())
+    if fuzzy:
+        add_name_matches(results, name_matches)
+        # Best matches first; content-only matches last
+        results.sort(key=lambda x: (-x.get("score", 0), x["name"].lower()))
+    else:
+        # Sort results by name
+        results.sort(key=lambda x: x["name"].lower())
 
-    return jsonify({
+    return json_response({
         "query": query,
         "count": len(results),
-        "files_count": len(files),
-        "folders_count": len(folders),
+        "files_count": sum(result["type"] == "file" for result in results),
+        "folders_count": sum(result["type"] == "folder" for result in results),
+        "truncated": truncated,  # Not every candidate file was examined
+        "content_match": content_mode,  # "substring" when no word started with the query
         "results": results,
     })
 
 
+def add_name_matches(results: list[dict], name_matches: list[Match]) -> None:
+    """Add fuzzy name matches to search results, formatted from their tree nodes."""
+    dataroom_ids = {match.dataroom_id for match in name_matches}
+    dataroom_names = dict(db.session.execute(
+        select(DataRoom.id, DataRoom.name).where(DataRoom.id.in_(dataroom_ids))
+    ).all()) if dataroom_ids else {}
+    content_results = {result["id"]: result for result in results}  # Files matched by content
+
+    for match in name_matches:
+        parent = {"id": match.parent.id, "name": match.parent.name, "path": match.parent.path} if match.parent else None
+        if isinstance(match.node, FolderNode):
+            result = folder_row(match.node)
+            result["type"] = "folder"
+            result["match_type"] = ["name"]
+            result["parent_folder"] = parent
+        elif match.node.id in content_results:
+            result = content_results[match.node.id]
+            result["match_type"].insert(0, "name")
+            result["score"] = round(match.score, 3)
+            continue
+        else:
+            result = file_row(match.node)
+            result["type"] = "file"
+            result["match_type"] = ["name"]
+            result["folder"] = parent
+        result["score"] = round(match.score, 3)
+        result["dataroom"] = {"id": match.dataroom_id, "name": dataroom_names.get(match.dataroom_id)}
+        results.append(result)
+
+
 @search_bp.route("/autocomplete", methods=["GET"])
 @login_required
 def autocomplete(current_user):
@@ -149,8 +223,14 @@ def autocomplete(current_user):
     if not query or len(query) < 2:
         return jsonify({"suggestions": []})
 
+    if request.args.get("fuzzy", "false").lower() == "true" and fuzzy_enabled():
+        matches = find_names(current_user.id, query, dataroom_id, limit=10, kind=FILE)
+        return jsonify({"suggestions": [{"id": match.node.id, "name": match.node.name} for match in matches]})
+
     # Base query
-    files_query = File.query.join(DataRoom).filter(DataRoom.owner_id == current_user.id)
+    files_query = File.query.outerjoin(Folder, File.folder_id == Folder.id).filter(
+        accessible(current_user.id, File.dataroom_id, Folder.path)
+    )
 
     # Filter by dataroom
     if dataroom_id:
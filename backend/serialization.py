@@ -0,0 +1,151 @@
+"""Fast JSON serialization for large listings.
+
+Listing endpoints select plain column tuples instead of ORM objects and
+serialize them here. Responses are streamed: lists at any depth may be given
+as generators and are encoded item by item, so the first bytes leave before
+the whole body is built. Long listings are generated with stream_rows, which
+fetches rows from the database cursor in batches as they are encoded; the
+request context is kept for them until the response is closed. orjson is
+used when installed.
+"""
+
+import json
+import types
+from datetime import datetime
+from typing import Any, Callable, Iterator
+
+from flask import Response, stream_with_context
+
+from models import db, File, Folder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# Chunks are buffered up to this size before being written to the socket
+STREAM_CHUNK_SIZE = 64 * 1024
+CURSOR_BATCH_SIZE = 1000  # Rows fetched from the cursor at a time by stream_rows
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """Serialize a value to JSON bytes."""
+    if orjson is not None:
+        # orjson encodes datetimes natively in the same format as isoformat()
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode()
+
+
+def _is_lazy(value: Any) -> bool:
+    """Whether a value holds a generator, directly or in a nested dict."""
+    if isinstance(value, types.GeneratorType):
+        return True
+    return isinstance(value, dict) and any(_is_lazy(item) for item in value.values())
+
+
+def _encode(value: Any) -> Iterator[bytes]:
+    """Encode a value, expanding generators lazily."""
+    if isinstance(value, types.GeneratorType):
+        yield b"["
+        for index, item in enumerate(value):
+            if index:
+                yield b","
+            yield from _encode(item)
+        yield b"]"
+    elif isinstance(value, dict) and _is_lazy(value):
+        yield b"{"
+        for index, (key, item) in enumerate(value.items()):
+            if index:
+                yield b","
+            yield dumps(key)
+            yield b":"
+            yield from _encode(item)
+        yield b"}"
+    else:
+        yield dumps(value)
+
+
+def iter_json(value: Any) -> Iterator[bytes]:
+    """Encode a value as JSON in chunks of roughly STREAM_CHUNK_SIZE bytes."""
+    buffer = bytearray()
+    for piece in _encode(value):
+        buffer += piece
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def json_response(value: Any, status: int = 200) -> Response:
+    """Build a streamed JSON response, encoded within the request's context."""
+    return Response(stream_with_context(iter_json(value)), status=status, mimetype="application/json")
+
+
+def stream_rows(stmt, serialize: Callable[[Any], dict]) -> Iterator[dict]:
+    """Execute a query now and serialize its rows as they are fetched from the cursor."""
+    result = db.session.execute(stmt.execution_options(yield_per=CURSOR_BATCH_SIZE))
+    return (serialize(row) for row in result)
+
+
+# Column sets and row serializers (mirror Folder.to_dict and File.to_dict)
+
+FOLDER_COLUMNS = (
+    Folder.id,
+    Folder.name,
+    Folder.parent_id,
+    Folder.dataroom_id,
+    Folder.path,
+    Folder.created_at,
+    Folder.updated_at,
+)
+
+FILE_COLUMNS = (
+    File.id,
+    File.name,
+    File.original_name,
+    File.folder_id,
+    File.dataroom_id,
+    File.file_size,
+    File.mime_type,
+    File.page_count,
+    File.thumbnail_path,
+    File.created_at,
+    File.updated_at,
+)
+
+
+def folder_row(row) -> dict:
+    """Serialize a row selected with FOLDER_COLUMNS."""
+    return {
+        "id": row.id,
+        "name": row.name,
+        "parent_id": row.parent_id,
+        "dataroom_id": row.dataroom_id,
+        "path": row.path,
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+    }
+
+
+def file_row(row) -> dict:
+    """Serialize a row selected with FILE_COLUMNS."""
+    return {
+        "id": row.id,
+        "name": row.name,
+        "original_name": row.original_name,
+        "folder_id": row.folder_id,
+        "dataroom_id": row.dataroom_id,
+        "file_size": row.file_size,
+        "mime_type": row.mime_type,
+        "page_count": row.page_count,
+        "thumbnail_url": f"/api/files/{row.id}/thumbnail" if row.thumbnail_path else None,
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+    }
@@ -0,0 +1,221 @@
+"""Near-duplicate document detection with MinHash and LSH.
+
+Each file's text is reduced to word shingles and summarized by a MinHash
+signature of NUM_PERM values: the fraction of equal values between two
+signatures estimates the Jaccard similarity of the documents. Signatures are
+split into BANDS bands; files sharing any band hash land in the same bucket.
+Lookups only compare the candidates found through the
+(band, bucket) index, so they stay sub-linear in the number of files.
+
+Changing NUM_PERM, BANDS or SHINGLE_SIZE invalidates stored signatures; run
+`flask similarity-backfill --all` afterwards.
+"""
+
+import re
+import zlib
+from typing import Iterable, Optional
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select, delete, insert, and_, tuple_
+
+from models import db, File, FileSignature, Folder, SimilarityBucket
+from acl import accessible
+
+NUM_PERM = 128
+BANDS = 16  # 8 rows per band: pairs above ~0.7 similarity become candidates
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5  # Words per shingle
+CHUNK_SIZE = 8192  # Shingles hashed per vectorized step
+
+_rng = np.random.default_rng(0x5EED)  # Fixed, so signatures are stable across processes
+_PERM_A = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_BAND_MULTIPLIERS = _rng.integers(1, 2**63, ROWS, dtype=np.uint64) | np.uint64(1)
+_SHINGLE_MULTIPLIER = np.uint64(0x100000001B3)
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """Hash every run of SHINGLE_SIZE words in a text to a unique 32-bit value."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return np.empty(0, dtype=np.uint64)
+
+    tokens = np.fromiter((zlib.crc32(word.encode()) for word in words), dtype=np.uint64, count=len(words))
+    count = len(tokens) - SHINGLE_SIZE + 1
+    hashes = tokens[:count].copy()
+    for offset in range(1, SHINGLE_SIZE):
+        hashes = hashes * _SHINGLE_MULTIPLIER + tokens[offset:offset + count]  # Wraps mod 2**64
+    return np.unique((hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+
+
+def compute_signatures(shingle_sets: list[np.ndarray]) -> np.ndarray:
+    """Compute the MinHash signatures of several documents at once.
+
+    All shingles are hashed together in CHUNK_SIZE steps and reduced per
+    document, so a batch costs a few large array operations rather than a
+    Python loop per document. Returns one row of NUM_PERM uint32 per set.
+    """
+    signatures = np.full((len(shingle_sets), NUM_PERM), np.iinfo(np.uint32).max, dtype=np.uint64)
+    if not shingle_sets:
+        return signatures.astype("<u4")
+
+    shingles = np.concatenate(shingle_sets)
+    owners = np.repeat(np.arange(len(shingle_sets)), [len(s) for s in shingle_sets])
+    for start in range(0, len(shingles), CHUNK_SIZE):
+        chunk = shingles[start:start + CHUNK_SIZE]
+        chunk_owners = owners[start:start + CHUNK_SIZE]
+        # Multiply-shift hashing, one row per permutation
+        permuted = (_PERM_A[:, None] * chunk[None, :] + _PERM_B[:, None]) >> np.uint64(32)
+        # Minimum per permutation over each document's run of columns
+        bounds = np.flatnonzero(np.r_[True, chunk_owners[1:] != chunk_owners[:-1]])
+        minima = np.minimum.reduceat(permuted, bounds, axis=1).T
+        documents = chunk_owners[bounds]
+        signatures[documents] = np.minimum(signatures[documents], minima)
+    return signatures.astype("<u4")
+
+
+def band_buckets(signature: np.ndarray) -> np.ndarray:
+    """Hash each band of a signature to a signed 64-bit bucket id."""
+    bands = signature.astype(np.uint64).reshape(BANDS, ROWS)
+    return (bands * _BAND_MULTIPLIERS).sum(axis=1).view(np.int64)
+
+
+def estimate_similarity(signature: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Estimate the Jaccard similarity between a signature and each row of `others`."""
+    return (others == signature).mean(axis=1)
+
+
+def _decode(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype="<u4")
+
+
+def index_files(documents: Iterable[tuple[int, Optional[str]]]) -> int:
+    """Replace the signatures and buckets of files in the current session.
+
+    Returns the number of files that got a signature.
+    """
+    documents = list(documents)
+    if not documents:
+        return 0
+
+    # Files without enough text get no signature
+    shingled = [(file_id, shingle_hashes(text or "")) for file_id, text in documents]
+    shingled = [(file_id, shingles) for file_id, shingles in shingled if len(shingles)]
+
+    signatures = []
+    buckets = []
+    computed = compute_signatures([shingles for _, shingles in shingled])
+    for (file_id, shingles), signature in zip(shingled, computed):
+        signatures.append({"file_id": file_id, "signature": signature.tobytes(), "shingle_count": len(shingles)})
+        buckets.extend(
+            {"file_id": file_id, "band": band, "bucket": int(bucket)}
+            for band, bucket in enumerate(band_buckets(signature))
+        )
+
+    file_ids = [file_id for file_id, _ in documents]
+    db.session.execute(delete(SimilarityBucket).where(SimilarityBucket.file_id.in_(file_ids)))
+    db.session.execute(delete(FileSignature).where(FileSignature.file_id.in_(file_ids)))
+    if signatures:
+        db.session.execute(insert(FileSignature), signatures)
+        db.session.execute(insert(SimilarityBucket), buckets)
+    return len(signatures)
+
+
+def find_similar(file_id: int, user_id: int, threshold: Optional[float] = None) -> list[tuple[int, float]]:
+    """Find files the user can read that are similar to a file, most similar first."""
+    threshold = current_app.config["SIMILARITY_THRESHOLD"] if threshold is None else threshold
+    blob = db.session.execute(
+        select(FileSignature.signature).where(FileSignature.file_id == file_id)
+    ).scalar()
+    if blob is None:
+        return []
+    signature = _decode(blob)
+
+    # Candidates share at least one band bucket
+    own_buckets = [(band, int(bucket)) for band, bucket in enumerate(band_buckets(signature))]
+    candidate_ids = (
+        select(SimilarityBucket.file_id)
+        .where(tuple_(SimilarityBucket.band, SimilarityBucket.bucket).in_(own_buckets))
+        .where(SimilarityBucket.file_id != file_id)
+        .distinct()
+        .scalar_subquery()
+    )
+    rows = db.session.execute(
+        select(FileSignature.file_id, FileSignature.signature)
+        .join(File, File.id == FileSignature.file_id)
+        .outerjoin(Folder, File.folder_id == Folder.id)
+        .where(FileSignature.file_id.in_(candidate_ids), accessible(user_id, File.dataroom_id, Folder.path))
+    ).all()
+    if not rows:
+        return []
+
+    scores = estimate_similarity(signature, np.stack([_decode(row.signature) for row in rows]))
+    matches = [(row.file_id, float(score)) for row, score in zip(rows, scores) if score >= threshold]
+    return sorted(matches, key=lambda match: match[1], reverse=True)
+
+
+def find_duplicate_groups(dataroom_id: int, threshold: Optional[float] = None) -> list[dict]:
+    """Group the near-duplicate files of a dataroom.
+
+    Returns groups of file ids with the similarity of each matching pair.
+    """
+    threshold = current_app.config["SIMILARITY_THRESHOLD"] if threshold is None else threshold
+    left = SimilarityBucket.__table__.alias("left_bucket")
+    right = SimilarityBucket.__table__.alias("right_bucket")
+    left_file = File.__table__.alias("left_file")
+    right_file = File.__table__.alias("right_file")
+
+    # Candidate pairs share a bucket; the self-join only touches this dataroom's buckets
+    pairs = db.session.execute(
+        select(left.c.file_id.label("a"), right.c.file_id.label("b"))
+        .join(right, and_(
+            left.c.band == right.c.band,
+            left.c.bucket == right.c.bucket,
+            left.c.file_id < right.c.file_id,
+        ))
+        .join(left_file, left_file.c.id == left.c.file_id)
+        .join(right_file, right_file.c.id == right.c.file_id)
+        .where(left_file.c.dataroom_id == dataroom_id, right_file.c.dataroom_id == dataroom_id)
+        .distinct()
+    ).all()
+    if not pairs:
+        return []
+
+    file_ids = {file_id for pair in pairs for file_id in pair}
+    signatures = {
+        row.file_id: _decode(row.signature) for row in db.session.execute(
+            select(FileSignature.file_id, FileSignature.signature).where(FileSignature.file_id.in_(file_ids))
+        )
+    }
+    left_sigs = np.stack([signatures[a] for a, _ in pairs])
+    right_sigs = np.stack([signatures[b] for _, b in pairs])
+    scores = (left_sigs == right_sigs).mean(axis=1)
+
+    # Union-find over matching pairs
+    parent = {}
+
+    def find(node: int) -> int:
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    matches = [(a, b, float(score)) for (a, b), score in zip(pairs, scores) if score >= threshold]
+    for a, b, _ in matches:
+        parent[find(a)] = find(b)
+
+    groups: dict[int, dict] = {}
+    for a, b, score in matches:
+        group = groups.setdefault(find(a), {"file_ids": set(), "pairs": []})
+        group["file_ids"].update((a, b))
+        group["pairs"].append({"file_ids": [a, b], "similarity": round(score, 3)})
+
+    return sorted(
+        ({"file_ids": sorted(group["file_ids"]), "pairs": group["pairs"]} for group in groups.values()),
+        key=lambda group: len(group["file_ids"]),
+        reverse=True,
+    )
@@ -0,0 +1,276 @@
+"""Pluggable blob storage for uploaded files.
+
+Blobs are addressed by a relative key (stored in File.file_path). Backends:
+- local: flat `<dataroom_id>/<name>` layout under UPLOAD_FOLDER (legacy)
+- sharded: hash fan-out `<ab>/<cd>/<name>` under UPLOAD_FOLDER, so no
+  directory grows beyond a few hundred entries
+- s3: any S3-compatible object store (AWS, MinIO, ...)
+
+Both local backends read any relative key, so existing files keep working
+after switching layouts; `flask storage-migrate` rewrites them in batches.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+from flask import Flask, Response, current_app, send_file, stream_with_context
+
+FSYNC_POLICIES = ("none", "file", "full")
+CHUNK_SIZE = 1024 * 1024
+
+
+class StorageBackend:
+    """Base class for blob storage backends."""
+
+    def make_key(self, dataroom_id: int, filename: str) -> str:
+        """Build the storage key for a new blob."""
+        raise NotImplementedError
+
+    def staging_dir(self) -> Path:
+        """Get a local directory for incoming files before they are stored."""
+        raise NotImplementedError
+
+    def put_file(self, src_path: Path, key: str) -> None:
+        """Store a local file under `key`, consuming the source file."""
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        """Open a blob for reading."""
+        raise NotImplementedError
+
+    def local_path(self, key: str):
+        """Context manager yielding a local filesystem path for a blob (e.g. for PDF parsers)."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, key: str) -> int:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Delete a blob; missing blobs are ignored."""
+        raise NotImplementedError
+
+    def send(self, key: str, mimetype: str, as_attachment: bool = False,
+             download_name: Optional[str] = None, max_age: Optional[int] = None) -> Response:
+        """Build a response that sends the blob to the client."""
+        raise NotImplementedError
+
+    def save(self, stream: BinaryIO, key: str) -> int:
+        """Store the contents of a stream under `key` and return its size."""
+        fd, tmp_name = tempfile.mkstemp(dir=self.staging_dir())
+        with os.fdopen(fd, "wb") as tmp:
+            shutil.copyfileobj(stream, tmp, CHUNK_SIZE)
+            size = tmp.tell()
+        self.put_file(Path(tmp_name), key)
+        return size
+
+
+class LocalStorage(StorageBackend):
+    """Blobs stored on the local filesystem under a root directory."""
+
+    def __init__(self, root: Path, shard_depth: int = 0, fsync: str = "file"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.root = Path(root)
+        self.shard_depth = shard_depth
+        self.fsync = fsync
+
+    def make_key(self, dataroom_id: int, filename: str) -> str:
+        if not self.shard_depth:
+            return f"{dataroom_id}/{filename}"
+        digest = hashlib.sha1(filename.encode()).hexdigest()
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return "/".join([*shards, filename])
+
+    def path(self, key: str) -> Path:
+        """Get the absolute path of a blob."""
+        return self.root / key
+
+    def staging_dir(self) -> Path:
+        # Same filesystem as the blobs, so storing is a rename
+        staging = self.root / ".staging"
+        staging.mkdir(parents=True, exist_ok=True)
+        return staging
+
+    def put_file(self, src_path: Path, key: str) -> None:
+        dest = self.path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.fsync != "none":
+            with open(src_path, "rb") as fp:
+                os.fsync(fp.fileno())
+
+        try:
+            # Atomic: readers see either no blob or the complete blob
+            os.replace(src_path, dest)
+        except OSError:
+            # Source on another filesystem: copy next to the target, then rename
+            tmp_path = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}.tmp")
+            shutil.copyfile(src_path, tmp_path)
+            if self.fsync != "none":
+                with open(tmp_path, "rb") as fp:
+                    os.fsync(fp.fileno())
+            os.replace(tmp_path, dest)
+            os.unlink(src_path)
+
+        if self.fsync == "full":
+            # Persist the directory entry created by the rename
+            dir_fd = os.open(dest.parent, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    @contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        yield str(self.path(key))
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).exists()
+
+    def size(self, key: str) -> int:
+        return self.path(key).stat().st_size
+
+    def delete(self, key: str) -> None:
+        self.path(key).unlink(missing_ok=True)
+
+    def send(self, key: str, mimetype: str, as_attachment: bool = False,
+             download_name: Optional[str] = None, max_age: Optional[int] = None) -> Response:
+        return send_file(
+            str(self.path(key)),
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            max_age=max_age,
+            conditional=True,
+        )
+
+
+class S3Storage(StorageBackend):
+    """Blobs stored in an S3-compatible object store (requires boto3)."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, access_key: Optional[str] = None,
+                 secret_key: Optional[str] = None, staging_root: Optional[Path] = None):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("The s3 storage backend requires boto3") from e
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.staging_root = Path(staging_root or tempfile.gettempdir()) / "dataroom-staging"
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key or None,
+            aws_secret_access_key=secret_key or None,
+        )
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def make_key(self, dataroom_id: int, filename: str) -> str:
+        # Object stores have no directory limits; keep keys grouped per dataroom
+        return f"{dataroom_id}/{filename}"
+
+    def staging_dir(self) -> Path:
+        self.staging_root.mkdir(parents=True, exist_ok=True)
+        return self.staging_root
+
+    def put_file(self, src_path: Path, key: str) -> None:
+        # Objects become visible only once the (multipart) upload completes
+        self.client.upload_file(str(src_path), self.bucket, self._object_key(key))
+        os.unlink(src_path)
+
+    def open(self, key: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))["Body"]
+
+    @contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        fd, tmp_name = tempfile.mkstemp(dir=self.staging_dir(), suffix=Path(key).suffix)
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), tmp_name)
+            yield tmp_name
+        finally:
+            os.unlink(tmp_name)
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError:
+            return False
+        return True
+
+    def size(self, key: str) -> int:
+        return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))["ContentLength"]
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def send(self, key: str, mimetype: str, as_attachment: bool = False,
+             download_name: Optional[str] = None, max_age: Optional[int] = None) -> Response:
+        obj = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        body = obj["Body"]
+
+        def generate():
+            try:
+                yield from body.iter_chunks(CHUNK_SIZE)
+            finally:
+                body.close()
+
+        response = Response(stream_with_context(generate()), mimetype=mimetype, direct_passthrough=True)
+        response.content_length = obj["ContentLength"]
+        if download_name:
+            disposition = "attachment" if as_attachment else "inline"
+            response.headers.set("Content-Disposition", disposition, filename=download_name)
+        if max_age is not None:
+            response.cache_control.max_age = max_age
+        return response
+
+
+def create_storage(config) -> StorageBackend:
+    """Create the storage backend selected by STORAGE_BACKEND."""
+    backend = config["STORAGE_BACKEND"]
+    if backend == "local":
+        return LocalStorage(config["UPLOAD_FOLDER"], fsync=config["STORAGE_FSYNC"])
+    if backend == "sharded":
+        return LocalStorage(
+            config["UPLOAD_FOLDER"],
+            shard_depth=config["STORAGE_SHARD_DEPTH"],
+            fsync=config["STORAGE_FSYNC"],
+        )
+    if backend == "s3":
+        return S3Storage(
+            bucket=config["S3_BUCKET"],
+            prefix=config["S3_PREFIX"],
+            endpoint_url=config["S3_ENDPOINT_URL"],
+            region=config["S3_REGION"],
+            access_key=config["S3_ACCESS_KEY_ID"],
+            secret_key=config["S3_SECRET_ACCESS_KEY"],
+        )
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def init_storage(app: Flask) -> None:
+    """Create the configured storage backend for an application."""
+    app.extensions["storage"] = create_storage(app.config)
+
+
+def get_storage() -> StorageBackend:
+    """Get the storage backend of the current application."""
+    return current_app.extensions["storage"]
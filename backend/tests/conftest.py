@@ -0,0 +1,122 @@
+"""Shared fixtures: applications on temporary SQLite databases."""
+
+import io
+
+import pytest
+
+from config import Config
+from auth_utils import create_jwt_token
+
+TEST_SETTINGS = {
+    "TESTING": True,
+    "SECRET_KEY": "test-secret-key-of-at-least-32-bytes",
+    "SQLALCHEMY_ECHO": False,
+    "PDF_EXTRACT_WORKERS": 1,
+    "BACKGROUND_WORKERS": 1,
+    "CHANGE_FEED_SAFETY_LAG": 0,
+}
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """Factory for applications with config overrides, migrated on creation."""
+    apps = []
+
+    def make(**settings):
+        settings = {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'primary.db'}",
+            "UPLOAD_FOLDER": tmp_path / "uploads",
+            **TEST_SETTINGS,
+            **settings,
+        }
+        for key, value in settings.items():
+            monkeypatch.setattr(Config, key, value, raising=False)
+        from app import create_app
+        app = create_app()
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        app.extensions["audit_log"].shutdown()
+        if "extraction_engine" in app.extensions:
+            app.extensions["extraction_engine"].close()
+        with app.app_context():
+            from models import db
+            db.session.remove()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_pdf(pages: list[str]) -> bytes:
+    """Build a minimal PDF with one line of text per page."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>",
+    ]
+    font = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 712 Td ({text}) Tj ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return data
+
+
+def create_user(app, email: str = "owner@example.com") -> tuple[int, dict]:
+    """Create a user; returns their id and request headers authenticating as them."""
+    from models import db, User
+
+    with app.app_context():
+        user = User(email=email, name=email.split("@")[0], oauth_provider="google", oauth_id=email)
+        db.session.add(user)
+        db.session.commit()
+        return user.id, {"Authorization": f"Bearer {create_jwt_token(user.id)}"}
+
+
+@pytest.fixture
+def make_user(app):
+    """Create users of the default application, see create_user."""
+    return lambda email="owner@example.com": create_user(app, email)
+
+
+@pytest.fixture
+def auth(make_user):
+    """Headers of a fresh user."""
+    return make_user()[1]
+
+
+@pytest.fixture
+def upload(client, monkeypatch):
+    """Upload a PDF of the given page texts; previews are not rendered. Returns the response."""
+    monkeypatch.setattr("routes.files.run_in_background", lambda func, *args: None)
+
+    def upload(headers: dict, dataroom_id: int, pages: list[str], name: str = "deck.pdf", folder_id: int = None):
+        data = {"dataroom_id": dataroom_id, "file": (io.BytesIO(make_pdf(pages)), name)}
+        if folder_id:
+            data["folder_id"] = folder_id
+        return client.post("/api/files", data=data, headers=headers)
+
+    return upload
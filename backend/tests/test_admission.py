@@ -0,0 +1,164 @@
+"""Admission control: per-user rate and concurrency limits, global caps."""
+
+import threading
+
+import pytest
+
+from tests.conftest import create_user
+
+
+UNLIMITED = {"rate": 0, "burst": 0, "user_concurrency": 0, "concurrency": 0}
+
+
+def limits(**structure) -> dict:
+    """ADMISSION_LIMITS with only structure listings limited, as given."""
+    return {"search": UNLIMITED, "upload": UNLIMITED, "structure": {**UNLIMITED, **structure}}
+
+
+@pytest.fixture
+def admitted(make_app):
+    """Build an application with the given structure limits; returns (app, dataroom id, owner headers)."""
+    def admitted(**structure):
+        app = make_app(ADMISSION_LIMITS=limits(**structure), ADMISSION_QUEUE_TIMEOUT=0.1)
+        _, headers = create_user(app)
+        client = app.test_client()
+        dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=headers).get_json()["dataroom"]["id"]
+        return app, dataroom, headers
+    return admitted
+
+
+def structure(client, dataroom: int, headers: dict, name: str = ""):
+    # Distinct query strings keep responses out of the response cache
+    return client.get(f"/api/datarooms/{dataroom}/structure", query_string={"n": name}, headers=headers)
+
+
+def test_rate_limit_rejects_with_retry_after(admitted):
+    app, dataroom, headers = admitted(rate=0.01, burst=2)
+    client = app.test_client()
+
+    assert [structure(client, dataroom, headers, str(i)).status_code for i in range(2)] == [200, 200]
+    response = structure(client, dataroom, headers, "2")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    # Buckets are per user
+    _, other = create_user(app, "other@example.com")
+    other_dataroom = client.post("/api/datarooms", json={"name": "Other"}, headers=other).get_json()["dataroom"]["id"]
+    assert structure(client, other_dataroom, other).status_code == 200
+
+
+def test_user_concurrency_holds_slots_until_streams_close(admitted):
+    app, dataroom, headers = admitted(user_concurrency=1)
+    client = app.test_client()
+
+    streaming = structure(client, dataroom, headers, "first")
+    assert streaming.status_code == 200
+    response = structure(client, dataroom, headers, "second")
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+    streaming.close()
+    assert structure(client, dataroom, headers, "third").status_code == 200
+
+
+def test_global_concurrency_queues_then_rejects(admitted):
+    app, dataroom, headers = admitted(concurrency=1)
+    client = app.test_client()
+    _, other = create_user(app, "other@example.com")
+    other_dataroom = client.post("/api/datarooms", json={"name": "Other"}, headers=other).get_json()["dataroom"]["id"]
+
+    streaming = structure(client, dataroom, headers)
+    assert structure(client, other_dataroom, other).status_code == 503
+    streaming.close()
+
+    metrics = client.get("/health/admission").get_json()["endpoints"]["structure"]
+    assert (metrics["admitted"], metrics["queued"], metrics["rejected_busy"]) == (1, 1, 1)
+
+
+class SlowSearches:
+    """Content searches for "slow ..." block inside the view until released, holding their slots."""
+
+    def __init__(self, app, monkeypatch):
+        import routes.search
+
+        self.app = app
+        self.entered = threading.Semaphore(0)
+        self.gate = threading.Event()
+        self.threads = []
+        self.statuses = []
+        match_condition = routes.search.match_condition
+
+        def blocking_match_condition(query, substring=False):
+            if query.startswith("slow") and not substring:
+                self.entered.release()
+                self.gate.wait(10)
+            return match_condition(query, substring)
+
+        monkeypatch.setattr(routes.search, "match_condition", blocking_match_condition)
+
+    def start(self, headers: dict, q: str, wait_admitted: bool = True) -> None:
+        """Send a search from another thread; by default wait until it is inside the view."""
+        def run():
+            response = self.app.test_client().get("/api/search", query_string={"q": q}, headers=headers)
+            self.statuses.append(response.status_code)
+            response.close()  # Results are streamed: the slots are held until the body is closed
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        if wait_admitted:
+            assert self.entered.acquire(timeout=10)
+
+    def finish(self) -> list[int]:
+        """Release the blocked searches; returns the statuses of every search started."""
+        self.gate.set()
+        for thread in self.threads:
+            thread.join(10)
+        return sorted(self.statuses)
+
+
+def test_user_concurrency_rejects_requests_beyond_the_users_slots(make_app, monkeypatch):
+    app = make_app(ADMISSION_LIMITS={**limits(), "search": {**UNLIMITED, "user_concurrency": 2}})
+    _, headers = create_user(app)
+    _, other = create_user(app, "other@example.com")
+    slow = SlowSearches(app, monkeypatch)
+    client = app.test_client()
+
+    slow.start(headers, "slow one")
+    slow.start(headers, "slow two")
+    response = client.get("/api/search", query_string={"q": "fast"}, headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # Slots are per user
+    assert client.get("/api/search", query_string={"q": "fast"}, headers=other).status_code == 200
+
+    assert slow.finish() == [200, 200]
+    assert client.get("/api/search", query_string={"q": "after"}, headers=headers).status_code == 200
+    metrics = client.get("/health/admission").get_json()["endpoints"]["search"]
+    assert (metrics["admitted"], metrics["rejected_user"]) == (4, 1)
+
+
+def test_global_concurrency_queues_under_load_then_rejects(make_app, monkeypatch):
+    app = make_app(
+        ADMISSION_LIMITS={**limits(), "search": {**UNLIMITED, "concurrency": 2}}, ADMISSION_QUEUE_TIMEOUT=1,
+    )
+    users = [create_user(app, f"user{i}@example.com")[1] for i in range(4)]
+    slow = SlowSearches(app, monkeypatch)
+    client = app.test_client()
+
+    slow.start(users[0], "slow one")
+    slow.start(users[1], "slow two")
+    # Both slots are busy: a request waits ADMISSION_QUEUE_TIMEOUT, then gets 503
+    response = client.get("/api/search", query_string={"q": "fast"}, headers=users[2])
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+    # A queued request is admitted as soon as a slot frees up
+    slow.start(users[3], "slow three", wait_admitted=False)
+    assert not slow.entered.acquire(timeout=0.2)
+    slow.gate.set()
+    assert slow.finish() == [200, 200, 200]
+
+    metrics = client.get("/health/admission").get_json()["endpoints"]["search"]
+    assert (metrics["admitted"], metrics["queued"], metrics["rejected_busy"]) == (3, 2, 1)
+    assert metrics["in_flight"] == 0
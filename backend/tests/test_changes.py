@@ -0,0 +1,115 @@
+"""Change feed: cursors, paging and what members of single folders are sent."""
+
+from datetime import timedelta
+
+import pytest
+
+from models import db, get_utc_now, ChangeEvent
+from tests.conftest import create_user
+
+
+@pytest.fixture
+def shared(app, client, auth):
+    """A dataroom with folders /Legal/Contracts and /Finance, and a member of /Legal only.
+
+    Returns (dataroom id, folder ids by path, member headers).
+    """
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    folders = {}
+    for path in ("/Legal", "/Legal/Contracts", "/Finance"):
+        parent, name = path.rsplit("/", 1)
+        response = client.post(
+            "/api/folders", json={"name": name, "dataroom_id": dataroom, "parent_id": folders.get(parent)}, headers=auth,
+        )
+        folders[path] = response.get_json()["folder"]["id"]
+    _, member = create_user(app, "member@example.com")
+    response = client.post(
+        f"/api/datarooms/{dataroom}/members",
+        json={"email": "member@example.com", "role": "viewer", "folder_id": folders["/Legal"]},
+        headers=auth,
+    )
+    assert response.status_code == 201
+    return dataroom, folders, member
+
+
+def changes(client, dataroom: int, headers: dict, since: int = 0, **params) -> dict:
+    response = client.get(f"/api/datarooms/{dataroom}/changes", query_string={"since": since, **params}, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_owner_pages_through_all_changes(client, auth, shared):
+    dataroom, _, _ = shared
+    first = changes(client, dataroom, auth, limit=2)
+    assert [change["entity_type"] for change in first["changes"]] == ["folder", "folder"]
+    assert first["has_more"]
+
+    rest = changes(client, dataroom, auth, since=first["cursor"])
+    assert [(change["entity_type"], change["action"]) for change in rest["changes"]] == [
+        ("folder", "created"), ("member", "created"),
+    ]
+    assert not rest["has_more"]
+    assert changes(client, dataroom, auth, since=rest["cursor"])["changes"] == []
+
+
+def test_folder_member_gets_changes_in_their_subtree(client, auth, shared):
+    dataroom, folders, member = shared
+    feed = changes(client, dataroom, member)["changes"]
+    assert [change["data"]["path"] for change in feed] == ["/Legal", "/Legal/Contracts", "/Legal"]
+    assert feed[-1]["data"] == {"id": feed[-1]["entity_id"], "role": "viewer", "path": "/Legal"}  # No email
+
+    cursor = changes(client, dataroom, member)["cursor"]
+    client.put(f"/api/folders/{folders['/Finance']}", json={"name": "Tax"}, headers=auth)
+    client.put(f"/api/folders/{folders['/Legal/Contracts']}", json={"name": "Signed"}, headers=auth)
+    new = changes(client, dataroom, member, since=cursor)["changes"]
+    assert [(change["data"]["previous_path"], change["data"]["path"]) for change in new] == [
+        ("/Legal/Contracts", "/Legal/Signed"),
+    ]
+
+
+def test_folder_member_sees_renames_above_their_grant(client, auth, app, shared):
+    dataroom, folders, _ = shared
+    _, member = create_user(app, "contracts@example.com")
+    client.post(
+        f"/api/datarooms/{dataroom}/members",
+        json={"email": "contracts@example.com", "role": "viewer", "folder_id": folders["/Legal/Contracts"]},
+        headers=auth,
+    )
+    cursor = changes(client, dataroom, member)["cursor"]
+
+    client.put(f"/api/folders/{folders['/Legal']}", json={"name": "Law"}, headers=auth)
+    [renamed] = changes(client, dataroom, member, since=cursor)["changes"]
+    assert renamed["data"]["previous_path"] == "/Legal"
+
+
+def test_changes_require_access(client, app, shared):
+    dataroom, _, _ = shared
+    _, stranger = create_user(app, "stranger@example.com")
+    response = client.get(f"/api/datarooms/{dataroom}/changes", query_string={"since": 0}, headers=stranger)
+    assert response.status_code == 403
+
+
+def test_limit_is_clamped(client, auth, shared):
+    dataroom, _, _ = shared
+    for limit in (0, -5):
+        feed = changes(client, dataroom, auth, limit=limit)
+        assert len(feed["changes"]) == 1
+        assert feed["has_more"]
+
+
+def test_recent_changes_are_held_back(app, client, auth, shared):
+    dataroom, _, _ = shared
+    app.config["CHANGE_FEED_SAFETY_LAG"] = 60
+    older = changes(client, dataroom, auth)
+    assert older["changes"] == [] and older["cursor"] == 0  # Everything is still recent
+    assert client.get(f"/api/datarooms/{dataroom}/changes", headers=auth).get_json()["cursor"] == 0
+
+    # Settled once older than the lag, even if a later event is not
+    with app.app_context():
+        db.session.execute(
+            db.update(ChangeEvent).where(ChangeEvent.id <= 2).values(created_at=get_utc_now() - timedelta(minutes=5))
+        )
+        db.session.commit()
+    settled = changes(client, dataroom, auth)
+    assert [change["cursor"] for change in settled["changes"]] == [1, 2]
+    assert settled["cursor"] == 2
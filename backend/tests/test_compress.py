@@ -0,0 +1,97 @@
+"""Response compression negotiation and the compressed response cache."""
+
+import gzip
+
+import pytest
+
+from models import db, Permission
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(COMPRESSION_MIN_SIZE=0, COMPRESSION_ENCODINGS="gzip", ADMISSION_ENABLED=False)
+
+
+@pytest.fixture
+def dataroom(client, auth):
+    response = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth)
+    return response.get_json()["dataroom"]["id"]
+
+
+def test_compresses_accepted_encoding(client, auth, dataroom):
+    response = client.get("/api/datarooms", headers={**auth, "Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert b'"Deal"' in gzip.decompress(response.data)
+
+
+def test_uncompressed_without_accepted_encoding(client, auth, dataroom):
+    for accept in (None, "br", "gzip;q=0"):
+        headers = {**auth, "Accept-Encoding": accept} if accept else auth
+        response = client.get("/api/datarooms", headers=headers)
+
+        assert "Content-Encoding" not in response.headers
+        assert response.get_json()["datarooms"][0]["name"] == "Deal"
+
+
+def test_cached_until_dataroom_changes(app, client, auth, dataroom):
+    headers = {**auth, "Accept-Encoding": "gzip"}
+    url = f"/api/datarooms/{dataroom}/structure"
+    cache = app.extensions["response_cache"]
+
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200
+    first.get_data()  # Streamed bodies are stored once fully sent
+    assert len(cache._entries) == 1
+    assert client.get(url, headers=headers).data == first.data
+    assert len(cache._entries) == 1
+
+    client.post("/api/folders", json={"name": "Legal", "dataroom_id": dataroom}, headers=auth)
+    assert b'"Legal"' in gzip.decompress(client.get(url, headers=headers).data)
+    assert len(cache._entries) == 2
+
+
+def test_cache_hit_requires_unchanged_permissions(app, client, auth, dataroom):
+    headers = {**auth, "Accept-Encoding": "gzip"}
+    url = f"/api/datarooms/{dataroom}/structure"
+    assert client.get(url, headers=headers).get_data()
+
+    # Access lost without a change event in the dataroom
+    with app.app_context():
+        db.session.execute(db.delete(Permission).where(Permission.dataroom_id == dataroom))
+        db.session.commit()
+
+    assert client.get(url, headers=headers).status_code == 403
+
+
+def test_streamed_responses_are_compressed_as_they_are_read(make_app):
+    from flask import Response
+    from compress import compress_response
+
+    app = make_app(COMPRESSION_MIN_SIZE=1024, COMPRESSION_ENCODINGS="gzip")
+    produced = []
+
+    def chunks():
+        for i in range(20):
+            produced.append(i)
+            yield b"x" * 100
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = compress_response(Response(chunks(), mimetype="application/json"))
+        # A short first chunk only needs a look at the next one to know the stream goes on
+        assert produced == [0, 1]
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(b"".join(response.response)) == b"x" * 2000
+        assert produced == list(range(20))
+
+
+def test_short_streamed_responses_are_sent_uncompressed(make_app):
+    from flask import Response
+    from compress import compress_response
+
+    app = make_app(COMPRESSION_MIN_SIZE=1024, COMPRESSION_ENCODINGS="gzip")
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = compress_response(Response(iter([b"x" * 100]), mimetype="application/json"))
+        assert "Content-Encoding" not in response.headers
+        assert response.get_data() == b"x" * 100
@@ -0,0 +1,86 @@
+"""Extraction engine worker pools and the reindex command."""
+
+import io
+import multiprocessing
+import time
+
+import pytest
+
+from extraction import ExtractionEngine
+from tests.conftest import make_pdf
+
+
+@pytest.fixture
+def engine():
+    with ExtractionEngine(workers=2, pages_per_worker=2, timeout=30) as engine:
+        yield engine
+
+
+def write_pdf(tmp_path, name: str, pages: list[str]) -> str:
+    path = tmp_path / name
+    path.write_bytes(make_pdf(pages))
+    return str(path)
+
+
+def test_documents_share_one_pool(engine, tmp_path):
+    small = engine.extract(write_pdf(tmp_path, "small.pdf", ["alpha"]))
+    pool = engine._pool
+    large = engine.extract(write_pdf(tmp_path, "large.pdf", [f"page {i}" for i in range(5)]))
+
+    assert small.pages == ["alpha"]
+    assert large.pages == [f"page {i}" for i in range(5)]  # Probe plus two ranges
+    assert engine._pool is pool
+
+
+def test_timeout_retires_the_pool(engine, tmp_path):
+    engine.timeout = 0.5
+    with pytest.raises(multiprocessing.TimeoutError):
+        engine.run(time.sleep, 5)
+    assert engine._pool is None
+    assert not engine._users  # The stuck worker was terminated with its pool
+
+    engine.timeout = 30
+    assert engine.extract(write_pdf(tmp_path, "after.pdf", ["still works"])).pages == ["still works"]
+
+
+def test_reindex_removes_checkpoint_when_complete(app, client, auth, tmp_path):
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    response = client.post(
+        "/api/files",
+        data={"file": (io.BytesIO(make_pdf(["Purchase agreement", "Closing"])), "deal.pdf"), "dataroom_id": dataroom},
+        content_type="multipart/form-data",
+        headers=auth,
+    )
+    assert response.status_code == 201
+    file_id = response.get_json()["file"]["id"]
+
+    checkpoint = tmp_path / "checkpoint"
+    result = app.test_cli_runner().invoke(args=["reindex", "--all", "--checkpoint", str(checkpoint)])
+
+    assert result.exit_code == 0, result.output
+    assert "Processed 1 files (0 failed" in result.output
+    assert not checkpoint.exists()
+    pages = client.get(f"/api/files/{file_id}/pages", headers=auth).get_json()["pages"]
+    assert [page["content_text"] for page in pages] == ["Purchase agreement", "Closing"]
+
+
+def test_reindex_records_updates_for_listings(app, client, auth, upload, tmp_path):
+    from models import db, File
+
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    file_id = upload(auth, dataroom, ["one", "two"]).get_json()["file"]["id"]
+    with app.app_context():
+        db.session.get(File, file_id).page_count = None  # As stored before page counts existed
+        db.session.commit()
+    cursor = client.get(f"/api/datarooms/{dataroom}/changes", headers=auth).get_json()["cursor"]
+    structure = client.get(f"/api/datarooms/{dataroom}/structure", headers=auth).get_json()
+    assert structure["root_files"][0]["page_count"] is None
+
+    result = app.test_cli_runner().invoke(args=["reindex", "--all", "--checkpoint", str(tmp_path / "checkpoint")])
+    assert result.exit_code == 0, result.output
+
+    feed = client.get(f"/api/datarooms/{dataroom}/changes", query_string={"since": cursor}, headers=auth).get_json()
+    assert [(change["entity_id"], change["action"]) for change in feed["changes"]] == [(file_id, "updated")]
+    # The cached listing is keyed on the change cursor, so it is rebuilt
+    structure = client.get(f"/api/datarooms/{dataroom}/structure", headers=auth).get_json()
+    assert structure["root_files"][0]["page_count"] == 2
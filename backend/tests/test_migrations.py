@@ -0,0 +1,80 @@
+"""Schema migrations of new and existing databases."""
+
+from sqlalchemy import create_engine, inspect, text
+
+from auth_utils import create_jwt_token
+
+# The four tables created by db.create_all() before migrations existed
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL, email VARCHAR(255) NOT NULL, name VARCHAR(255),
+        oauth_provider VARCHAR(50) NOT NULL, oauth_id VARCHAR(255) NOT NULL, avatar_url VARCHAR(500),
+        created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL,
+        PRIMARY KEY (id), CONSTRAINT unique_oauth_user UNIQUE (oauth_provider, oauth_id))""",
+    "CREATE UNIQUE INDEX ix_users_email ON users (email)",
+    """CREATE TABLE datarooms (
+        id INTEGER NOT NULL, name VARCHAR(255) NOT NULL, description TEXT, owner_id INTEGER NOT NULL,
+        created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL,
+        PRIMARY KEY (id), FOREIGN KEY(owner_id) REFERENCES users (id))""",
+    "CREATE INDEX ix_datarooms_owner_id ON datarooms (owner_id)",
+    """CREATE TABLE folders (
+        id INTEGER NOT NULL, name VARCHAR(255) NOT NULL, parent_id INTEGER, dataroom_id INTEGER NOT NULL,
+        path VARCHAR(1000) NOT NULL, created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL,
+        PRIMARY KEY (id), CONSTRAINT unique_folder_per_parent UNIQUE (dataroom_id, parent_id, name),
+        FOREIGN KEY(parent_id) REFERENCES folders (id), FOREIGN KEY(dataroom_id) REFERENCES datarooms (id))""",
+    "CREATE INDEX ix_folders_dataroom_id ON folders (dataroom_id)",
+    "CREATE INDEX ix_folders_path ON folders (path)",
+    "CREATE INDEX ix_folders_parent_id ON folders (parent_id)",
+    """CREATE TABLE files (
+        id INTEGER NOT NULL, name VARCHAR(255) NOT NULL, original_name VARCHAR(255) NOT NULL,
+        folder_id INTEGER, dataroom_id INTEGER NOT NULL, file_path VARCHAR(500) NOT NULL,
+        file_size BIGINT NOT NULL, mime_type VARCHAR(100) NOT NULL, content_text TEXT,
+        created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL,
+        PRIMARY KEY (id), FOREIGN KEY(folder_id) REFERENCES folders (id),
+        FOREIGN KEY(dataroom_id) REFERENCES datarooms (id))""",
+    "CREATE INDEX ix_files_dataroom_id ON files (dataroom_id)",
+    "CREATE INDEX ix_files_folder_id ON files (folder_id)",
+]
+
+
+def schema_diff(app) -> list:
+    """Differences between the application's database and its models."""
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from models import db
+
+    with app.app_context(), db.engine.connect() as connection:
+        return compare_metadata(MigrationContext.configure(connection), db.metadata)
+
+
+def test_new_databases_match_the_models(app):
+    assert schema_diff(app) == []
+
+
+def test_unversioned_databases_are_upgraded(make_app, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text(
+            "INSERT INTO users VALUES (1, 'old@example.com', 'old', 'google', 'old', NULL, '2024-01-01', '2024-01-01')"
+        ))
+        connection.execute(text("INSERT INTO datarooms VALUES (1, 'Old', NULL, 1, '2024-01-01', '2024-01-01')"))
+        connection.execute(text(
+            "INSERT INTO files VALUES (1, 'a.pdf', 'a.pdf', NULL, 1, '1/a.pdf', 123, 'application/pdf', "
+            "'merger terms', '2024-01-01', '2024-01-01')"
+        ))
+    engine.dispose()
+
+    app = make_app()
+    assert schema_diff(app) == []
+    with app.app_context():
+        from models import db
+        assert inspect(db.engine).has_table("alembic_version")
+        assert db.session.execute(text("SELECT storage_used FROM users")).scalar() == 123
+        headers = {"Authorization": f"Bearer {create_jwt_token(1)}"}
+
+    # The owner keeps access to their dataroom
+    response = app.test_client().get("/api/datarooms/1", headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["dataroom"]["role"] == "owner"
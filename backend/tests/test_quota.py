@@ -0,0 +1,184 @@
+"""Storage quota reservations and usage accounting."""
+
+import io
+
+from tests.conftest import make_pdf
+
+
+class TrackedStream(io.BytesIO):
+    """A request body that records whether it was read."""
+
+    read_bytes = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.read_bytes += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = super().readline(size)
+        self.read_bytes += len(data)
+        return data
+
+
+def usage(app, user_id: int) -> int:
+    from models import db, User
+
+    with app.app_context():
+        return db.session.get(User, user_id).storage_used
+
+
+def set_quota(app, user_id: int, quota: int) -> None:
+    from models import db, User
+
+    with app.app_context():
+        db.session.get(User, user_id).storage_quota = quota
+        db.session.commit()
+
+
+def create_dataroom(client, headers: dict) -> int:
+    return client.post("/api/datarooms", json={"name": "Deal"}, headers=headers).get_json()["dataroom"]["id"]
+
+
+def test_usage_is_trued_up_to_stored_sizes_and_released_on_delete(app, client, make_user, upload):
+    user_id, headers = make_user()
+    dataroom = create_dataroom(client, headers)
+    first = upload(headers, dataroom, ["one"]).get_json()["file"]
+    folder = client.post("/api/folders", json={"name": "Legal", "dataroom_id": dataroom}, headers=headers).get_json()
+    second = upload(headers, dataroom, ["two", "three"], folder_id=folder["folder"]["id"]).get_json()["file"]
+    third = upload(headers, create_dataroom(client, headers), ["four"]).get_json()["file"]
+
+    # Reservations cover the whole request; only the stored bytes stay charged
+    assert usage(app, user_id) == first["file_size"] + second["file_size"] + third["file_size"]
+
+    client.delete(f"/api/files/{first['id']}", headers=headers)
+    assert usage(app, user_id) == second["file_size"] + third["file_size"]
+    client.delete(f"/api/folders/{folder['folder']['id']}", headers=headers)
+    assert usage(app, user_id) == third["file_size"]
+    client.delete(f"/api/datarooms/{third['dataroom_id']}", headers=headers)
+    assert usage(app, user_id) == 0
+
+
+def test_upload_over_quota_is_rejected_before_the_body_is_read(app, client, make_user, tmp_path):
+    user_id, headers = make_user()
+    dataroom = create_dataroom(client, headers)
+    set_quota(app, user_id, 1000)
+
+    boundary = "quota-test"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"dataroom_id\"\r\n\r\n{dataroom}\r\n"
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.pdf\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode() + make_pdf(["page"] * 40) + f"\r\n--{boundary}--\r\n".encode()
+    assert len(body) > 1000
+    stream = TrackedStream(body)
+
+    response = client.post(
+        "/api/files", input_stream=stream, content_length=len(body),
+        content_type=f"multipart/form-data; boundary={boundary}", headers=headers,
+    )
+
+    assert response.status_code == 413
+    assert stream.read_bytes == 0
+    assert not any(path.is_file() for path in (tmp_path / "uploads").rglob("*"))
+    assert usage(app, user_id) == 0
+
+
+def test_quota_counts_every_dataroom_of_the_user(app, client, make_user, upload):
+    user_id, headers = make_user()
+    first = upload(headers, create_dataroom(client, headers), ["one"]).get_json()["file"]
+    # Room for one more file of that size, but not for the whole second request
+    set_quota(app, user_id, first["file_size"] * 2)
+
+    assert upload(headers, create_dataroom(client, headers), ["one"]).status_code == 413
+    assert usage(app, user_id) == first["file_size"]
+
+    set_quota(app, user_id, 0)  # Unlimited
+    assert upload(headers, create_dataroom(client, headers), ["one"]).status_code == 201
+
+
+def test_reservations_never_overshoot_the_quota(app, make_user):
+    from models import db
+    from quota import reserve_storage
+
+    user_id, _ = make_user()
+    set_quota(app, user_id, 100)
+    with app.app_context():
+        assert reserve_storage(user_id, 60)
+        assert not reserve_storage(user_id, 60)  # Would reach 120
+        assert reserve_storage(user_id, 40)
+        db.session.commit()
+
+    assert usage(app, user_id) == 100
+
+
+def test_reconcile_repairs_drift(app, client, make_user, upload):
+    from quota import charge_storage
+    from models import db
+
+    user_id, headers = make_user()
+    file = upload(headers, create_dataroom(client, headers), ["one"]).get_json()["file"]
+    with app.app_context():
+        charge_storage(user_id, 12345)  # A reservation lost to a crashed worker
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["quota-reconcile"])
+    assert result.exit_code == 0, result.output
+    assert usage(app, user_id) == file["file_size"]
+
+
+def test_uploads_to_shared_datarooms_count_toward_the_owner(app, client, make_user, upload):
+    owner_id, owner = make_user()
+    editor_id, editor = make_user("editor@example.com")
+    dataroom = create_dataroom(client, owner)
+    client.post(
+        f"/api/datarooms/{dataroom}/members", json={"email": "editor@example.com", "role": "editor"}, headers=owner,
+    )
+
+    file = upload(editor, dataroom, ["one"]).get_json()["file"]
+    assert usage(app, owner_id) == file["file_size"]
+    assert usage(app, editor_id) == 0
+
+    # The owner's quota applies, not the editor's
+    set_quota(app, owner_id, file["file_size"])
+    assert upload(editor, dataroom, ["one"]).status_code == 413
+    assert usage(app, editor_id) == 0
+
+
+def test_import_over_quota_is_rejected_before_the_archive_is_read(app, client, make_user, tmp_path, monkeypatch):
+    import zipfile
+    from importer import run_import
+
+    monkeypatch.setattr("routes.datarooms.run_in_background", lambda func, *args: None)
+    user_id, headers = make_user()
+    dataroom = create_dataroom(client, headers)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("Legal/nda.pdf", make_pdf(["one"]))
+        zf.writestr("deck.pdf", make_pdf(["two", "three"]))
+    body = archive.getvalue()
+
+    def post(stream):
+        return client.post(
+            f"/api/datarooms/{dataroom}/imports", query_string={"name": "deal.zip"}, input_stream=stream,
+            content_length=len(body), content_type="application/zip", headers=headers,
+        )
+
+    set_quota(app, user_id, len(body) - 1)
+    stream = TrackedStream(body)
+    response = post(stream)
+    assert response.status_code == 413
+    assert stream.read_bytes == 0
+    assert not any(path.is_file() for path in (tmp_path / "uploads").rglob("*"))
+    assert usage(app, user_id) == 0
+
+    # The archive's reservation is released once it is saved; the import charges the files it stores
+    set_quota(app, user_id, 0)
+    response = post(TrackedStream(body))
+    assert response.status_code == 202
+    assert usage(app, user_id) == 0
+    with app.app_context():
+        job = run_import(response.get_json()["job"]["id"], previews=False)
+        assert job.status == "completed"
+        imported = job.bytes_imported
+    assert usage(app, user_id) == imported > 0
@@ -0,0 +1,105 @@
+"""Read-replica routing against a primary and a replica database.
+
+The replica is a copy of the primary's file, refreshed only when a test
+calls replicate(), so a read shows which database served it.
+"""
+
+import shutil
+import sqlite3
+
+import pytest
+
+from replicas import STICKY_COOKIE
+from tests.conftest import create_user
+
+
+@pytest.fixture
+def routed(tmp_path, make_app):
+    """An application reading from a replica of its database, with one user; returns (app, headers, replicate)."""
+    primary, replica = tmp_path / "primary.db", tmp_path / "replica.db"
+
+    def make(replica_url: str = f"sqlite:///{replica}", **settings):
+        make_app(SQLALCHEMY_DATABASE_URI=f"sqlite:///{primary}")  # Migrates the primary
+        app = make_app(
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{primary}",
+            DATABASE_REPLICA_URLS=replica_url,
+            DB_AUTO_MIGRATE=False,
+            **settings,
+        )
+        _, headers = create_user(app)
+        replicate = lambda: shutil.copyfile(primary, replica)  # noqa: E731
+        replicate()
+        return app, headers, replicate
+    return make
+
+
+def dataroom_names(response) -> list[str]:
+    assert response.status_code == 200
+    return [dataroom["name"] for dataroom in response.get_json()["datarooms"]]
+
+
+def test_reads_go_to_replica_and_writes_to_primary(routed):
+    app, headers, replicate = routed()
+    client = app.test_client()
+    assert client.post("/api/datarooms", json={"name": "Deal"}, headers=headers).status_code == 201
+
+    # Another client reads the replica, which does not have the new dataroom yet
+    assert dataroom_names(app.test_client().get("/api/datarooms", headers=headers)) == []
+
+    # Once replicated, it does
+    replicate()
+    assert dataroom_names(app.test_client().get("/api/datarooms", headers=headers)) == ["Deal"]
+
+
+def test_writing_client_reads_its_writes_from_primary(routed):
+    app, headers, _ = routed()
+    client = app.test_client()
+    client.post("/api/datarooms", json={"name": "Deal"}, headers=headers)
+
+    assert client.get_cookie(STICKY_COOKIE) is not None
+    assert dataroom_names(client.get("/api/datarooms", headers=headers)) == ["Deal"]
+
+
+def test_sticky_reads_expire(routed):
+    app, headers, _ = routed(REPLICA_STICKY_SECONDS=0)
+    client = app.test_client()
+    client.post("/api/datarooms", json={"name": "Deal"}, headers=headers)
+
+    assert dataroom_names(client.get("/api/datarooms", headers=headers)) == []
+
+
+def test_failed_writes_do_not_stick_to_primary(routed):
+    app, headers, _ = routed()
+    client = app.test_client()
+    assert client.post("/api/datarooms", json={}, headers=headers).status_code == 400
+
+    assert client.get_cookie(STICKY_COOKIE) is None
+
+
+def test_unreachable_replica_falls_back_to_primary(routed, tmp_path):
+    app, headers, _ = routed(replica_url=f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    app.test_client().post("/api/datarooms", json={"name": "Deal"}, headers=headers)
+
+    assert dataroom_names(app.test_client().get("/api/datarooms", headers=headers)) == ["Deal"]
+    replica = app.extensions["replicas"].replicas[0]
+    assert not replica.healthy and replica.error
+
+
+def test_lagging_replica_is_skipped(routed):
+    # Any measured lag exceeds a negative limit
+    app, headers, _ = routed(REPLICA_MAX_LAG=-1)
+    app.test_client().post("/api/datarooms", json={"name": "Deal"}, headers=headers)
+
+    assert dataroom_names(app.test_client().get("/api/datarooms", headers=headers)) == ["Deal"]
+    replica = app.extensions["replicas"].replicas[0]
+    assert not replica.healthy and "lag" in replica.error
+
+
+def test_replica_failure_mid_request_is_retried_on_primary(routed, tmp_path):
+    app, headers, _ = routed()
+    app.test_client().post("/api/datarooms", json={"name": "Deal"}, headers=headers)
+    with sqlite3.connect(tmp_path / "replica.db") as connection:
+        connection.execute("DROP TABLE permissions")  # The listing's query now fails on the replica
+
+    assert dataroom_names(app.test_client().get("/api/datarooms", headers=headers)) == ["Deal"]
+    assert not app.extensions["replicas"].replicas[0].healthy
@@ -0,0 +1,171 @@
+"""Name and content search."""
+
+import pytest
+
+from tests.conftest import create_user
+
+
+@pytest.fixture
+def dataroom(app, client, auth, upload):
+    """A dataroom with /Legal/nda.pdf and /Finance/teaser.pdf; returns its id."""
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    for folder, name, text in (
+        ("Legal", "nda.pdf", "confidential merger terms"),
+        ("Finance", "teaser.pdf", "quarterly revenue and merger"),
+    ):
+        created = client.post("/api/folders", json={"name": folder, "dataroom_id": dataroom}, headers=auth).get_json()
+        assert upload(auth, dataroom, [text], name, created["folder"]["id"]).status_code == 201
+    return dataroom
+
+
+def search(client, headers: dict, q: str, **params):
+    response = client.get("/api/search", query_string={"q": q, **params}, headers=headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    response.close()  # Releases the admission slot of the streamed results
+    return body
+
+
+def test_name_and_content_matches(client, auth, dataroom):
+    body = search(client, auth, "merger")
+    assert [(result["name"], result["match_type"]) for result in body["results"]] == [
+        ("nda.pdf", ["content"]), ("teaser.pdf", ["content"]),
+    ]
+    assert not body["truncated"]
+
+    body = search(client, auth, "finance")
+    assert [(result["type"], result["name"]) for result in body["results"]] == [("folder", "Finance")]
+
+
+def test_content_falls_back_to_matching_inside_words(client, auth, dataroom):
+    body = search(client, auth, "merg")
+    assert [result["name"] for result in body["results"]] == ["nda.pdf", "teaser.pdf"]
+    assert body["content_match"] == "word_prefix"
+
+    # Nothing starts with the query, so words are matched anywhere inside
+    body = search(client, auth, "erger")
+    assert [result["name"] for result in body["results"]] == ["nda.pdf", "teaser.pdf"]
+    assert body["content_match"] == "substring"
+    assert [result["name"] for result in search(client, auth, "fidential merger")["results"]] == ["nda.pdf"]
+    assert search(client, auth, "fidential terms")["results"] == []
+
+    assert search(client, auth, "teaser", search_content="false")["content_match"] is None
+
+
+def test_contract_is_found_by_tract(client, auth, upload):
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    upload(auth, dataroom, ["Signed share purchase contract"], "spa.pdf")
+
+    body = search(client, auth, "tract")
+    assert [(result["name"], result["match_type"]) for result in body["results"]] == [("spa.pdf", ["content"])]
+    assert body["content_match"] == "substring"
+
+
+def test_phrases_are_confirmed_against_the_text(client, auth, dataroom):
+    assert [result["name"] for result in search(client, auth, "merger terms")["results"]] == ["nda.pdf"]
+    assert search(client, auth, "terms merger")["results"] == []
+
+
+def test_results_are_limited_to_granted_folders(app, client, auth, dataroom):
+    legal = client.get(f"/api/datarooms/{dataroom}/resolve", query_string={"path": "/Legal"}, headers=auth).get_json()
+    _, viewer = create_user(app, "viewer@example.com")
+    client.post(
+        f"/api/datarooms/{dataroom}/members",
+        json={"email": "viewer@example.com", "role": "viewer", "folder_id": legal["folder"]["id"]},
+        headers=auth,
+    )
+
+    assert [result["name"] for result in search(client, viewer, "merger")["results"]] == ["nda.pdf"]
+
+
+def test_text_is_stored_compressed_with_its_terms(app, dataroom):
+    from sqlalchemy import inspect, select
+    from models import db, File, FileTerm
+    from text_store import load_texts
+
+    with app.app_context():
+        assert "content_text" not in {column["name"] for column in inspect(db.engine).get_columns("files")}
+        file_id = db.session.execute(select(File.id).where(File.name == "nda.pdf")).scalar_one()
+        assert load_texts([file_id])[file_id].split() == ["confidential", "merger", "terms"]
+        terms = db.session.execute(select(FileTerm.term).where(FileTerm.file_id == file_id)).scalars()
+        assert sorted(terms) == ["confidential", "merger", "terms"]
+
+
+def test_migration_compresses_existing_texts(app, client, auth, dataroom):
+    from alembic import command
+    from sqlalchemy import text
+    from migrate import get_alembic_config
+    from models import db
+
+    with app.app_context(), db.engine.connect() as connection:
+        command.downgrade(get_alembic_config(connection), "0003")
+        texts = connection.execute(text("SELECT name, content_text FROM files ORDER BY name")).all()
+        connection.commit()  # Alembic must own the transactions
+        assert [(name, content.split()) for name, content in texts] == [
+            ("nda.pdf", ["confidential", "merger", "terms"]), ("teaser.pdf", ["quarterly", "revenue", "and", "merger"]),
+        ]
+        command.upgrade(get_alembic_config(connection), "head")
+        connection.commit()
+
+    assert [result["name"] for result in search(client, auth, "merger terms")["results"]] == ["nda.pdf"]
+
+
+def test_fuzzy_names_tolerate_typos(client, auth, dataroom):
+    body = search(client, auth, "teasr", fuzzy="true", search_content="false")
+    assert [result["name"] for result in body["results"]] == ["teaser.pdf"]
+    assert 0 < body["results"][0]["score"] <= 1
+
+    body = search(client, auth, "finanse", fuzzy="true", search_content="false")
+    assert [(result["type"], result["name"]) for result in body["results"]] == [("folder", "Finance")]
+
+    response = client.get("/api/search/autocomplete", query_string={"q": "teasr", "fuzzy": "true"}, headers=auth)
+    assert [suggestion["name"] for suggestion in response.get_json()["suggestions"]] == ["teaser.pdf"]
+
+
+def test_fuzzy_index_follows_renames_and_deletes(client, auth, dataroom):
+    [teaser] = search(client, auth, "teasr", fuzzy="true", search_content="false")["results"]
+
+    client.put(f"/api/files/{teaser['id']}", json={"name": "investor memo"}, headers=auth)
+    body = search(client, auth, "invester memo", fuzzy="true", search_content="false")
+    assert [result["name"] for result in body["results"]] == ["investor memo.pdf"]
+    assert search(client, auth, "teasr", fuzzy="true", search_content="false")["results"] == []
+
+    client.delete(f"/api/files/{teaser['id']}", headers=auth)
+    assert search(client, auth, "invester memo", fuzzy="true", search_content="false")["results"] == []
+
+
+def test_phrase_scan_stops_at_the_budget(make_app):
+    app = make_app(SEARCH_MAX_SCANNED_FILES=100)
+    _, headers = create_user(app)
+    client = app.test_client()
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=headers).get_json()["dataroom"]["id"]
+    with app.app_context():
+        from models import db, File
+        from text_store import store_texts
+
+        files = [
+            File(name=f"report {i:03}.pdf", original_name="report.pdf", dataroom_id=dataroom,
+                 file_path=f"{dataroom}/{i}.pdf", file_size=1, mime_type="application/pdf")
+            for i in range(120)
+        ]
+        db.session.add_all(files)
+        db.session.flush()
+        # Every file has both words, none the phrase
+        store_texts((file.id, "terms of the merger") for file in files)
+        db.session.commit()
+
+    body = search(client, headers, "merger terms", search_names="false")
+    assert body["results"] == []
+    assert body["truncated"]
+
+
+def test_pages_are_sliced_from_the_compressed_text(client, auth, upload):
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    file = upload(auth, dataroom, ["first page", "second page", "third page"]).get_json()["file"]
+
+    pages = client.get(f"/api/files/{file['id']}/pages", headers=auth).get_json()["pages"]
+    assert [(page["page_number"], page["content_text"].strip()) for page in pages] == [
+        (1, "first page"), (2, "second page"), (3, "third page"),
+    ]
+    [page] = client.get(f"/api/files/{file['id']}/pages", query_string={"page": 2}, headers=auth).get_json()["pages"]
+    assert page["content_text"].strip() == "second page"
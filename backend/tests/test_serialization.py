@@ -0,0 +1,115 @@
+"""Streamed JSON encoding of large listings."""
+
+import json
+from datetime import datetime
+
+import serialization
+from serialization import iter_json
+
+
+def test_generators_are_encoded_as_lists():
+    created = datetime(2026, 1, 2, 3, 4, 5, 678)
+    value = {
+        "name": "Deal",
+        "folders": ({"id": i, "created_at": created, "files": (n for n in range(i))} for i in range(3)),
+        "empty": (n for n in ()),
+    }
+
+    assert json.loads(b"".join(iter_json(value))) == {
+        "name": "Deal",
+        "folders": [{"id": i, "created_at": created.isoformat(), "files": list(range(i))} for i in range(3)],
+        "empty": [],
+    }
+
+
+def test_json_fallback_encodes_like_orjson(monkeypatch):
+    value = {"name": "Ünïcode", "size": 2 ** 40, "created_at": datetime(2026, 1, 2, 3, 4, 5, 678), "none": None}
+    encoded = serialization.dumps(value)
+    monkeypatch.setattr(serialization, "orjson", None)
+
+    assert json.loads(serialization.dumps(value)) == json.loads(encoded)
+
+
+def test_first_chunk_is_sent_before_the_listing_is_consumed(monkeypatch):
+    monkeypatch.setattr(serialization, "STREAM_CHUNK_SIZE", 256)
+    produced = []
+
+    def rows():
+        for i in range(1000):
+            produced.append(i)
+            yield {"id": i, "name": f"file {i}"}
+
+    chunks = iter_json({"items": rows()})
+    first = next(chunks)
+
+    assert len(first) >= 256
+    assert len(produced) < 20  # Only the rows of the first chunk were built
+    body = first + b"".join(chunks)
+    assert len(produced) == 1000
+    assert [item["id"] for item in json.loads(body)["items"]] == list(range(1000))
+
+
+def test_responses_are_encoded_within_the_request_context(app):
+    from flask import g
+    from serialization import json_response
+
+    def rows():
+        yield g.marker  # Rows are read from the session, which lives in the context
+
+    with app.test_request_context():
+        g.marker = "row"
+        response = json_response({"rows": rows()})
+    assert json.loads(response.get_data()) == {"rows": ["row"]}
+    response.close()
+
+
+def test_structure_is_streamed_with_rows_matching_file_details(client, auth, upload):
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    legal = client.post("/api/folders", json={"name": "Legal", "dataroom_id": dataroom}, headers=auth).get_json()
+    year = client.post(
+        "/api/folders", json={"name": "2024", "dataroom_id": dataroom, "parent_id": legal["folder"]["id"]},
+        headers=auth,
+    ).get_json()
+    nested = upload(auth, dataroom, ["one", "two"], "nda.pdf", year["folder"]["id"]).get_json()["file"]
+    upload(auth, dataroom, ["three"], "teaser.pdf")
+
+    response = client.get(f"/api/datarooms/{dataroom}/structure", headers=auth)
+    assert response.status_code == 200
+    assert response.is_streamed
+    body = response.get_json()
+
+    [root] = body["structure"]
+    [child] = root["children"]
+    assert (root["name"], root["files"], child["name"]) == ("Legal", [], "2024")
+    assert (root["file_count"], root["folder_count"], root["total_size"]) == (1, 1, nested["file_size"])
+    assert [file["name"] for file in body["root_files"]] == ["teaser.pdf"]
+    # Rows selected as plain columns serialize exactly like the ORM objects
+    assert child["files"] == [client.get(f"/api/files/{nested['id']}", headers=auth).get_json()["file"]]
+
+
+def test_folder_listings_stream_files_sorted_like_the_tree_index(app, make_app, client, auth, upload, monkeypatch):
+    from routes.folders import SORT_KEYS
+
+    monkeypatch.setattr(serialization, "CURSOR_BATCH_SIZE", 2)  # Several fetches per listing
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    legal = client.post("/api/folders", json={"name": "Legal", "dataroom_id": dataroom}, headers=auth).get_json()
+    folder_id = legal["folder"]["id"]
+    client.post("/api/folders", json={"name": "2024", "dataroom_id": dataroom, "parent_id": folder_id}, headers=auth)
+    for name, pages in (("b.pdf", ["one"]), ("A.pdf", ["one", "two", "three"]), ("c.pdf", ["one", "two"]), ("D.pdf", ["one"])):
+        assert upload(auth, dataroom, pages, name, folder_id).status_code == 201
+
+    # Same database, listed by SQL instead of the in-memory tree index
+    sql_client = make_app(TREE_INDEX_MAX_NODES=0).test_client()
+    for sort in SORT_KEYS:
+        for order in ("asc", "desc"):
+            url = f"/api/folders/{folder_id}/contents?sort={sort}&order={order}"
+            response = sql_client.get(url, headers=auth)
+            assert response.is_streamed
+            listed = response.get_json()
+            assert listed == client.get(url, headers=auth).get_json(), url
+    assert [file["name"] for file in listed["files"]] == ["D.pdf", "c.pdf", "A.pdf", "b.pdf"]  # Newest first
+
+    detail = sql_client.get(f"/api/folders/{folder_id}", headers=auth).get_json()
+    assert detail == client.get(f"/api/folders/{folder_id}", headers=auth).get_json()
+    assert [child["name"] for child in detail["folder"]["children"]] == ["2024"]
+    assert [file["name"] for file in detail["folder"]["files"]] == ["A.pdf", "D.pdf", "b.pdf", "c.pdf"]
@@ -0,0 +1,80 @@
+"""Folder-scoped sharing: what members of a single folder can reach."""
+
+import pytest
+
+from tests.conftest import create_user
+
+
+@pytest.fixture
+def shared(app, client, auth):
+    """A dataroom with folders /Legal and /Finance and a viewer of /Legal; returns (dataroom id, viewer headers)."""
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    legal = client.post("/api/folders", json={"name": "Legal", "dataroom_id": dataroom}, headers=auth).get_json()
+    client.post("/api/folders", json={"name": "Finance", "dataroom_id": dataroom}, headers=auth)
+    _, viewer = create_user(app, "viewer@example.com")
+    client.post(
+        f"/api/datarooms/{dataroom}/members",
+        json={"email": "viewer@example.com", "role": "viewer", "folder_id": legal["folder"]["id"]},
+        headers=auth,
+    )
+    return dataroom, viewer
+
+
+def resolve(client, dataroom: int, path: str, headers: dict):
+    return client.get(f"/api/datarooms/{dataroom}/resolve", query_string={"path": path}, headers=headers)
+
+
+def test_resolve_granted_folder(client, shared):
+    dataroom, viewer = shared
+    response = resolve(client, dataroom, "/Legal", viewer)
+
+    assert response.status_code == 200
+    assert [crumb["path"] for crumb in response.get_json()["breadcrumbs"]] == ["/Legal"]
+
+
+def test_resolve_hides_forbidden_and_missing_folders_alike(client, shared):
+    dataroom, viewer = shared
+    for path in ("/Finance", "/Nowhere", "/Legal/Nowhere"):
+        assert resolve(client, dataroom, path, viewer).status_code == 404
+
+
+def test_resolve_checks_access_before_loading_the_tree(app, client, shared):
+    dataroom, _ = shared
+    _, stranger = create_user(app, "stranger@example.com")
+    trees = app.extensions["tree_index"]
+    trees._trees.clear()
+
+    assert resolve(client, dataroom, "/Legal", stranger).status_code == 404
+    assert dataroom not in trees._trees
+
+
+def test_folder_names_cannot_reach_another_subtree(app, client, auth):
+    """A "/" in a renamed folder would move its editor's grant onto another folder's path."""
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+    secret = client.post("/api/folders", json={"name": "Secret", "dataroom_id": dataroom}, headers=auth).get_json()
+    sub = client.post(
+        "/api/folders", json={"name": "Sub", "dataroom_id": dataroom, "parent_id": secret["folder"]["id"]}, headers=auth,
+    ).get_json()["folder"]["id"]
+    drafts = client.post("/api/folders", json={"name": "Drafts", "dataroom_id": dataroom}, headers=auth).get_json()
+    drafts = drafts["folder"]["id"]
+    _, editor = create_user(app, "editor@example.com")
+    client.post(
+        f"/api/datarooms/{dataroom}/members",
+        json={"email": "editor@example.com", "role": "editor", "folder_id": drafts},
+        headers=auth,
+    )
+
+    for name in ("Secret/Sub", "/Secret/Sub", ".", "..", " "):
+        assert client.put(f"/api/folders/{drafts}", json={"name": name}, headers=editor).status_code == 400
+        response = client.post(
+            "/api/folders", json={"name": name, "dataroom_id": dataroom, "parent_id": drafts}, headers=editor,
+        )
+        assert response.status_code == 400
+    batch = client.post(
+        "/api/batch", json={"operations": [{"op": "rename", "type": "folder", "id": drafts, "name": "Secret/Sub"}]},
+        headers=editor,
+    ).get_json()
+    assert batch["results"][0]["status"] == 400
+
+    assert client.get(f"/api/folders/{drafts}", headers=editor).get_json()["folder"]["path"] == "/Drafts"
+    assert client.get(f"/api/folders/{sub}", headers=editor).status_code == 403
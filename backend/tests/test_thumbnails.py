@@ -0,0 +1,73 @@
+"""Page counts and thumbnails of uploaded files."""
+
+import io
+
+import pytest
+
+import thumbnails
+
+
+@pytest.fixture
+def pdf(app, client, auth, upload):
+    """Upload a PDF of the given pages; returns the file as created, with its storage key."""
+    dataroom = client.post("/api/datarooms", json={"name": "Deal"}, headers=auth).get_json()["dataroom"]["id"]
+
+    def pdf(pages: list[str]) -> dict:
+        response = upload(auth, dataroom, pages)
+        assert response.status_code == 201
+        file = response.get_json()["file"]
+        with app.app_context():
+            from models import db, File
+            file["file_path"] = db.session.get(File, file["id"]).file_path
+        return file
+
+    return pdf
+
+
+def stored(app, file: dict) -> bool:
+    from storage import get_storage
+
+    with app.app_context():
+        return get_storage().exists(thumbnails.get_thumbnail_key(file["file_path"]))
+
+
+def test_page_count_is_set_at_upload(app, pdf):
+    file = pdf(["one", "two", "three"])
+    assert file["page_count"] == 3
+
+    with app.app_context():
+        thumbnails.generate_preview(file["id"])
+    with app.app_context():
+        from models import db, File
+        preview = db.session.get(File, file["id"])
+        assert (preview.page_count, preview.thumbnail_path) == (3, thumbnails.get_thumbnail_key(file["file_path"]))
+    assert stored(app, file)
+
+
+def test_file_deleted_while_rendering_leaves_no_thumbnail(app, client, auth, pdf, monkeypatch):
+    file = pdf(["one"])
+    engine = None
+
+    class DeletingEngine:
+        def run(self, func, *args):
+            engine.run(func, *args)
+            assert client.delete(f"/api/files/{file['id']}", headers=auth).status_code == 200
+
+    with app.app_context():
+        from extraction import get_extraction_engine
+        engine = get_extraction_engine()
+        monkeypatch.setattr(thumbnails, "get_extraction_engine", DeletingEngine)
+        thumbnails.generate_preview(file["id"])
+
+    assert not stored(app, file)
+
+
+def test_delete_removes_an_unrecorded_thumbnail(app, client, auth, pdf):
+    file = pdf(["one"])
+    from storage import get_storage
+
+    with app.app_context():
+        get_storage().save(io.BytesIO(b"jpeg"), thumbnails.get_thumbnail_key(file["file_path"]))
+
+    assert client.delete(f"/api/files/{file['id']}", headers=auth).status_code == 200
+    assert not stored(app, file)
@@ -0,0 +1,183 @@
+"""Compressed storage and word index of extracted file text.
+
+Extracted text is the bulk of the database but is rarely needed in full, so
+it is kept out of the files table:
+
+- file_contents holds each file's text as one zstd frame, compressed with
+  the newest dictionary in content_dictionaries. Dictionaries are trained on
+  the deployment's own documents (`flask content-train-dictionary`), which
+  pays off most on the many short documents plain zstd compresses poorly.
+  Frames keep a reference to the dictionary they were made with, and
+  dictionaries never change, so they are cached per process.
+- file_terms holds the distinct lowercase words of each text. Content search
+  looks the query's words up there and only decompresses the candidates when
+  the exact phrase has to be confirmed.
+
+Content matches start at a word boundary: "contr" finds "contract". Only
+when that finds nothing does search fall back to matching inside words
+("tract" finds "contract"), which has to scan the terms rather than look
+them up.
+"""
+
+import re
+import threading
+from typing import Iterable, Optional
+
+import zstandard
+from flask import current_app
+from sqlalchemy import and_, delete, func, insert, select
+
+from models import db, ContentDictionary, File, FileContent, FileTerm
+
+MAX_TERM_LENGTH = 64  # Longer words are indexed by their first characters
+TRAINING_CHUNK_SIZE = 16384  # Bytes of text per dictionary training sample
+TRAINING_CHUNKS_PER_FILE = 8
+
+_WORD_RE = re.compile(r"\w+")
+_MAX_CHAR = "\U0010ffff"  # Sorts after any character a term can continue with
+
+_dictionaries: dict[int, zstandard.ZstdCompressionDict] = {}
+_dictionaries_lock = threading.Lock()
+
+
+def extract_terms(text: str) -> set[str]:
+    """Get the distinct lowercase words of a text, as indexed in file_terms."""
+    return {word[:MAX_TERM_LENGTH] for word in _WORD_RE.findall(text.lower())}
+
+
+def get_dictionary(dictionary_id: int) -> zstandard.ZstdCompressionDict:
+    """Load a dictionary (cached per process)."""
+    with _dictionaries_lock:
+        dictionary = _dictionaries.get(dictionary_id)
+    if dictionary is None:
+        data = db.session.execute(
+            select(ContentDictionary.data).where(ContentDictionary.id == dictionary_id)
+        ).scalar_one()
+        dictionary = zstandard.ZstdCompressionDict(data)
+        with _dictionaries_lock:
+            _dictionaries[dictionary_id] = dictionary
+    return dictionary
+
+
+def get_current_dictionary_id() -> Optional[int]:
+    """Get the id of the dictionary new texts are compressed with (None if none was trained)."""
+    return db.session.execute(select(func.max(ContentDictionary.id))).scalar()
+
+
+def compress_texts(texts: Iterable[str], dictionary_id: Optional[int] = None) -> list[bytes]:
+    """Compress texts to zstd frames, with a dictionary if given."""
+    level = current_app.config["CONTENT_COMPRESSION_LEVEL"]
+    if dictionary_id is None:
+        compressor = zstandard.ZstdCompressor(level=level)
+    else:
+        compressor = zstandard.ZstdCompressor(level=level, dict_data=get_dictionary(dictionary_id))
+    return [compressor.compress(text.encode(errors="replace")) for text in texts]
+
+
+def decompress_text(data: bytes, dictionary_id: Optional[int] = None) -> str:
+    """Decompress a frame made by compress_texts."""
+    if dictionary_id is None:
+        decompressor = zstandard.ZstdDecompressor()
+    else:
+        decompressor = zstandard.ZstdDecompressor(dict_data=get_dictionary(dictionary_id))
+    return decompressor.decompress(data).decode()
+
+
+def store_texts(documents: Iterable[tuple[int, Optional[str]]]) -> int:
+    """Replace the stored text and terms of files in the current session.
+
+    Files without text get neither. Returns the number of texts stored.
+    """
+    documents = list(documents)
+    if not documents:
+        return 0
+
+    file_ids = [file_id for file_id, _ in documents]
+    db.session.execute(delete(FileTerm).where(FileTerm.file_id.in_(file_ids)))
+    db.session.execute(delete(FileContent).where(FileContent.file_id.in_(file_ids)))
+
+    documents = [(file_id, text) for file_id, text in documents if text]
+    if not documents:
+        return 0
+    dictionary_id = get_current_dictionary_id()
+    frames = compress_texts((text for _, text in documents), dictionary_id)
+    db.session.execute(insert(FileContent), [
+        {"file_id": file_id, "dictionary_id": dictionary_id, "data": frame, "text_size": len(text.encode(errors="replace"))}
+        for (file_id, text), frame in zip(documents, frames)
+    ])
+    terms = [{"term": term, "file_id": file_id} for file_id, text in documents for term in extract_terms(text)]
+    if terms:
+        db.session.execute(insert(FileTerm), terms)
+    return len(documents)
+
+
+def load_texts(file_ids: Iterable[int]) -> dict[int, str]:
+    """Load and decompress the text of files (files without text are left out)."""
+    rows = db.session.execute(
+        select(FileContent.file_id, FileContent.dictionary_id, FileContent.data)
+        .where(FileContent.file_id.in_(list(file_ids)))
+    ).all()
+    decompressors = {}
+    texts = {}
+    for row in rows:
+        decompressor = decompressors.get(row.dictionary_id)
+        if decompressor is None:
+            dict_data = None if row.dictionary_id is None else get_dictionary(row.dictionary_id)
+            decompressor = decompressors[row.dictionary_id] = zstandard.ZstdDecompressor(dict_data=dict_data)
+        texts[row.file_id] = decompressor.decompress(row.data).decode()
+    return texts
+
+
+def match_condition(query: str, substring: bool = False):
+    """SQL condition on File selecting the files whose words could contain a query.
+
+    Every word of the query but the last must be a word of the file, the last
+    a prefix of one. With `substring`, the first word may also end a word, or
+    a single word lie anywhere inside one. Returns None if the query has no words.
+    """
+    words = [word[:MAX_TERM_LENGTH] for word in _WORD_RE.findall(query.lower())]
+    if not words:
+        return None
+    conditions = [FileTerm.term == word for word in words[:-1]]
+    # Prefix range rather than LIKE, so both databases use the primary key index
+    conditions.append(and_(FileTerm.term >= words[-1], FileTerm.term < words[-1] + _MAX_CHAR))
+    if substring:
+        first = words[0]
+        conditions[0] = (
+            FileTerm.term.contains(first, autoescape=True) if len(words) == 1
+            else FileTerm.term.endswith(first, autoescape=True)
+        )
+    return and_(*(File.id.in_(select(FileTerm.file_id).where(condition)) for condition in conditions))
+
+
+def confirm_matches(query: str, file_ids: list[int], case_insensitive: bool = True) -> set[int]:
+    """Get the files among match_condition candidates whose text contains a query."""
+    if case_insensitive and len(query) <= MAX_TERM_LENGTH and _WORD_RE.fullmatch(query):
+        return set(file_ids)  # A single word is matched by its terms alone
+    if not case_insensitive:
+        return {file_id for file_id, text in load_texts(file_ids).items() if query in text}
+    needle = query.lower()
+    return {file_id for file_id, text in load_texts(file_ids).items() if needle in text.lower()}
+
+
+def train_dictionary(texts: Iterable[str], size: int) -> Optional[ContentDictionary]:
+    """Train a dictionary on sample texts and add it to the session.
+
+    Returns None if the samples are too few or too small to train on.
+    """
+    samples = []
+    for text in texts:
+        data = text.encode(errors="replace")
+        samples.extend(
+            data[start:start + TRAINING_CHUNK_SIZE]
+            for start in range(0, min(len(data), TRAINING_CHUNK_SIZE * TRAINING_CHUNKS_PER_FILE), TRAINING_CHUNK_SIZE)
+        )
+    try:
+        trained = zstandard.train_dictionary(size, samples)
+    except zstandard.ZstdError as e:
+        current_app.logger.warning(f"Could not train a content dictionary: {e}")
+        return None
+
+    dictionary = ContentDictionary(data=trained.as_bytes(), sample_count=len(samples))
+    db.session.add(dictionary)
+    return dictionary
@@ -0,0 +1,114 @@
+"""First-page thumbnails for uploaded PDFs."""
+
+import importlib.util
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from flask import current_app
+from sqlalchemy import func, select, update
+
+from models import db, File, FilePage
+from acl import folder_path
+from changes import record_change
+from extraction import get_extraction_engine
+from storage import StorageBackend, get_storage
+
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+
+
+def get_thumbnail_key(file_path: str) -> str:
+    """Get the storage key of a blob's thumbnail (stored next to the blob)."""
+    return f"{os.path.splitext(file_path)[0]}{THUMBNAIL_SUFFIX}"
+
+
+def rendering_available() -> bool:
+    """Check whether thumbnails can be rendered (pypdfium2 is optional)."""
+    return importlib.util.find_spec("pypdfium2") is not None
+
+
+def _render_thumbnail(path: str, output_path: str, max_size: int) -> None:
+    """Render the first page of a PDF as a JPEG (runs in a worker process)."""
+    import pypdfium2 as pdfium
+
+    # PDFium reads the file on demand, so only the objects needed for the
+    # first page are loaded
+    document = pdfium.PdfDocument(Path(path))
+    try:
+        page = document[0]
+        scale = max_size / max(page.get_size())
+        image = page.render(scale=scale).to_pil().convert("RGB")
+        image.thumbnail((max_size, max_size))
+        image.save(output_path, "JPEG", quality=80, optimize=True)
+    finally:
+        document.close()
+
+
+def generate_preview(file_id: int) -> None:
+    """Render the thumbnail for a stored file.
+
+    The page count is recorded at extraction; files extracted before that
+    get it from their stored pages.
+    """
+    file = db.session.get(File, file_id)
+    if not file:
+        return
+
+    page_count = file.page_count
+    if page_count is None:
+        page_count = db.session.execute(
+            select(func.count()).select_from(FilePage).where(FilePage.file_id == file.id)
+        ).scalar() or None
+
+    storage = get_storage()
+    thumbnail_key = None
+    if rendering_available():
+        fd, output_path = tempfile.mkstemp(dir=storage.staging_dir(), suffix=THUMBNAIL_SUFFIX)
+        os.close(fd)
+        try:
+            with storage.local_path(file.file_path) as blob_path:
+                get_extraction_engine().run(
+                    _render_thumbnail, blob_path, output_path, current_app.config["THUMBNAIL_MAX_SIZE"]
+                )
+            thumbnail_key = get_thumbnail_key(file.file_path)
+            storage.put_file(Path(output_path), thumbnail_key)
+        except Exception as e:
+            current_app.logger.warning(f"Failed to generate preview for file {file_id}: {type(e).__name__}: {e}")
+            thumbnail_key = None
+        finally:
+            Path(output_path).unlink(missing_ok=True)
+
+    if thumbnail_key is None and page_count == file.page_count:
+        return
+
+    values = {"page_count": page_count}
+    if thumbnail_key:
+        values["thumbnail_path"] = thumbnail_key
+    # The file may have been deleted while rendering; only a row that still
+    # exists gets the thumbnail, otherwise the blob is removed here
+    result = db.session.execute(
+        update(File).where(File.id == file_id).values(**values).execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        db.session.rollback()
+        if thumbnail_key:
+            storage.delete(thumbnail_key)
+        return
+
+    db.session.refresh(file)
+    record_change(file.dataroom_id, "file", file.id, "updated", file.to_dict(), path=folder_path(file))
+    db.session.commit()
+
+
+def delete_thumbnail(file_path: str, storage: StorageBackend, thumbnail_path: Optional[str] = None) -> None:
+    """Delete the thumbnail of a blob from storage.
+
+    The key is derived from the blob, so a thumbnail rendered after the file
+    row was read is removed as well.
+    """
+    keys = {get_thumbnail_key(file_path)}
+    if thumbnail_path:
+        keys.add(thumbnail_path)
+    for key in keys:
+        storage.delete(key)
@@ -0,0 +1,211 @@
+"""Process-local index of dataroom folder trees.
+
+Navigating a dataroom reads its tree over and over between changes. Each
+process keeps the trees of recently used datarooms in memory as compact
+nodes (classes with __slots__, so no per-node dict), loaded with two
+column-only queries and with subtree totals rolled up once:
+
+- every read compares the tree's version with the dataroom's change cursor
+  (one index-only query). Mutations record a change event in their own
+  transaction, so a tree is reloaded exactly when its dataroom changed, in
+  any process;
+- child listings, subtree totals, path resolution and breadcrumbs are then
+  served from the nodes without ORM objects;
+- trees are evicted least recently used once the cached nodes exceed
+  TREE_INDEX_MAX_NODES (0 disables the index). Datarooms larger than that
+  are not indexed and callers fall back to querying.
+
+Nodes have the attributes of FOLDER_COLUMNS and FILE_COLUMNS rows, so the
+serializers in serialization.py encode them directly.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import select
+
+from models import db, File, Folder
+from acl import level_at
+from changes import get_latest_cursor
+from folder_stats import rollup_folder_stats
+from serialization import FILE_COLUMNS, FOLDER_COLUMNS
+
+
+class FileNode:
+    """A file of an indexed tree."""
+
+    __slots__ = tuple(column.key for column in FILE_COLUMNS)
+
+    def __init__(self, *values):
+        for slot, value in zip(self.__slots__, values):
+            setattr(self, slot, value)
+
+
+class FolderNode:
+    """A folder of an indexed tree, linked to its parent and children."""
+
+    __slots__ = tuple(column.key for column in FOLDER_COLUMNS) + (
+        "parent", "children", "files", "total_size", "file_count", "folder_count",
+    )
+
+    def __init__(self, *values):
+        for slot, value in zip(self.__slots__, values):
+            setattr(self, slot, value)
+        self.parent: Optional[FolderNode] = None
+        self.children: list[FolderNode] = []
+        self.files: list[FileNode] = []
+
+    @property
+    def stats(self) -> dict:
+        """Subtree totals, as returned by folder_stats."""
+        return {"total_size": self.total_size, "file_count": self.file_count, "folder_count": self.folder_count}
+
+
+class TreeIndex:
+    """The folders and files of one dataroom at one change cursor."""
+
+    __slots__ = ("dataroom_id", "version", "folders", "files", "paths", "roots", "root_files", "size")
+
+    def __init__(self, dataroom_id: int, version: int, folder_rows: Iterable, file_rows: Iterable):
+        self.dataroom_id = dataroom_id
+        self.version = version
+        # Rows come ordered by name, so children and files are too
+        self.folders = {row.id: FolderNode(*row) for row in folder_rows}
+        self.files = {row.id: FileNode(*row) for row in file_rows}
+        self.paths = {folder.path: folder for folder in self.folders.values()}
+        self.roots: list[FolderNode] = []
+        self.root_files: list[FileNode] = []
+
+        for folder in self.folders.values():
+            folder.parent = self.folders.get(folder.parent_id)
+            (folder.parent.children if folder.parent else self.roots).append(folder)
+        for file in self.files.values():
+            folder = self.folders.get(file.folder_id)
+            (folder.files if folder else self.root_files).append(file)
+
+        for folder_id, stats in rollup_folder_stats(self.folders.values(), self.files.values()).items():
+            folder = self.folders[folder_id]
+            folder.total_size = stats["total_size"]
+            folder.file_count = stats["file_count"]
+            folder.folder_count = stats["folder_count"]
+        self.size = len(self.folders) + len(self.files)
+
+
+def load_tree(dataroom_id: int, version: int) -> TreeIndex:
+    """Load the tree of a dataroom from the database."""
+    folders = db.session.execute(
+        select(*FOLDER_COLUMNS).where(Folder.dataroom_id == dataroom_id).order_by(Folder.name)
+    ).all()
+    files = db.session.execute(
+        select(*FILE_COLUMNS).where(File.dataroom_id == dataroom_id).order_by(File.name)
+    ).all()
+    return TreeIndex(dataroom_id, version, folders, files)
+
+
+def breadcrumbs(folder, prefixes: Optional[dict[str, int]] = None) -> list[dict]:
+    """List a folder and its ancestors (id, name, path) from the top level down.
+
+    With `prefixes` (see acl.get_user_prefixes), ancestors above the user's
+    grants are left out. Works on nodes and on ORM folders (one lazy load per
+    ancestor).
+    """
+    trail = []
+    while folder is not None:
+        if prefixes is None or level_at(prefixes, folder.path):
+            trail.append({"id": folder.id, "name": folder.name, "path": folder.path})
+        folder = folder.parent
+    return trail[::-1]
+
+
+class TreeIndexCache:
+    """Least recently used trees of a process, bounded by their total node count."""
+
+    def __init__(self, max_nodes: int):
+        self.max_nodes = max_nodes
+        self._trees: OrderedDict[int, TreeIndex] = OrderedDict()
+        self._nodes = 0
+        self._oversized: set[int] = set()  # Datarooms that did not fit when last loaded
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_nodes > 0
+
+    def get(self, dataroom_id: int, required: bool = False) -> Optional[TreeIndex]:
+        """Get the current tree of a dataroom.
+
+        Returns None if the index is disabled or the dataroom does not fit in
+        it, unless `required`, in which case an uncached tree is loaded.
+        """
+        if not required and (not self.enabled or dataroom_id in self._oversized):
+            return None
+
+        version = get_latest_cursor(dataroom_id)
+        with self._lock:
+            tree = self._trees.get(dataroom_id)
+            # A lagging replica may report an older cursor than the cached tree's
+            if tree is not None and tree.version >= version:
+                self._trees.move_to_end(dataroom_id)
+                return tree
+
+        tree = load_tree(dataroom_id, version)
+        self._store(tree)
+        return tree
+
+    def find_dataroom(self, folder_id: int) -> Optional[int]:
+        """Get the dataroom of a folder if a cached tree contains it."""
+        with self._lock:
+            for tree in self._trees.values():
+                if folder_id in tree.folders:
+                    return tree.dataroom_id
+        return None
+
+    def _store(self, tree: TreeIndex) -> None:
+        with self._lock:
+            previous = self._trees.get(tree.dataroom_id)
+            if previous is not None and previous.version > tree.version:
+                return  # A concurrent request already stored a newer tree
+            if previous is not None:
+                del self._trees[tree.dataroom_id]
+                self._nodes -= previous.size
+            if tree.size > self.max_nodes:
+                if self.enabled:
+                    self._oversized.add(tree.dataroom_id)
+                return
+
+            self._oversized.discard(tree.dataroom_id)
+            self._trees[tree.dataroom_id] = tree
+            self._nodes += tree.size
+            while self._nodes > self.max_nodes:
+                _, evicted = self._trees.popitem(last=False)
+                self._nodes -= evicted.size
+
+
+def init_tree_index(app: Flask) -> None:
+    """Create the tree index of an application."""
+    app.extensions["tree_index"] = TreeIndexCache(app.config["TREE_INDEX_MAX_NODES"])
+
+
+def get_tree(dataroom_id: int, required: bool = False) -> Optional[TreeIndex]:
+    """Get the current tree of a dataroom, see TreeIndexCache.get."""
+    return current_app.extensions["tree_index"].get(dataroom_id, required)
+
+
+def get_folder_tree(folder_id: int) -> Optional[TreeIndex]:
+    """Get the current tree of the dataroom containing a folder.
+
+    Returns None if the index cannot serve it (disabled, dataroom too large
+    or no such folder); the caller then queries as usual. The folder may be
+    missing from the returned tree if it was just deleted.
+    """
+    cache: TreeIndexCache = current_app.extensions["tree_index"]
+    if not cache.enabled:
+        return None
+    dataroom_id = cache.find_dataroom(folder_id)
+    if dataroom_id is None:
+        dataroom_id = db.session.execute(select(Folder.dataroom_id).where(Folder.id == folder_id)).scalar()
+        if dataroom_id is None:
+            return None
+    return cache.get(dataroom_id)